@@ -0,0 +1,152 @@
+# Answer statistics and answer index materialized at ingest time.
+# Counting answers or finding respondents by answer over the responses table means reading every row of a year,
+# so the dumper goes through the response file once and stores the totals in stackoverflow_answer_count and the
+# respondents of every answer value in stackoverflow_answer_posting.
+from ExampleStackOverflowRest import db, AnswerCount, AnswerPosting
+from SurveyFormat import UNANSWERED
+from array import array
+from collections import defaultdict
+from itertools import accumulate
+import csv
+import sys
+import zlib
+
+answer_count_table = AnswerCount.__table__
+answer_posting_table = AnswerPosting.__table__
+# Separator of multi-select answers, e.g. "Python;Rust;Go"
+MULTI_SELECT_SEPARATOR = ';'
+# Columns that aren't questions, every value would be counted once
+IGNORED_COLUMNS = {'Respondent'}
+# Rows per insert when saving the counts and postings
+INSERT_BATCH_SIZE = 5000
+# Postings hold unsigned 32 bit deltas, stored little endian whatever the host is
+POSTING_TYPECODE = 'I'
+
+
+def split_answer(answer):
+    """
+    Split an answer into the values it's made of. Multi-select answers give one value per selection.
+
+    :param answer: Answer as found in the response file
+    :return: List of values, empty for unanswered questions (see SurveyFormat.UNANSWERED)
+    """
+    if answer is None or answer in UNANSWERED:
+        return []
+    return [value for value in answer.split(MULTI_SELECT_SEPARATOR) if value not in UNANSWERED]
+
+
+def index_answers(path):
+    """
+    Find the respondents of every answer value of every question in a response file.
+
+    :param path: Path to the response CSV file
+    :return: Dict of (question, value) -> array of respondent IDs
+    """
+    postings = defaultdict(lambda: array(POSTING_TYPECODE))
+    with open(path, newline='', encoding='utf8') as file:
+        for d in csv.DictReader(file):
+            respondent_id = int(d['Respondent'])
+            for question, answer in d.items():
+                if question in IGNORED_COLUMNS:
+                    continue
+                for value in split_answer(answer):
+                    postings[question, value].append(respondent_id)
+    return postings
+
+
+def encode_respondents(respondent_ids):
+    """
+    Encode respondent IDs for storage: sorted, deduplicated, delta encoded and zlib compressed.
+    Neighbouring IDs are close to each other so most deltas are tiny and compress well.
+
+    :param respondent_ids: Iterable of respondent IDs
+    :return: Encoded bytes
+    """
+    respondent_ids = sorted(set(respondent_ids))
+    deltas = array(POSTING_TYPECODE, (current - previous for previous, current
+                                      in zip([0] + respondent_ids, respondent_ids)))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes())
+
+
+def decode_respondents(data):
+    """
+    Decode respondent IDs encoded by encode_respondents().
+
+    :param data: Encoded bytes
+    :return: Sorted list of respondent IDs
+    """
+    deltas = array(POSTING_TYPECODE)
+    deltas.frombytes(zlib.decompress(data))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return list(accumulate(deltas))
+
+
+def _insert_batches(connection, table, rows):
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        connection.execute(table.insert(), rows[i:i + INSERT_BATCH_SIZE])
+
+
+def save_answer_index(year, postings):
+    """
+    Replace the answer counts and postings of a year, in a single transaction.
+
+    :param year: Year of the survey
+    :param postings: Dict of (question, value) -> respondent IDs, as returned by index_answers()
+    :return: Amount of (question, value) rows saved
+    """
+    count_rows = []
+    posting_rows = []
+    for (question, value), respondent_ids in postings.items():
+        data = encode_respondents(respondent_ids)
+        count_rows.append({'year': year, 'question': question, 'value': value, 'count': len(set(respondent_ids))})
+        posting_rows.append({'year': year, 'question': question, 'value': value, 'respondents': data})
+    with db.engine.begin() as connection:
+        connection.execute(answer_count_table.delete().where(answer_count_table.c.year == year))
+        connection.execute(answer_posting_table.delete().where(answer_posting_table.c.year == year))
+        _insert_batches(connection, answer_count_table, count_rows)
+        _insert_batches(connection, answer_posting_table, posting_rows)
+    return len(count_rows)
+
+
+def materialize_answer_index(path, year):
+    """
+    Index the answers of a response file and save them as the answer counts and postings of the year.
+
+    :param path: Path to the response CSV file
+    :param year: Year of the survey
+    :return: Amount of (question, value) rows saved
+    """
+    return save_answer_index(year, index_answers(path))
+
+
+def match_respondents(postings, predicates, match_all=True):
+    """
+    Find the respondents matching answer predicates by combining their postings.
+    A predicate matches respondents that picked any of its values. The smallest postings are intersected first
+    so the work depends on the size of the postings, not on the amount of responses.
+
+    :param postings: Dict of (question, value) -> sorted respondent IDs, missing keys have no respondents
+    :param predicates: List of (question, [values]) tuples
+    :param match_all: True to keep respondents matching every predicate (AND), False for any of them (OR)
+    :return: Sorted list of respondent IDs
+    """
+    matches = []
+    for question, values in predicates:
+        match = set()
+        for value in values:
+            match.update(postings.get((question, value), ()))
+        matches.append(match)
+    if not matches:
+        return []
+    if not match_all:
+        return sorted(set().union(*matches))
+    matches.sort(key=len)
+    result = matches[0]
+    for match in matches[1:]:
+        if not result:
+            break
+        result = result.intersection(match)
+    return sorted(result)
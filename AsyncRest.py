@@ -0,0 +1,376 @@
+# Async serving mode.
+# The same routes as ExampleStackOverflowRest, served over ASGI with SQLAlchemy's asyncio engine. A request waiting
+# on the database only holds a coroutine instead of a worker thread, so one process can keep thousands of slow
+# clients around while at most ASYNC_POOL_SIZE queries run at the same time.
+#
+# Run it with any ASGI server, e.g. `uvicorn AsyncRest:app`. Needs the asyncio driver of the database:
+# asyncpg for PostgreSQL, aiosqlite for SQLite or aiomysql for MySQL.
+#
+# The cache is the same db_cache as the Flask app. Its locks are only held for in-memory bookkeeping so they never
+# block the event loop for long, the optional SQLite L2 cache does disk I/O and is used from a thread instead.
+# Concurrent misses for the same key share one query through AsyncSingleFlight. Cached bodies are checked against the
+# data generations of CacheDBWrapper, read here with the async engine.
+from CacheEngine import MISSING, AsyncSingleFlight
+from CompactStorage import ResponseLayout
+from ExampleStackOverflowRest import app as flask_app, db_cache, get_fields, DataGeneration, MAX_RESULTS_PER_PAGE, \
+    Response, Schema
+from ResponseEncoder import encode_json
+from SharedCache import TieredCache
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.routing import Map, Rule
+import asyncio
+import CacheDBWrapper
+import PromotedQuestions
+import os
+
+# Database URI for the async engine. Defaults to the one of the Flask app with its driver swapped for an
+# asyncio one, see ASYNC_DRIVERS.
+ASYNC_DATABASE_URI = os.environ.get('PYSTACKOVERFLOW_ASYNC_DATABASE_URI')
+# Most connections open at the same time. Requests past that wait for a connection without holding anything else.
+ASYNC_POOL_SIZE = int(os.environ.get('PYSTACKOVERFLOW_ASYNC_POOL_SIZE', 20))
+# Seconds a request waits for a free connection before failing
+ASYNC_POOL_TIMEOUT = int(os.environ.get('PYSTACKOVERFLOW_ASYNC_POOL_TIMEOUT', 30))
+# asyncio driver of every backend
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite', 'mysql': 'mysql+aiomysql'}
+
+in_flight = AsyncSingleFlight()
+# Reads of the data generations, a separate one so they don't show up in the cache statistics
+generations_flight = AsyncSingleFlight()
+# Created on first use so importing the module doesn't need the driver
+engine = None
+async_session = None
+
+
+def get_async_database_uri():
+    """
+    Database URI used by the async engine.
+
+    :return: URI with an asyncio driver
+    """
+    if ASYNC_DATABASE_URI:
+        return ASYNC_DATABASE_URI
+    url = make_url(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def get_session():
+    """
+    Open a new async session, creating the engine on first use.
+
+    :return: AsyncSession instance, to be used with async with
+    """
+    global engine, async_session
+    if engine is None:
+        url = make_url(get_async_database_uri())
+        # SQLite connections aren't pooled
+        pool_options = {} if url.get_backend_name() == 'sqlite' else {
+            'pool_size': ASYNC_POOL_SIZE, 'max_overflow': 0, 'pool_timeout': ASYNC_POOL_TIMEOUT}
+        engine = create_async_engine(url, **pool_options)
+        async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    return async_session()
+
+
+class AsyncRequest(object):
+    """
+    The bits of an ASGI request the routes need, named like their Flask counterparts.
+    """
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope['query_string']
+        query_string = self.query_string.decode('utf8', 'replace')
+        self.args = MultiDict(parse_qsl(query_string, keep_blank_values=True))
+        headers = {key.decode('latin1').lower(): value.decode('latin1') for key, value in scope['headers']}
+        self.accept_encodings = parse_accept_header(headers.get('accept-encoding'))
+        self.if_none_match = parse_etags(headers.get('if-none-match'))
+        # Same as request.full_path, so cache keys match the ones of the Flask app
+        self.full_path = f'{self.path}?{query_string}'
+
+
+def encode(payload, status=200):
+    # encode_json() follows the JSON settings of the Flask app
+    with flask_app.app_context():
+        return encode_json(payload, status)
+
+
+async def _cache_get(req):
+    if isinstance(db_cache, TieredCache):
+        return await asyncio.get_running_loop().run_in_executor(None, db_cache.get, req, MISSING)
+    return db_cache.get(req, MISSING)
+
+
+async def _cache_insert(req, body):
+    if isinstance(db_cache, TieredCache):
+        await asyncio.get_running_loop().run_in_executor(None, db_cache.insert, req, body)
+    else:
+        db_cache.insert(req, body)
+
+
+async def _read_generations():
+    async with get_session() as session:
+        CacheDBWrapper.generations.update(dict(
+            (await session.execute(select(DataGeneration.year, DataGeneration.generation))).all()))
+
+
+async def _get_generation(year=None):
+    # Async counterpart of CacheDBWrapper.get_generation(), requests arriving during a read wait for the same read
+    if CacheDBWrapper.generations.is_stale():
+        await generations_flight.do('generations', _read_generations)
+    return CacheDBWrapper.generations.get(year)
+
+
+async def _get_cached(req, query, render, year=None):
+    # Same rules as CacheDBWrapper._get_cached()
+    generation = await _get_generation(year)
+    body = await _cache_get(req)
+    if body is not MISSING and body.generation == generation:
+        return body
+    return await in_flight.do(req, lambda: _load(req, query, render, generation))
+
+
+async def _load(req, query, render, generation):
+    # Another caller may have finished loading between our cache miss and becoming the leader
+    body = await _cache_get(req)
+    if body is not MISSING and body.generation == generation:
+        return body
+    async with get_session() as session:
+        result = await query(session)
+    body = render(result)
+    body.generation = generation
+    await _cache_insert(req, body)
+    return body
+
+
+async def _get_layouts(session, years):
+    # Async counterpart of CacheDBWrapper.get_layout(), which queries synchronously and would block the event loop.
+    # Years without a schema get an empty layout that isn't kept, like get_layout() does.
+    missing_years = [year for year in years if year not in CacheDBWrapper.layouts]
+    if missing_years:
+        for schema in (await session.execute(select(Schema).where(Schema.year.in_(missing_years)))).scalars():
+            CacheDBWrapper.layouts[schema.year] = ResponseLayout(schema.response_columns.keys())
+    return {year: CacheDBWrapper.layouts.get(year) or ResponseLayout([]) for year in years}
+
+
+async def _fetch(session, statement, fields=None, years=None):
+    """
+    Async counterpart of CacheDBWrapper._fetch().
+
+    :param session: AsyncSession
+    :param statement: Filtered/ordered/limited select() over Response
+    :param fields: List of survey fields to return, None for all of them
+    :param years: Years the query can return, None for every year with a schema
+    :return: List of dicts with the same keys as the Response dataclass
+    """
+    if years is None:
+        years = (await session.execute(select(Schema.year))).scalars().all()
+    year_layouts = await _get_layouts(session, years)
+    if fields is None:
+        return CacheDBWrapper.to_payload((await session.execute(statement)).scalars().all(), year_layouts)
+    if engine.dialect.name not in CacheDBWrapper.JSON_EXTRACT_DIALECTS:
+        return [dict(response, responses={field: response['responses'].get(field) for field in fields})
+                for response in CacheDBWrapper.to_payload((await session.execute(statement)).scalars().all(),
+                                                          year_layouts)]
+    expressions = [CacheDBWrapper._field_expression(field, years, year_layouts) for field in fields]
+    rows = (await session.execute(statement.with_only_columns(
+        Response.response_id, Response.respondent_id, Response.response_year, *expressions))).all()
+    return [{'response_id': row[0], 'respondent_id': row[1], 'response_year': row[2],
+             'responses': dict(zip(fields, row[3:]))} for row in rows]
+
+
+async def _get_schema_body(key, query, render):
+    # Same rules as CacheDBWrapper._get_schema_body(), the rendered schemas are shared with the Flask app
+    await _get_generation()
+    body = CacheDBWrapper.schema_bodies.get(key)
+    if body is not None:
+        return body
+    async with get_session() as session:
+        result = await query(session)
+    body = render(result)
+    if len(result) > 0:
+        CacheDBWrapper.schema_bodies[key] = body
+    return body
+
+
+async def get_schemas(req):
+    async def query(session):
+        return (await session.execute(select(Schema))).scalars().all()
+
+    def render(result):
+        return encode({'error': 'No schema found.'}, 404) if len(result) == 0 else encode(result)
+    return await _get_schema_body('/schemas', query, render)
+
+
+async def get_schema_by_year(req, year):
+    async def query(session):
+        return (await session.execute(select(Schema).filter_by(year=year))).scalars().all()
+
+    def render(result):
+        if len(result) > 1:
+            result.append({'warning': 'Multiple results exist. Your database may be inconsistent!'})
+        return encode({'error': f'Schema for year {year} not found.'}, 404) if len(result) == 0 else encode(result)
+    return await _get_schema_body(year, query, render)
+
+
+async def get_responses_by_cursor(req, year, filters=None):
+    size_per_page = max(1, req.args.get('size', MAX_RESULTS_PER_PAGE, type=int))
+    with_count = req.args.get('count', 'false').lower() == 'true'
+    fields = get_fields(req.args)
+    try:
+        after = CacheDBWrapper.decode_cursor(req.args.get('cursor'))
+    except ValueError:
+        return encode({'error': 'Invalid cursor.'}, 400)
+
+    async def query(session):
+        criteria = PromotedQuestions.filter_criteria(Response, filters or [])
+        statement = select(Response).where(*criteria)
+        count_statement = select(func.count()).select_from(Response).where(*criteria)
+        if year is not None:
+            statement = statement.filter_by(response_year=year)
+            count_statement = count_statement.where(Response.response_year == year)
+        total = (await session.execute(count_statement)).scalar() if with_count else None
+        if after is not None:
+            statement = statement.where(tuple_(*CacheDBWrapper.KEYSET_ORDER) > tuple_(*after))
+        result = await _fetch(session, statement.order_by(*CacheDBWrapper.KEYSET_ORDER).limit(size_per_page),
+                              fields, None if year is None else [year])
+        next_cursor = CacheDBWrapper.encode_cursor(result[-1]) if len(result) == size_per_page else None
+        return result, next_cursor, total
+
+    def render(result):
+        result, next_cursor, total = result
+        if len(result) == 0 and after is None and not filters:
+            return encode({'error': 'Database is empty'}, 404)
+        payload = {'responses': result, 'next': next_cursor}
+        if total is not None:
+            payload.update({'total': total})
+        return encode(payload)
+    return await _get_cached(req.full_path, query, render, year)
+
+
+async def get_response_per_page(req, year=None):
+    # Promoted question filters are only offered on /responses/<year>, like the Flask app
+    filters = []
+    if year is not None:
+        try:
+            filters = PromotedQuestions.parse_filters(req.args)
+        except ValueError as e:
+            return encode({'error': str(e)}, 400)
+    if 'cursor' in req.args:
+        return await get_responses_by_cursor(req, year, filters)
+    page_number = req.args.get('page', 1, type=int)
+    size_per_page = req.args.get('size', MAX_RESULTS_PER_PAGE, type=int)
+    fields = get_fields(req.args)
+    statement = select(Response).where(*PromotedQuestions.filter_criteria(Response, filters))
+    if year is not None:
+        statement = statement.filter_by(response_year=year)
+    statement = CacheDBWrapper._offset_page(statement, page_number, size_per_page)
+
+    def render(result):
+        if len(result) == 0 and not filters:
+            return encode({'error': 'Database is empty'}, 404)
+        return encode(result)
+    return await _get_cached(req.full_path, lambda session: _fetch(session, statement, fields,
+                                                                     None if year is None else [year]), render, year)
+
+
+async def get_response_by_response_id(req, response_id):
+    def render(result):
+        if len(result) > 1:
+            result.append({'warning': 'More than one response detected. Your database may be inconsistent!'})
+        return encode({'error': f'Response ID {response_id} not found.'}, 404) if len(result) != 1 else encode(result)
+    statement = select(Response).filter_by(response_id=response_id)
+    return await _get_cached(req.full_path, lambda session: _fetch(session, statement, get_fields(req.args)), render)
+
+
+async def get_response_by_year_respondent_id(req, year, respondent_id):
+    def render(result):
+        return encode({'error': f'Response data for respondent ID {respondent_id} for year {year} is not found.'},
+                      404) if len(result) != 1 else encode(result)
+    statement = select(Response).filter_by(response_year=year, respondent_id=respondent_id)
+    return await _get_cached(req.full_path, lambda session: _fetch(session, statement, get_fields(req.args), [year]),
+                             render, year)
+
+
+async def get_cache_stats(req):
+    stats = db_cache.get_stats()
+    stats.update({'single_flight': in_flight.get_stats(), 'generations': CacheDBWrapper.generations.values or {}})
+    return encode(stats)
+
+
+url_map = Map([
+    Rule('/schemas', endpoint=get_schemas, methods=['GET']),
+    Rule('/schema/<int:year>', endpoint=get_schema_by_year, methods=['GET']),
+    Rule('/responses', endpoint=get_response_per_page, methods=['GET']),
+    Rule('/responses/<int:year>', endpoint=get_response_per_page, methods=['GET']),
+    Rule('/response/<response_id>', endpoint=get_response_by_response_id, methods=['GET']),
+    Rule('/response/<int:year>/<int:respondent_id>', endpoint=get_response_by_year_respondent_id, methods=['GET']),
+    Rule('/cache/stats', endpoint=get_cache_stats, methods=['GET']),
+], strict_slashes=False)
+
+
+async def send_body(send, body, req):
+    """
+    Send an EncodedBody the way EncodedBody.to_response() does for Flask.
+
+    :param send: ASGI send callable
+    :param body: EncodedBody instance
+    :param req: AsyncRequest being answered
+    """
+    data, etag, encoding = body.pick(req.accept_encodings)
+    status = body.status
+    headers = []
+    if body.is_not_modified(req.if_none_match, etag):
+        status = 304
+        data = b''
+    else:
+        headers.append((b'content-type', body.mimetype.encode('latin1')))
+        if encoding is not None:
+            headers.append((b'content-encoding', encoding.encode('latin1')))
+        headers.append((b'content-length', str(len(data)).encode('latin1')))
+    if body.gzipped is not None:
+        headers.append((b'vary', b'Accept-Encoding'))
+    if body.status == 200:
+        headers.append((b'etag', f'"{etag}"'.encode('latin1')))
+        cache_control = flask_app.config.get('PYSTACKOVERFLOW_CACHE_CONTROL')
+        if cache_control:
+            headers.append((b'cache-control', cache_control.encode('latin1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'' if req.method == 'HEAD' else data})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if engine is not None:
+                await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point.
+    """
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    req = AsyncRequest(scope)
+    try:
+        endpoint, values = url_map.bind('localhost').match(req.path, method=req.method)
+    except NotFound:
+        body = encode({'error': f'{req.path} not found.'}, 404)
+    except MethodNotAllowed:
+        body = encode({'error': f'Method {req.method} not allowed.'}, 405)
+    else:
+        body = await endpoint(req, **values)
+    await send_body(send, body, req)
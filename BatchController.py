@@ -0,0 +1,104 @@
+# Batch size controller for the dumper.
+# Additive increase/multiplicative decrease (AIMD): the batch grows by a fixed step while commits stay within
+# the latency and memory limits and throughput keeps improving, and is cut by a factor as soon as a limit is hit.
+import sys
+
+# Size of an empty str object, added per value on top of its length
+STR_OVERHEAD = sys.getsizeof('')
+
+
+def estimate_row_size(row):
+    """
+    Cheap estimate of the memory held by a parsed CSV line. Keys are shared by every line of a file so only
+    the values are counted.
+
+    :param row: Dict from csv.DictReader
+    :return: Approximate size in bytes
+    """
+    return sum(len(value) for value in row.values()) + STR_OVERHEAD * len(row)
+
+
+class BatchController(object):
+    """
+    Picks the amount of rows to commit at once, aiming for the best rows per second without going over
+    the commit latency or pending memory limits.
+    """
+    def __init__(self, initial=1000, minimum=100, maximum=100000, step=500, decrease_factor=0.5,
+                 max_commit_time=10.0, max_batch_bytes=256 * 1024 * 1024):
+        """
+        Create a new BatchController instance
+
+        :param initial: Starting batch size. Defaults to 1000 rows.
+        :param minimum: Smallest batch size. Defaults to 100 rows.
+        :param maximum: Largest batch size. Defaults to 100000 rows.
+        :param step: Rows added to the batch size after a good batch. Defaults to 500 rows.
+        :param decrease_factor: Factor applied to the batch size after a limit was hit. Defaults to 0.5.
+        :param max_commit_time: Longest acceptable commit in seconds. Defaults to 10 seconds.
+        :param max_batch_bytes: Most data allowed to wait for a commit, in bytes. Defaults to 256 MiB.
+        """
+        self.batch_size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.decrease_factor = decrease_factor
+        self.max_commit_time = max_commit_time
+        self.max_batch_bytes = max_batch_bytes
+        self.last_throughput = None
+        self.last_action = None
+
+    def should_commit(self, pending_rows, pending_bytes):
+        """
+        Check whether the pending rows should be committed now.
+
+        :param pending_rows: Rows waiting for a commit
+        :param pending_bytes: Estimated size of the rows waiting for a commit
+        :return: True when the batch is full or the memory limit is reached
+        """
+        return pending_rows >= self.batch_size or pending_bytes >= self.max_batch_bytes
+
+    def _clamp(self, batch_size):
+        return max(self.minimum, min(self.maximum, int(batch_size)))
+
+    def update(self, rows, batch_bytes, commit_time, batch_time):
+        """
+        Feed the measurements of a committed batch and pick the next batch size.
+
+        :param rows: Rows in the batch
+        :param batch_bytes: Estimated size of the batch in bytes
+        :param commit_time: Time taken by the commit in nanoseconds
+        :param batch_time: Time taken by the whole batch (reading, adding and committing) in nanoseconds
+        :return: Dict describing the decision: batch_size, action, reason and rows_per_second
+        """
+        commit_seconds = commit_time / 1000000000
+        throughput = rows / max(batch_time / 1000000000, 1e-9)
+        if commit_seconds > self.max_commit_time:
+            action = 'decrease'
+            reason = f'commit took {round(commit_seconds, 3)}s, over the {self.max_commit_time}s limit'
+            batch_size = self.batch_size * self.decrease_factor
+        elif batch_bytes >= self.max_batch_bytes:
+            action = 'decrease'
+            reason = f'batch reached {batch_bytes} bytes, over the {self.max_batch_bytes} bytes limit'
+            batch_size = self.batch_size * self.decrease_factor
+        elif self.last_action == 'increase' and self.last_throughput is not None \
+                and throughput < self.last_throughput * 0.9:
+            # Bigger batches made things slower, step back. The next good batch tries growing again.
+            action = 'decrease'
+            reason = f'throughput dropped from {round(self.last_throughput)} rows/s after the last increase'
+            batch_size = self.batch_size - self.step
+        else:
+            action = 'increase'
+            reason = 'within limits'
+            batch_size = self.batch_size + self.step
+            # Don't grow past what the limits allow, going by the per row cost of this batch
+            if rows > 0 and commit_seconds > 0:
+                batch_size = min(batch_size, self.max_commit_time / (commit_seconds / rows))
+            if rows > 0 and batch_bytes > 0:
+                batch_size = min(batch_size, self.max_batch_bytes / (batch_bytes / rows))
+            if int(batch_size) <= self.batch_size:
+                action = 'hold'
+                reason = 'close to the commit time or memory limit'
+        self.batch_size = self._clamp(batch_size)
+        self.last_throughput = throughput
+        self.last_action = action
+        return {'batch_size': self.batch_size, 'action': action, 'reason': reason,
+                'rows_per_second': round(throughput)}
@@ -0,0 +1,386 @@
+# Reproducible benchmark of the dumper and the REST API.
+# Generates a synthetic survey, loads it with the dumper into a throwaway database and replays a mixed request
+# workload against the Flask routes through the test client. The results are saved as JSON so runs can be compared:
+#
+#   python Benchmark.py --rows 20000 --columns 80 --requests 5000 --output before.json
+#   python Benchmark.py --rows 20000 --columns 80 --requests 5000 --output after.json --baseline before.json
+#
+# Everything is seeded, the same arguments give the same survey files and the same requests.
+# Runs against a SQLite file in the work directory unless --database-uri is given. Every table of that database is
+# dropped first, so only point it at a database made for benchmarking.
+import argparse
+import csv
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is reported as null there
+    resource = None
+
+# Directory of this file, where the dumper lives
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Columns every synthetic survey starts with, the rest are filler questions
+FIXED_COLUMNS = ['Respondent', 'Country', 'YearsCodePro', 'ConvertedComp', 'LanguageWorkedWith']
+COUNTRIES = ['United States', 'India', 'Germany', 'United Kingdom', 'Canada', 'France', 'Brazil', 'Poland',
+             'Netherlands', 'Australia', 'Spain', 'Malaysia', 'Austria', 'Japan', 'Nigeria']
+LANGUAGES = ['JavaScript', 'Python', 'SQL', 'Java', 'TypeScript', 'C#', 'PHP', 'C++', 'C', 'Go', 'Kotlin',
+             'Ruby', 'Rust', 'Swift', 'R', 'Scala']
+ANSWERS = ['Yes', 'No', 'Sometimes', 'Strongly agree', 'Agree', 'Neither agree nor disagree', 'Disagree',
+           'Strongly disagree', 'Daily', 'Weekly', 'Monthly', 'Never']
+# Share of unanswered questions, written as NA like the real files
+UNANSWERED_RATE = 0.1
+# Every MULTI_SELECT_EVERY-th filler question is multi-select
+MULTI_SELECT_EVERY = 5
+# Requests of the replayed workload and how often they're picked
+WORKLOAD_WEIGHTS = {'schemas': 2, 'schema': 2, 'page': 30, 'cursor': 6, 'respondent': 25, 'filter': 8,
+                    'search': 8, 'stats': 7, 'lookup': 4}
+# Responses asked for by one batch lookup
+LOOKUP_SIZE = 50
+# Version of the results file format
+RESULTS_VERSION = 1
+
+# Loggy bits
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+log.addHandler(ch)
+
+
+def _skewed_choice(rng, values):
+    # Popular answers first, the way real surveys look: the n-th value is picked about 1/n as often as the first
+    return rng.choices(values, weights=[1 / (i + 1) for i in range(len(values))])[0]
+
+
+def _answer(rng, values, multi_select):
+    if rng.random() < UNANSWERED_RATE:
+        return 'NA'
+    if not multi_select:
+        return _skewed_choice(rng, values)
+    return ';'.join(sorted({_skewed_choice(rng, values) for _ in range(rng.randint(1, 4))}))
+
+
+def generate_survey(directory, years, rows, columns, seed):
+    """
+    Write synthetic survey_results_schema.csv and survey_results_public.csv files for every year, in the layout
+    the dumper reads (<directory>/<year>/...). The fixed columns include the promoted questions and a multi-select
+    question, so every endpoint has something to work with.
+
+    :param directory: Data directory, StackOverflowDataDumper.DIR
+    :param years: Years to generate
+    :param rows: Responses per year
+    :param columns: Columns per year, Respondent included. At least the fixed columns.
+    :param seed: Random seed
+    :return: List of the question columns
+    """
+    rng = random.Random(seed)
+    filler_count = max(columns, len(FIXED_COLUMNS)) - len(FIXED_COLUMNS)
+    questions = FIXED_COLUMNS[1:] + [f'Question{i}' for i in range(filler_count)]
+    for year in years:
+        path = os.path.join(directory, str(year))
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'survey_results_schema.csv'), 'w', newline='', encoding='utf8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Column', 'QuestionText'])
+            writer.writerow(['Respondent', 'Randomized respondent ID number'])
+            for question in questions:
+                writer.writerow([question, f'Synthetic question {question}'])
+        with open(os.path.join(path, 'survey_results_public.csv'), 'w', newline='', encoding='utf8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Respondent'] + questions)
+            for respondent_id in range(1, rows + 1):
+                # Worded the way the real files word the ends of the range
+                years_code_pro = int(rng.expovariate(0.12))
+                years_code_pro = 'Less than 1 year' if years_code_pro == 0 else \
+                    'More than 50 years' if years_code_pro > 50 else str(years_code_pro)
+                row = [respondent_id, _answer(rng, COUNTRIES, False),
+                       years_code_pro if rng.random() >= UNANSWERED_RATE else 'NA',
+                       str(round(rng.lognormvariate(10.8, 0.7), 1)) if rng.random() >= UNANSWERED_RATE else 'NA',
+                       _answer(rng, LANGUAGES, True)]
+                row.extend(_answer(rng, ANSWERS, i % MULTI_SELECT_EVERY == 0) for i in range(filler_count))
+                writer.writerow(row)
+    return questions
+
+
+def build_workload(years, rows, count, page_size, questions, seed):
+    """
+    Mixed request workload, skewed towards the first pages and the lowest respondent IDs like real traffic is,
+    so the cache has something to do.
+
+    :param years: Years in the database
+    :param rows: Responses per year
+    :param count: Amount of requests
+    :param page_size: Responses per page
+    :param questions: Question columns, as returned by generate_survey()
+    :param seed: Random seed
+    :return: List of (endpoint name, method, path, JSON body or None) tuples
+    """
+    rng = random.Random(seed)
+    pages = max(1, math.ceil(rows / page_size))
+    names = list(WORKLOAD_WEIGHTS)
+    weights = [WORKLOAD_WEIGHTS[name] for name in names]
+    workload = []
+    for name in rng.choices(names, weights=weights, k=count):
+        year = rng.choice(years)
+        if name == 'schemas':
+            workload.append((name, 'GET', '/schemas', None))
+        elif name == 'schema':
+            workload.append((name, 'GET', f'/schema/{year}', None))
+        elif name == 'page':
+            page = min(pages, int(rng.paretovariate(1.0)))
+            workload.append((name, 'GET', f'/responses/{year}?page={page}&size={page_size}', None))
+        elif name == 'cursor':
+            workload.append((name, 'GET', f'/responses/{year}?cursor=&size={page_size}&count=true', None))
+        elif name == 'respondent':
+            workload.append((name, 'GET', f'/response/{year}/{min(rows, int(rng.paretovariate(0.5)))}', None))
+        elif name == 'filter':
+            workload.append((name, 'GET', f'/responses/{year}?Country={quote(_skewed_choice(rng, COUNTRIES))}'
+                                          f'&YearsCodePro.gte={rng.randint(0, 20)}&size={page_size}', None))
+        elif name == 'search':
+            # quote() keeps C# and C++ intact
+            workload.append((name, 'GET', f'/responses/{year}/search?where=LanguageWorkedWith:'
+                                          f'{quote(_skewed_choice(rng, LANGUAGES), safe="")}&where=Country:'
+                                          f'{quote(_skewed_choice(rng, COUNTRIES))}&size={page_size}', None))
+        elif name == 'stats':
+            workload.append((name, 'GET', f'/stats/{year}/{_skewed_choice(rng, questions)}', None))
+        elif name == 'lookup':
+            respondents = [[rng.choice(years), rng.randint(1, rows)] for _ in range(LOOKUP_SIZE)]
+            workload.append((name, 'POST', '/responses/lookup', {'respondents': respondents}))
+    return workload
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile.
+
+    :param values: Sorted list of values
+    :param p: Percentile, 0 to 100
+    :return: Value at the percentile, None for no values
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    return {'count': len(latencies), 'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3)}
+
+
+def peak_rss_mb(children=False):
+    """
+    Peak resident set size.
+
+    :param children: True for the largest finished child process, False for this process
+    :return: Peak RSS in MiB, None when it can't be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB everywhere else
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_dumper(workdir, database_uri, dumper_args):
+    """
+    Run the dumper in a process of its own, so its peak RSS is its own.
+
+    :param workdir: Work directory holding the stackoverflow_data directory
+    :param database_uri: Database to load into
+    :param dumper_args: Extra command line arguments of the dumper
+    :return: Seconds the dumper took
+    :raises RuntimeError: When the dumper fails
+    """
+    env = dict(os.environ, PYSTACKOVERFLOW_DATABASE_URI=database_uri,
+               PYSTACKOVERFLOW_INGEST_METRICS_PATH=os.path.join(workdir, 'ingest.prom'))
+    log_path = os.path.join(workdir, 'dumper.log')
+    start_time = time.perf_counter()
+    with open(log_path, 'w', encoding='utf8') as log_file:
+        returncode = subprocess.call([sys.executable, os.path.join(REPO_DIR, 'StackOverflowDataDumper.py')] +
+                                     dumper_args, cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    elapsed_time = time.perf_counter() - start_time
+    if returncode != 0:
+        raise RuntimeError(f'The dumper failed with exit code {returncode}, see "{log_path}"')
+    return elapsed_time
+
+
+def replay(client, workload):
+    """
+    Send every request of a workload through the Flask test client, one after another.
+
+    :param client: Flask test client
+    :param workload: Requests from build_workload()
+    :return: Tuple of a dict of endpoint name -> list of latencies in seconds, a dict of status code -> count and
+             the total seconds spent
+    """
+    latencies = {}
+    statuses = {}
+    start_time = time.perf_counter()
+    for name, method, path, body in workload:
+        request_start_time = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        latencies.setdefault(name, []).append(time.perf_counter() - request_start_time)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+    return latencies, statuses, time.perf_counter() - start_time
+
+
+def get_cache_hit_rates(cache_requests):
+    """
+    Cache hit rate, overall and per key family.
+
+    :param cache_requests: Metrics.cache_requests counter
+    :return: Tuple of the overall hit rate and a dict of family -> hit rate, None where nothing was looked up
+    """
+    counts = {}
+    for (family, result), count in cache_requests.values.items():
+        counts.setdefault(family, {'hit': 0, 'miss': 0})[result] += count
+    hits = sum(count['hit'] for count in counts.values())
+    total = hits + sum(count['miss'] for count in counts.values())
+    return (round(hits / total, 4) if total else None,
+            {family: round(count['hit'] / (count['hit'] + count['miss']), 4) for family, count in counts.items()})
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Metrics compared with --baseline, as paths into the results and whether higher is better
+COMPARED_METRICS = [(('ingest', 'rows_per_second'), True), (('ingest', 'peak_rss_mb'), False),
+                    (('api', 'requests_per_second'), True), (('api', 'latency', 'p50_ms'), False),
+                    (('api', 'latency', 'p99_ms'), False), (('api', 'cache_hit_rate'), True),
+                    (('api', 'peak_rss_mb'), False)]
+
+
+def compare(baseline, results):
+    """
+    Log the change of the main metrics against an earlier run.
+
+    :param baseline: Results of the earlier run
+    :param results: Results of this run
+    """
+    if baseline.get('config') != results['config']:
+        log.warning('The baseline was run with a different configuration, the numbers may not be comparable.')
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = baseline, results
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+            new = new.get(key) if isinstance(new, dict) else None
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        verdict = 'better' if (change > 0) == higher_is_better else 'worse'
+        log.info(f'{".".join(path)}: {old} -> {new} ({change:+.1f}%, {verdict if change else "same"})')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark loading a synthetic survey and serving it.')
+    parser.add_argument('--rows', type=int, default=10000, help='Responses per year. Defaults to 10000.')
+    parser.add_argument('--columns', type=int, default=60,
+                        help=f'Columns per year, Respondent included. At least {len(FIXED_COLUMNS)}. '
+                             f'Defaults to 60.')
+    parser.add_argument('--requests', type=int, default=5000, help='Requests replayed. Defaults to 5000.')
+    parser.add_argument('--page-size', type=int, default=20, help='Responses per page. Defaults to 20.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the survey and the workload.')
+    parser.add_argument('--workdir', help='Directory for the survey files, logs and SQLite database. '
+                                          'Defaults to a new temporary directory.')
+    parser.add_argument('--database-uri',
+                        help='Database to benchmark, e.g. a local PostgreSQL. Every table in it is dropped. '
+                             'Defaults to a SQLite file in the work directory.')
+    parser.add_argument('--dumper-args', default='--bulk',
+                        help='Arguments passed to the dumper. Defaults to "--bulk".')
+    parser.add_argument('--output', help='File to save the results to as JSON')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare with')
+    args = parser.parse_args()
+    if args.columns < len(FIXED_COLUMNS):
+        parser.error(f'--columns must be at least {len(FIXED_COLUMNS)}')
+    if args.rows < 1 or args.requests < 1 or args.page_size < 1:
+        parser.error('--rows, --requests and --page-size must be positive')
+    return args
+
+
+def main():
+    args = parse_args()
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='pystackoverflow-benchmark-'))
+    os.makedirs(workdir, exist_ok=True)
+    database_uri = args.database_uri or f'sqlite:///{os.path.join(workdir, "benchmark.sqlite")}'
+    # The REST API reads its configuration when imported, so it's only imported once the database is known
+    os.environ['PYSTACKOVERFLOW_DATABASE_URI'] = database_uri
+    from ExampleStackOverflowRest import app, db
+    from StackOverflowDataDumper import DIR, YEARS
+    import Metrics
+
+    log.info(f'Generating {args.rows} responses of {args.columns} columns per year in "{workdir}".')
+    start_time = time.perf_counter()
+    questions = generate_survey(os.path.join(workdir, DIR), YEARS, args.rows, args.columns, args.seed)
+    generate_time = time.perf_counter() - start_time
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # The API reconnects after the dumper is done
+        db.engine.dispose()
+
+    dumper_args = args.dumper_args.split()
+    log.info(f'Loading with the dumper ({" ".join(dumper_args)}).')
+    ingest_time = run_dumper(workdir, database_uri, dumper_args)
+    total_rows = args.rows * len(YEARS)
+    log.info(f'Loaded {total_rows} rows in {round(ingest_time, 3)}s.')
+
+    workload = build_workload(list(YEARS), args.rows, args.requests, args.page_size, questions, args.seed)
+    log.info(f'Replaying {len(workload)} requests.')
+    latencies, statuses, replay_time = replay(app.test_client(), workload)
+    hit_rate, family_hit_rates = get_cache_hit_rates(Metrics.cache_requests)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'rows': args.rows, 'columns': args.columns, 'years': list(YEARS), 'requests': args.requests,
+                   'page_size': args.page_size, 'seed': args.seed, 'dumper_args': dumper_args,
+                   # Only the backend, the URI may hold credentials
+                   'database': db.engine.dialect.name},
+        'generate': {'seconds': round(generate_time, 3)},
+        'ingest': {'rows': total_rows, 'seconds': round(ingest_time, 3),
+                   'rows_per_second': round(total_rows / ingest_time, 1),
+                   'peak_rss_mb': peak_rss_mb(children=True)},
+        'api': {'requests': len(workload), 'seconds': round(replay_time, 3),
+                'requests_per_second': round(len(workload) / replay_time, 1),
+                'latency': summarize_latencies([latency for values in latencies.values() for latency in values]),
+                'endpoints': {name: summarize_latencies(values) for name, values in sorted(latencies.items())},
+                'statuses': statuses, 'cache_hit_rate': hit_rate, 'cache_hit_rate_per_family': family_hit_rates,
+                # The benchmark process serves the requests, so this includes the survey generation too
+                'peak_rss_mb': peak_rss_mb()},
+    }
+    log.info(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(results, file, indent=2)
+        log.info(f'Saved the results to "{args.output}".')
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as file:
+            compare(json.load(file), results)
+
+
+if __name__ == '__main__':
+    main()
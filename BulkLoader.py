@@ -0,0 +1,363 @@
+# Bulk loading of response data.
+# Skips the ORM entirely: rows go straight from the CSV reader into batched multi-row inserts through
+# SQLAlchemy Core, or into COPY FROM STDIN when the database is PostgreSQL.
+from ExampleStackOverflowRest import db, Response, IngestCheckpoint
+from sqlalchemy.dialects import postgresql, sqlite
+import csv
+import PromotedQuestions
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+# Rows per batch (and per transaction)
+DEFAULT_BATCH_SIZE = 5000
+# Batches parsed ahead of the writers in pipelined mode. Bounds the memory used no matter how big the files are.
+DEFAULT_QUEUE_SIZE = 8
+
+response_table = Response.__table__
+checkpoint_table = IngestCheckpoint.__table__
+# Column order used by COPY, must match the order the CSV lines are written in
+PROMOTED_COLUMNS = tuple(promoted.column for promoted in PromotedQuestions.PROMOTED_QUESTIONS)
+COPY_COLUMNS = ('response_id', 'respondent_id', 'response_year', 'responses') + PROMOTED_COLUMNS
+COPY_STATEMENT = f'COPY {response_table.name} ({", ".join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)'
+
+
+def new_response_ids(count):
+    """
+    Generate random (version 4) UUID strings in bulk, with one read from the OS random source
+    instead of one per row like uuid.uuid4() does.
+
+    :param count: Amount of IDs to generate
+    :return: List of UUID strings
+    """
+    random_bytes = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=random_bytes[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+
+def read_response_batches(path, year, batch_size=DEFAULT_BATCH_SIZE, layout=None):
+    """
+    Read a survey_results_public.csv file as batches of insert-ready rows.
+    Only one batch is held in memory at a time.
+
+    :param path: Path to the response CSV file
+    :param year: Year of the survey
+    :param batch_size: Amount of rows per batch
+    :param layout: ResponseLayout of the year to store compact rows, None stores regular rows
+    :return: Generator of lists of row dicts matching the stackoverflow_response columns
+    """
+    with open(path, newline='', encoding='utf8') as file:
+        batch = []
+        for d in csv.DictReader(file):
+            batch.append(d)
+            if len(batch) == batch_size:
+                yield build_rows(batch, year, layout)
+                batch = []
+        if batch:
+            yield build_rows(batch, year, layout)
+
+
+def build_rows(responses, year, layout=None):
+    """
+    Turn parsed CSV lines into rows for the stackoverflow_response table, promoted question columns included.
+
+    :param responses: List of dicts from csv.DictReader
+    :param year: Year of the survey
+    :param layout: ResponseLayout of the year to store compact rows, None stores regular rows
+    :return: List of row dicts
+    """
+    response_ids = new_response_ids(len(responses))
+    return [{'response_id': response_id, 'respondent_id': int(d['Respondent']), 'response_year': year,
+             'responses': d if layout is None else layout.compact(d), **PromotedQuestions.extract(d)}
+            for response_id, d in zip(response_ids, responses)]
+
+
+def _copy_rows(connection, rows):
+    """
+    Send rows through COPY FROM STDIN. PostgreSQL only.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # None is written as an unquoted empty field, which COPY reads as NULL
+        writer.writerow((row['response_id'], row['respondent_id'], row['response_year'],
+                         json.dumps(row['responses'], separators=(',', ':')),
+                         *(row[column] for column in PROMOTED_COLUMNS)))
+    buffer.seek(0)
+    # Raw DBAPI connection, COPY isn't available through SQLAlchemy. It's the same connection (and
+    # transaction) SQLAlchemy uses, so committing is still done by the caller.
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(COPY_STATEMENT, buffer)
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, rows):
+    """
+    Insert a batch of rows using the fastest method the database supports.
+
+    :param connection: SQLAlchemy connection with a transaction in progress
+    :param rows: List of row dicts matching the stackoverflow_response columns
+    """
+    if connection.dialect.name == 'postgresql':
+        _copy_rows(connection, rows)
+    else:
+        # Single executemany() call, which the DBAPI turns into batched/multi-row inserts
+        connection.execute(response_table.insert(), rows)
+
+
+def bulk_load_responses(path, year, batch_size=DEFAULT_BATCH_SIZE, on_batch=None, layout=None):
+    """
+    Load a whole response file, committing once per batch.
+
+    :param path: Path to the response CSV file
+    :param year: Year of the survey
+    :param batch_size: Amount of rows per batch
+    :param on_batch: Optional function called after every commit with (rows loaded so far, rows in the batch,
+                     nanoseconds spent writing and committing the batch)
+    :param layout: ResponseLayout of the year to store compact rows, None stores regular rows
+    :return: Amount of rows loaded
+    """
+    count = 0
+    with db.engine.connect() as connection:
+        for rows in read_response_batches(path, year, batch_size, layout):
+            start_time = time.time_ns()
+            with connection.begin():
+                insert_rows(connection, rows)
+            write_time = time.time_ns() - start_time
+            count += len(rows)
+            if on_batch is not None:
+                on_batch(count, len(rows), write_time)
+    return count
+
+
+def _parse_files(tasks, batches, batch_size, layouts):
+    """
+    Parser process of pipelined_load_responses(). Parses files from the task queue into the batch queue
+    until it receives None.
+    """
+    for path, year in iter(tasks.get, None):
+        for rows in read_response_batches(path, year, batch_size, layouts.get(year)):
+            batches.put((year, rows))
+
+
+def _write_batches(batches, engine, on_batch, state):
+    """
+    Writer thread of pipelined_load_responses(). Inserts batches from the batch queue until it receives None.
+    """
+    with engine.connect() as connection:
+        for year, rows in iter(batches.get, None):
+            if state['error'] is not None:
+                # Keep draining so the parsers don't block on a full queue, the load fails anyway
+                continue
+            start_time = time.time_ns()
+            try:
+                with connection.begin():
+                    insert_rows(connection, rows)
+            except Exception as e:
+                state['error'] = e
+                continue
+            write_time = time.time_ns() - start_time
+            with state['lock']:
+                state['counts'][year] = state['counts'].get(year, 0) + len(rows)
+                count = state['counts'][year]
+            if on_batch is not None:
+                on_batch(year, count, len(rows), write_time)
+
+
+def pipelined_load_responses(files, workers=1, writers=2, batch_size=DEFAULT_BATCH_SIZE,
+                             queue_size=DEFAULT_QUEUE_SIZE, on_batch=None, layouts=None):
+    """
+    Load several response files with parsing and inserting running at the same time.
+    Parser processes (one file at a time each) feed a bounded queue of batches drained by writer threads,
+    each writer using its own database connection.
+
+    :param files: List of (path, year) tuples
+    :param workers: Amount of parser processes
+    :param writers: Amount of writer threads
+    :param batch_size: Amount of rows per batch
+    :param queue_size: Maximum amount of parsed batches waiting to be inserted
+    :param on_batch: Optional function called after every commit with (year, rows loaded so far for the year,
+                     rows in the batch, nanoseconds spent writing and committing the batch). Called from the writer
+                     threads.
+    :param layouts: Optional dict of year -> ResponseLayout, years found in it are stored as compact rows
+    :return: Dict of year -> amount of rows loaded
+    """
+    workers = max(1, workers)
+    context = multiprocessing.get_context()
+    tasks = context.Queue()
+    batches = context.Queue(maxsize=max(1, queue_size))
+    for task in files:
+        tasks.put(task)
+    for _ in range(workers):
+        tasks.put(None)
+    parsers = [context.Process(target=_parse_files, args=(tasks, batches, batch_size, layouts or {}), daemon=True)
+               for _ in range(workers)]
+    state = {'lock': threading.Lock(), 'counts': {}, 'error': None}
+    writer_threads = [threading.Thread(target=_write_batches, args=(batches, db.engine, on_batch, state), daemon=True)
+                      for _ in range(max(1, writers))]
+    for thread in writer_threads:
+        thread.start()
+    for parser in parsers:
+        parser.start()
+    for parser in parsers:
+        parser.join()
+    for _ in writer_threads:
+        batches.put(None)
+    for thread in writer_threads:
+        thread.join()
+    failed = [parser.exitcode for parser in parsers if parser.exitcode != 0]
+    if state['error'] is not None:
+        raise state['error']
+    if failed:
+        raise RuntimeError(f'{len(failed)} parser process(es) failed with exit codes {failed}')
+    return state['counts']
+
+
+class _OffsetLines(object):
+    """
+    Line iterator over a file opened in binary mode that knows the byte offset right after the last line
+    it handed out. csv readers only pull the lines they need for one record, so after every record the
+    offset points at the start of the next one.
+    """
+    def __init__(self, file, encoding='utf8'):
+        self.file = file
+        self.encoding = encoding
+        self.offset = file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.encoding)
+
+    def seek(self, offset):
+        self.file.seek(offset)
+        self.offset = offset
+
+
+def hash_file(path):
+    """
+    SHA-256 of a file, read in 1 MiB chunks.
+
+    :param path: Path to the file
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_response_batches_from(path, year, offset=0, batch_size=DEFAULT_BATCH_SIZE, layout=None):
+    """
+    Like read_response_batches(), but starts at a byte offset and tells where every batch ends.
+
+    :param path: Path to the response CSV file
+    :param year: Year of the survey
+    :param offset: Byte offset of the first row to read, 0 starts from the beginning
+    :param batch_size: Amount of rows per batch
+    :param layout: ResponseLayout of the year to store compact rows, None stores regular rows
+    :return: Generator of (list of row dicts, byte offset right after the batch) tuples
+    """
+    with open(path, 'rb') as file:
+        lines = _OffsetLines(file)
+        # The header is always read from the start of the file
+        fieldnames = next(csv.reader(lines))
+        if offset > lines.offset:
+            lines.seek(offset)
+        batch = []
+        for d in csv.DictReader(lines, fieldnames=fieldnames):
+            batch.append(d)
+            if len(batch) == batch_size:
+                yield build_rows(batch, year, layout), lines.offset
+                batch = []
+        if batch:
+            yield build_rows(batch, year, layout), lines.offset
+
+
+def upsert_rows(connection, rows):
+    """
+    Insert a batch of rows, replacing the responses (and promoted question columns) of rows that already exist
+    for the same (response_year, respondent_id). Existing rows keep their response_id.
+
+    :param connection: SQLAlchemy connection with a transaction in progress
+    :param rows: List of row dicts matching the stackoverflow_response columns
+    """
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(response_table)
+        statement = statement.on_conflict_do_update(index_elements=['response_year', 'respondent_id'],
+                                                    set_={column: statement.excluded[column]
+                                                          for column in ('responses',) + PROMOTED_COLUMNS})
+        connection.execute(statement, rows)
+        return
+    # No portable upsert, delete whatever is in the way first. Same transaction so nobody sees the gap.
+    year = rows[0]['response_year']
+    respondent_ids = [row['respondent_id'] for row in rows]
+    connection.execute(response_table.delete().where(response_table.c.response_year == year)
+                       .where(response_table.c.respondent_id.in_(respondent_ids)))
+    connection.execute(response_table.insert(), rows)
+
+
+def resumable_load_responses(path, year, batch_size=DEFAULT_BATCH_SIZE, on_batch=None, layout=None):
+    """
+    Load a response file with a checkpoint committed together with every batch.
+    An interrupted load resumes after the last committed batch, a file that was loaded completely and hasn't
+    changed since is skipped, and a changed file (or a year loaded without checkpoints) replaces every row of the
+    year, so respondents missing from the new file don't stay behind. Rows are upserted, so loading the same rows
+    twice never creates duplicates.
+
+    :param path: Path to the response CSV file
+    :param year: Year of the survey
+    :param batch_size: Amount of rows per batch
+    :param on_batch: Optional function called after every commit with (rows loaded so far, rows in the batch,
+                     nanoseconds spent writing and committing the batch)
+    :param layout: ResponseLayout of the year to store compact rows, None stores regular rows
+    :return: (rows loaded by this call, status) tuple, status being 'skipped', 'resumed' or 'loaded'
+    """
+    file_hash = hash_file(path)
+    with db.engine.connect() as connection:
+        checkpoint = connection.execute(checkpoint_table.select().where(checkpoint_table.c.year == year)).first()
+        if checkpoint is not None and checkpoint.file_hash == file_hash and checkpoint.completed:
+            return 0, 'skipped'
+        if checkpoint is not None and checkpoint.file_hash == file_hash:
+            status = 'resumed'
+            offset = checkpoint.byte_offset
+            count = checkpoint.row_count
+        else:
+            status = 'loaded'
+            offset = 0
+            count = 0
+            with connection.begin():
+                # Same transaction as the new checkpoint, a load interrupted right after still starts over
+                connection.execute(response_table.delete().where(response_table.c.response_year == year))
+                connection.execute(checkpoint_table.delete().where(checkpoint_table.c.year == year))
+                connection.execute(checkpoint_table.insert(), {'year': year, 'file_name': path, 'file_hash': file_hash,
+                                                               'byte_offset': 0, 'row_count': 0, 'completed': False})
+        loaded = 0
+        update_checkpoint = checkpoint_table.update().where(checkpoint_table.c.year == year)
+        for rows, end_offset in read_response_batches_from(path, year, offset, batch_size, layout):
+            count += len(rows)
+            loaded += len(rows)
+            start_time = time.time_ns()
+            with connection.begin():
+                upsert_rows(connection, rows)
+                connection.execute(update_checkpoint.values(byte_offset=end_offset, row_count=count))
+            write_time = time.time_ns() - start_time
+            if on_batch is not None:
+                on_batch(count, len(rows), write_time)
+        with connection.begin():
+            connection.execute(update_checkpoint.values(completed=True))
+    return loaded, status
@@ -1,42 +1,441 @@
-from ExampleStackOverflowRest import Response, db_cache, db
+from CacheEngine import MISSING, Generations, SingleFlight
+from CompactStorage import ResponseLayout, is_compact
+from Metrics import cache_requests, db_query_seconds
+from ExampleStackOverflowRest import AnswerCount, AnswerPosting, DataGeneration, Response, Schema, db_cache, db, \
+    GENERATION_CHECK_INTERVAL
+from sqlalchemy import case, func, tuple_
+import AnswerStats
+import PromotedQuestions
+import base64
+import json
+import time
 
+# Cache misses for the same key that happen at the same time share one database query
+in_flight = SingleFlight()
 
-def get_responses_by_page(req, page_number, size_per_page):
-    if db_cache.check(req):
-        return db_cache.get(req)
-    result = db.session.query(Response).paginate(page=page_number, per_page=size_per_page, error_out=False).items
-    db.session.remove()
-    db_cache.insert(req, result)
-    return result
+# Ordering used by keyset pagination, covered by the idx_response_year_respondent_order index.
+# respondent_id is always filled in by the dumper, rows with a NULL respondent_id are skipped by the cursor.
+KEYSET_ORDER = (Response.response_year, Response.respondent_id, Response.response_id)
 
+# Column layout of every year seen so far, used to expand compact rows. Schemas only change when the dumper loads
+# the year again, see _forget_years().
+layouts = {}
 
-def get_responses_by_year_per_page(req, year, page_number, size_per_page):
-    if db_cache.check(req):
-        return db_cache.get(req)
-    result = db.session.query(Response).filter_by(response_year=year).paginate(page=page_number, per_page=size_per_page,
-                                                                               error_out=False).items
-    db.session.remove()
-    db_cache.insert(req, result)
-    return result
+# Rendered schema bodies. Schemas only change when the dumper loads the year again, so they're rendered once and
+# kept here until then instead of competing with the responses in db_cache.
+schema_bodies = {}
 
+# Cache key family of every cached function, cache hits and misses are counted per family
+KEY_FAMILIES = {'get_responses_by_page': 'page', 'get_responses_by_year_per_page': 'year-page',
+                'get_responses_by_cursor': 'cursor', 'get_response_by_response_id': 'response-id',
+                'get_response_by_year_respondent_id': 'respondent', 'search_responses': 'search',
+                'get_answer_counts': 'stats'}
 
-def get_response_by_response_id(req, response_id):
-    if db_cache.check(req):
-        return db_cache.get(req)
-    result = db.session.query(Response).filter_by(response_id=response_id).all()
-    db.session.remove()
-    db_cache.insert(req, result)
-    return result
+# Backends that can extract single JSON fields in the query, see _fetch()
+JSON_EXTRACT_DIALECTS = {'postgresql', 'sqlite', 'mysql'}
+
+
+def _forget_years(years):
+    # The dumper loaded these years again, their schema may have changed along with the responses
+    for year in years:
+        layouts.pop(year, None)
+        schema_bodies.pop(year, None)
+    schema_bodies.pop('/schemas', None)
+
+
+# Data generation of every year. Cached bodies built from an older generation of their year are stale.
+generations = Generations(GENERATION_CHECK_INTERVAL, _forget_years)
+
+
+def read_generations():
+    return dict(db.session.query(DataGeneration.year, DataGeneration.generation).all())
 
 
-def get_response_by_year_respondent_id(req, year, respondent_id):
-    if db_cache.check(req):
-        return db_cache.get(req)
-    result = db.session.query(Response).filter_by(response_year=year, respondent_id=respondent_id).all()
+def get_generation(year=None):
+    """
+    Current data generation of a year, read from the database at most every GENERATION_CHECK_INTERVAL seconds.
+
+    :param year: Survey year, None for data spanning every year
+    :return: Generation to build and check cached bodies with
+    """
+    generations.refresh(read_generations)
+    return generations.get(year)
+
+
+# The cache holds rendered bodies (see ResponseEncoder) rather than ORM objects, so a hit is sent
+# as-is without touching the database models or serializing anything again.
+# render is called with the query result and returns the body to cache.
+# function is the name of the calling function, used by the metrics.
+# year is the survey year the body is built from, None when it can span every year. A cached body built before the
+# dumper last loaded its year counts as a miss and is replaced.
+def _get_cached(req, query, render, function, year=None):
+    # Read before querying, a load finishing during the query leaves the body stale instead of wrongly fresh
+    generation = get_generation(year)
+    # Single lookup instead of check() + get(), the entry may get evicted by another thread in between
+    body = db_cache.get(req, MISSING)
+    if body is not MISSING and body.generation == generation:
+        cache_requests.inc((KEY_FAMILIES[function], 'hit'))
+        return body
+    cache_requests.inc((KEY_FAMILIES[function], 'miss'))
+    return in_flight.do(req, lambda: _load(req, query, render, function, generation))
+
+
+def _load(req, query, render, function, generation):
+    # Another caller may have finished loading between our cache miss and becoming the leader
+    body = db_cache.get(req, MISSING)
+    if body is not MISSING and body.generation == generation:
+        return body
+    with db_query_seconds.time((function,)):
+        result = query()
+    # Render while the session is still around, nothing keeps the ORM objects alive afterwards
+    body = render(result)
+    body.generation = generation
     db.session.remove()
-    db_cache.insert(req, result)
-    return result
+    db_cache.insert(req, body)
+    return body
+
+
+def _get_schema_body(key, query, render, function):
+    # Drops the schemas of reloaded years when the generations changed
+    get_generation()
+    body = schema_bodies.get(key)
+    if body is not None:
+        return body
+    with db_query_seconds.time((function,)):
+        result = query()
+    body = render(result)
+    # Only keep what exists, or any year anyone asks for would stay around forever
+    if len(result) > 0:
+        schema_bodies[key] = body
+    return body
+
+
+def get_schemas(render):
+    return _get_schema_body('/schemas', lambda: db.session.query(Schema).all(), render, 'get_schemas')
+
+
+def get_schema_by_year(year, render):
+    return _get_schema_body(year, lambda: db.session.query(Schema).filter_by(year=year).all(), render,
+                            'get_schema_by_year')
+
+
+def get_layout(year):
+    """
+    Get the column layout of a year.
+
+    :param year: Survey year
+    :return: ResponseLayout instance
+    """
+    layout = layouts.get(year)
+    if layout is None:
+        schema = db.session.query(Schema).get(year)
+        layout = ResponseLayout(schema.response_columns.keys() if schema is not None else [])
+        if schema is not None:
+            layouts[year] = layout
+    return layout
+
+
+def to_payload(result, year_layouts=None):
+    """
+    Turn response models into plain dicts ready for encode_json(), expanding compact rows on the way.
+    Cheaper than letting the JSON encoder call dataclasses.asdict(), which deep copies the responses.
+
+    :param result: List of Response models
+    :param year_layouts: Dict of the ResponseLayout of every year in the result, looked up with get_layout() when
+                         not given
+    :return: List of dicts with the same keys as the Response dataclass
+    """
+    layout_of = get_layout if year_layouts is None else year_layouts.__getitem__
+    return [{'response_id': response.response_id, 'respondent_id': response.respondent_id,
+             'response_year': response.response_year,
+             'responses': layout_of(response.response_year).expand(response.responses)
+             if is_compact(response.responses) else response.responses} for response in result]
+
+
+def _field_expression(field, years, year_layouts=None):
+    """
+    SQL expression extracting one survey field as text, from both regular and compact rows.
+    Extracting a key from an array (or a position from an object) gives NULL, so COALESCE picks whichever
+    matches the way the row is stored.
+
+    :param field: Column name of the survey field
+    :param years: Years the query can return
+    :param year_layouts: Dict of the ResponseLayout of every year, looked up with get_layout() when not given
+    :return: SQLAlchemy expression
+    """
+    by_key = Response.responses[field].as_string()
+    layout_of = get_layout if year_layouts is None else year_layouts.__getitem__
+    positions = {year: layout_of(year).positions[field] for year in years if field in layout_of(year).positions}
+    if not positions:
+        return by_key
+    if len(years) == 1:
+        by_position = Response.responses[positions[years[0]]].as_string()
+    else:
+        by_position = case({year: Response.responses[position].as_string() for year, position in positions.items()},
+                           value=Response.response_year)
+    return func.coalesce(by_key, by_position)
+
+
+def _project(query, fields=None, years=None):
+    """
+    Prepare a response query for turning its rows into payload dicts.
+    When fields are given only those survey fields are returned. The projection is done by the database
+    where it can extract JSON fields, so the rest of the responses never leave it, and in Python otherwise.
+
+    :param query: Filtered/ordered/limited query over Response
+    :param fields: List of survey fields to return, None for all of them
+    :param years: Years the query can return, None for every year with a schema
+    :return: Tuple of the query to run and a function turning a list of its rows into payload dicts
+    """
+    if fields is None:
+        return query, to_payload
+    if db.engine.dialect.name not in JSON_EXTRACT_DIALECTS:
+        return query, lambda rows: [dict(response, responses={field: response['responses'].get(field)
+                                                              for field in fields}) for response in to_payload(rows)]
+    if years is None:
+        years = [year for year, in db.session.query(Schema.year).all()]
+    expressions = [_field_expression(field, years) for field in fields]
+    return query.with_entities(Response.response_id, Response.respondent_id, Response.response_year, *expressions), \
+        lambda rows: [{'response_id': row[0], 'respondent_id': row[1], 'response_year': row[2],
+                       'responses': dict(zip(fields, row[3:]))} for row in rows]
+
+
+def _fetch(query, fields=None, years=None):
+    """
+    Run a response query and turn the result into payload dicts, see _project().
+
+    :param query: Filtered/ordered/limited query over Response
+    :param fields: List of survey fields to return, None for all of them
+    :param years: Years the query can return, None for every year with a schema
+    :return: List of dicts with the same keys as the Response dataclass
+    """
+    query, convert = _project(query, fields, years)
+    return convert(query.all())
+
+
+def _offset_page(query, page_number, size_per_page):
+    # Same rules as paginate(error_out=False), minus the COUNT(*) it runs for a total nobody reads
+    if page_number < 1:
+        page_number = 1
+    if size_per_page < 0:
+        size_per_page = 20
+    return query.limit(size_per_page).offset((page_number - 1) * size_per_page)
+
+
+def encode_cursor(response):
+    """
+    Build an opaque cursor pointing right after the given response.
+
+    :param response: Last response of a page, as returned by to_payload()
+    :return: Cursor string
+    """
+    key = [response['response_year'], response['respondent_id'], response['response_id']]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor made by encode_cursor() back into the keyset position.
+
+    :param cursor: Cursor string. Empty or None means the first page.
+    :return: (response_year, respondent_id, response_id) tuple, or None for the first page
+    :raises ValueError: When the cursor is malformed
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Malformed cursor {cursor}') from e
+    if not isinstance(key, list) or len(key) != 3 or not isinstance(key[0], int) \
+            or not isinstance(key[1], int) or not isinstance(key[2], str):
+        raise ValueError(f'Malformed cursor {cursor}')
+    return tuple(key)
+
+
+def get_responses_by_page(req, page_number, size_per_page, render, fields=None):
+    return _get_cached(req, lambda: _fetch(_offset_page(db.session.query(Response), page_number, size_per_page),
+                                           fields), render, 'get_responses_by_page')
+
+
+def get_responses_by_year_per_page(req, year, page_number, size_per_page, render, fields=None, filters=None):
+    query = db.session.query(Response).filter_by(response_year=year).filter(
+        *PromotedQuestions.filter_criteria(Response, filters or []))
+    return _get_cached(req, lambda: _fetch(_offset_page(query, page_number, size_per_page), fields, [year]), render,
+                       'get_responses_by_year_per_page', year)
+
+
+def get_responses_by_cursor(req, year, after, size_per_page, with_count, render, fields=None, filters=None):
+    """
+    Keyset paginated responses. Every page costs the same index range scan no matter how deep it is.
+
+    :param req: Cache key
+    :param year: Only return responses of this year, None for all years
+    :param after: Keyset position from decode_cursor(), None for the first page
+    :param size_per_page: Amount of responses per page
+    :param with_count: Also count the matching responses, which scans all of them
+    :param render: Called with (responses, next cursor or None, total or None) and returns the body to cache
+    :param fields: List of survey fields to return, None for all of them
+    :param filters: Promoted question filters from PromotedQuestions.parse_filters(), None for no filtering
+    """
+    def query():
+        base_query = db.session.query(Response).filter(*PromotedQuestions.filter_criteria(Response, filters or []))
+        if year is not None:
+            base_query = base_query.filter_by(response_year=year)
+        total = base_query.count() if with_count else None
+        page_query = base_query
+        if after is not None:
+            page_query = page_query.filter(tuple_(*KEYSET_ORDER) > tuple_(*after))
+        result = _fetch(page_query.order_by(*KEYSET_ORDER).limit(size_per_page), fields,
+                        None if year is None else [year])
+        next_cursor = encode_cursor(result[-1]) if len(result) == size_per_page else None
+        return result, next_cursor, total
+    return _get_cached(req, query, lambda result: render(*result), 'get_responses_by_cursor', year)
+
+
+def get_response_by_response_id(req, response_id, render, fields=None):
+    return _get_cached(req, lambda: _fetch(db.session.query(Response).filter_by(response_id=response_id), fields),
+                       render, 'get_response_by_response_id')
+
+
+def get_response_by_year_respondent_id(req, year, respondent_id, render, fields=None):
+    return _get_cached(req, lambda: _fetch(db.session.query(Response).filter_by(
+        response_year=year, respondent_id=respondent_id), fields, [year]), render, 'get_response_by_year_respondent_id',
+                       year)
+
+
+def get_answer_counts(req, year, question, render):
+    return _get_cached(req, lambda: db.session.query(AnswerCount.value, AnswerCount.count).filter_by(
+        year=year, question=question).order_by(AnswerCount.count.desc(), AnswerCount.value).all(), render,
+                       'get_answer_counts', year)
+
+
+def search_responses(req, year, predicates, match_all, page_number, size_per_page, render, fields=None):
+    """
+    Responses of a year matching answer predicates, found through the answer postings instead of the responses.
+
+    :param req: Cache key
+    :param year: Survey year
+    :param predicates: List of (question, [values]) tuples, a predicate matches any of its values
+    :param match_all: True when every predicate must match (AND), False when any of them is enough (OR)
+    :param page_number: Page of matching respondents to return
+    :param size_per_page: Amount of responses per page
+    :param render: Called with (responses, total) and returns the body to cache
+    :param fields: List of survey fields to return, None for all of them
+    """
+    def query():
+        keys = {(question, value) for question, values in predicates for value in values}
+        rows = db.session.query(AnswerPosting.question, AnswerPosting.value, AnswerPosting.respondents).filter(
+            AnswerPosting.year == year, tuple_(AnswerPosting.question, AnswerPosting.value).in_(keys)).all()
+        postings = {(question, value): AnswerStats.decode_respondents(respondents)
+                    for question, value, respondents in rows}
+        respondent_ids = AnswerStats.match_respondents(postings, predicates, match_all)
+        start = (max(page_number, 1) - 1) * size_per_page
+        page_ids = respondent_ids[start:start + size_per_page]
+        if not page_ids:
+            return [], len(respondent_ids)
+        return _fetch(db.session.query(Response).filter(Response.response_year == year,
+                                                        Response.respondent_id.in_(page_ids)).order_by(
+            Response.respondent_id), fields, [year]), len(respondent_ids)
+    return _get_cached(req, query, lambda result: render(*result), 'search_responses', year)
+
+
+def _get_cached_response(req, function, year=None):
+    """
+    Peek at the cached body of a single response endpoint.
+
+    :param req: Cache key, the full path of the single response endpoint
+    :param function: Name of the function caching the endpoint, used by the metrics
+    :param year: Survey year of the response, None when it's not known
+    :return: The response payload, None when the cached body says it doesn't exist, MISSING when it's not cached
+             or stale
+    """
+    body = db_cache.get(req, MISSING)
+    if body is MISSING or body.generation != get_generation(year):
+        cache_requests.inc((KEY_FAMILIES[function], 'miss'))
+        return MISSING
+    cache_requests.inc((KEY_FAMILIES[function], 'hit'))
+    if body.status != 200:
+        return None
+    result = json.loads(body.raw)
+    return result[0]
+
+
+def get_responses_by_keys(respondents, response_ids, query_string, fields=None):
+    """
+    Look up many responses at once. Responses whose /response/... endpoint is already cached are taken from the
+    cache, the rest are fetched with one query per kind of key. Nothing is added to the cache, batch lookups
+    mostly come from jobs going through the data once.
+
+    :param respondents: List of (year, respondent_id) pairs
+    :param response_ids: List of response IDs
+    :param query_string: Query string of the batch request, applied to every response like it would be on the
+                         single response endpoints (and part of their cache keys)
+    :param fields: List of survey fields to return, None for all of them
+    :return: Tuple of the payload of every pair and of every response ID in request order, None where not found
+    """
+    pair_results = {}
+    for pair in respondents:
+        if pair not in pair_results:
+            pair_results[pair] = _get_cached_response(f'/response/{pair[0]}/{pair[1]}?{query_string}',
+                                                      'get_response_by_year_respondent_id', pair[0])
+    missing_pairs = [pair for pair, payload in pair_results.items() if payload is MISSING]
+    if missing_pairs:
+        # Covered by idx_response_year_respondent
+        query = db.session.query(Response).filter(
+            tuple_(Response.response_year, Response.respondent_id).in_(missing_pairs))
+        for pair in missing_pairs:
+            pair_results[pair] = None
+        with db_query_seconds.time(('get_responses_by_keys',)):
+            result = _fetch(query, fields, sorted({year for year, _ in missing_pairs}))
+        for response in result:
+            pair_results[response['response_year'], response['respondent_id']] = response
+
+    id_results = {}
+    for response_id in response_ids:
+        if response_id not in id_results:
+            id_results[response_id] = _get_cached_response(f'/response/{response_id}?{query_string}',
+                                                           'get_response_by_response_id')
+    missing_ids = [response_id for response_id, payload in id_results.items() if payload is MISSING]
+    if missing_ids:
+        for response_id in missing_ids:
+            id_results[response_id] = None
+        with db_query_seconds.time(('get_responses_by_keys',)):
+            result = _fetch(db.session.query(Response).filter(Response.response_id.in_(missing_ids)), fields)
+        for response in result:
+            id_results[response['response_id']] = response
+    return [pair_results[pair] for pair in respondents], [id_results[response_id] for response_id in response_ids]
+
+
+def stream_responses_by_year(year, batch_size, fields=None):
+    """
+    Every response of a year in keyset order, read through a server-side cursor in batches.
+    Meant for bulk exports: nothing goes through the cache, a full year would only push out entries worth keeping.
+
+    :param year: Survey year
+    :param batch_size: Amount of rows fetched from the cursor at a time
+    :param fields: List of survey fields to return, None for all of them
+    :return: Generator of lists of payload dicts, at most batch_size long
+    """
+    query, convert = _project(db.session.query(Response).filter_by(response_year=year).order_by(*KEYSET_ORDER),
+                              fields, [year])
+    batch = []
+    # Time spent fetching every batch, not counting the time the caller takes to send it
+    start_time = time.perf_counter()
+    # yield_per() streams the results instead of loading them all (stream_results on PostgreSQL)
+    for row in query.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db_query_seconds.observe(time.perf_counter() - start_time, ('stream_responses_by_year',))
+            yield convert(batch)
+            batch = []
+            start_time = time.perf_counter()
+    if batch:
+        db_query_seconds.observe(time.perf_counter() - start_time, ('stream_responses_by_year',))
+        yield convert(batch)
 
 
-def get_stats():
-    return db_cache.get_stats()
+def get_stats(with_entries=True):
+    stats = db_cache.get_stats(with_entries)
+    stats.update({'single_flight': in_flight.get_stats(), 'generations': generations.values or {}})
+    return stats
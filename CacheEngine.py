@@ -1,46 +1,103 @@
-# Naive implementation of LFU cache by The Internet:tm: and my puny brain.
+# LFU cache implementation based on frequency buckets.
 # Open for a better implementation by opening an issue and put `[LFU cache]` on the topic/issue name
 #
-# Known (WONTFIX) issues:
-# - Exception during concurrent access due to lack of locking for accesses across threads
-from collections import deque
+# LFUCache itself does no locking, use StripedLFUCache when the cache is shared across threads.
+from collections import OrderedDict
+import asyncio
+import heapq
+import sys
+import threading
+import time
+
+# Returned by get() when asked to, so callers can tell "not cached" apart from cached falsy data
+# (like an empty result list) in a single call.
+MISSING = object()
+
+# Eviction reasons reported by get_stats()
+EVICT_CAPACITY = 'capacity'
+EVICT_SIZE = 'size'
+EVICT_TTL = 'ttl'
+
+
+def estimate_size(data):
+    """
+    Estimate the memory used by an object and everything it references.
+    Good enough for cache accounting, not an exact measurement.
+
+    :param data: Object to measure
+    :return: Approximate size in bytes
+    """
+    # Objects that know their own size (encoded bodies, buffers) don't need to be walked
+    nbytes = getattr(data, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    total = 0
+    seen = set()
+    pending = [data]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            # Skip SQLAlchemy instance state, it's shared bookkeeping and not part of the data
+            pending.extend(v for k, v in vars(obj).items() if not k.startswith('_sa_'))
+    return total
 
 
 class LFUCache(object):
     """
     Class that implement LFU algorithm.
-    Based on Deque data structure for fast operations and ordering reasons.
+    Entries are kept in a dict for lookups and grouped in per-frequency buckets for eviction,
+    so get/insert/update/check/evict are all O(1). Entries with the same hit count are evicted
+    in least recently used order.
+    Optionally limits the total size of the cached data in bytes and expires entries after a
+    time to live.
     WARNING: THIS CACHE IS NOT THREAD SAFE.
     """
-    # TODO: Make LFUCache **subclass** of Deque as this class implementation **will**
-    # be based on Deque at some point.
-    def __init__(self, size=1024):
+    def __init__(self, size=1024, max_bytes=None, ttl=None, sweep_interval=60, sizer=estimate_size):
         """
         Create a new LFUCache instance for caching
 
         :param size: Size of the cache. Defaults to 1024 entries.
+        :param max_bytes: Upper limit of the cached data size in bytes. Defaults to no limit.
+        :param ttl: Default time to live of an entry in seconds. Defaults to never expiring.
+        :param sweep_interval: Minimum seconds between sweeps of expired entries. Defaults to 60 seconds.
+        :param sizer: Function used to measure an entry when max_bytes is set.
         """
-        # Deque because
-        # - I learned that from computer science class (unfortunately)
-        # - you can left append it and not having to do those awful shifting dances
-        # - you can pop any direction you want
-        # - tried and tested (have you googled Deque?)
-        # - IT HAS ROTATE FUNCTION WTF.
+        # name -> cache entry (see _get_cache_metadata_template)
+        self.cache = {}
+        # hit count -> OrderedDict of names with that hit count, oldest first.
+        # OrderedDict because
+        # - popitem(last=False) gives us the least recently used entry in O(1)
+        # - move_to_end gives us the "touch" in O(1)
         # - it's in Python stdlib so why reimplementing it from scratch?
-        self.cache = deque({})
-        # dict because
-        # - it's the next best thing to use as an index (which LRU cache depends on)
-        # - key=value support, which is **awesome**
-        # - included in Python stdlib
-        # - work around limitations with object searching (require searching for attribute)
-        # Index is **NEVER** used for data fetching/delete, they're just to work around a few
-        # limitations
-        self.index = []
+        self.buckets = {}
+        # Lowest hit count that currently has entries, which is where the next victim comes from
+        self.min_hit_count = 0
         # Set the upper element size limit of cache
         self.size = size
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.ttl = ttl
+        self.sizer = sizer
+        # (expires_at, name) of entries with a TTL. Updated entries leave stale items behind,
+        # they're skipped when popped.
+        self.expiry_heap = []
+        self.sweep_interval = sweep_interval
+        self.next_sweep = time.monotonic() + sweep_interval
         self.hit_count = 0
         self.miss_count = 0
         self.evict_count = 0
+        self.evictions = {EVICT_CAPACITY: 0, EVICT_SIZE: 0, EVICT_TTL: 0}
 
     def _get_cache_metadata_template(self):
         """
@@ -48,78 +105,470 @@ class LFUCache(object):
 
         :return: Template cache data
         """
-        base_dict = {'name': None, 'data': None, 'hit_count': 0}
+        base_dict = {'name': None, 'data': None, 'hit_count': 0, 'size': 0, 'expires_at': None}
         return base_dict
 
-    def _get_index_by_name(self, name):
-        # Hinty hint the cache_entry as dict as every entry in cache is a dict
-        cache_entry: dict
-        # This might sounds awfully weird, but it is how it is.
-        # Deque index only matches the whole object, irrespective of the contents.
-        # So do a classic O(n) traversing (what's performance?) and check the name attribute,
-        # get the whole dict if exists, __then__ get the actual index
-        for cache_entry in self.cache:
-            if cache_entry.get('name') == name:
-                return self.cache.index(cache_entry)
-
     def _get_data_by_name(self, name):
-        for cache_entry in self.cache:
-            if cache_entry.get('name') == name:
-                return cache_entry
+        cache_entry = self.cache.get(name)
+        if cache_entry is not None and cache_entry['expires_at'] is not None \
+                and cache_entry['expires_at'] <= time.monotonic():
+            # Lazy expiry, the sweep gets the ones nobody asks for
+            self._remove(name, EVICT_TTL)
+            return None
+        return cache_entry
+
+    def _bucket_add(self, name, hit_count):
+        bucket = self.buckets.get(hit_count)
+        if bucket is None:
+            bucket = self.buckets[hit_count] = OrderedDict()
+        bucket[name] = None
+
+    def _bucket_remove(self, name, hit_count):
+        bucket = self.buckets[hit_count]
+        del bucket[name]
+        if not bucket:
+            del self.buckets[hit_count]
+            if self.min_hit_count == hit_count:
+                # Correct when the entry moves to hit_count + 1, otherwise _evict fixes it up
+                self.min_hit_count = hit_count + 1
+
+    def _measure(self, data):
+        return self.sizer(data) if self.max_bytes is not None else 0
 
-    def insert(self, name, data):
+    def _set_data(self, cache_entry, data, ttl, size=None):
         """
-        Insert new data.
+        Store data in a cache entry and account for its size and expiry.
+        """
+        if size is None:
+            size = self._measure(data)
+        self.current_bytes += size - cache_entry['size']
+        cache_entry['data'] = data
+        cache_entry['size'] = size
+        ttl = self.ttl if ttl is None else ttl
+        if ttl:
+            cache_entry['expires_at'] = time.monotonic() + ttl
+            heapq.heappush(self.expiry_heap, (cache_entry['expires_at'], cache_entry['name']))
+        else:
+            cache_entry['expires_at'] = None
+
+    def insert(self, name, data, ttl=None):
+        """
+        Insert new data and count it as a miss.
 
         :param name: Name of the key
         :param data: Data that the key represents.
+        :param ttl: Time to live of this entry in seconds. Defaults to the cache TTL.
         :return: Inserted data
         """
-        new_cache_object = self._get_cache_metadata_template()
-        if name not in self.index:
-            new_cache_object.update({'name': name})
-            new_cache_object.update({'data': data})
-            self.cache.appendleft(new_cache_object)
-            self.index.append(name)
-        elif name in self.index:
-            # Call update function instead
-            self.update(name, data)
         self.miss_count += 1
-        self.prune()
+        return self.put(name, data, ttl)
+
+    def put(self, name, data, ttl=None):
+        """
+        Insert new data without counting a miss, for data copied over from another cache.
+
+        :param name: Name of the key
+        :param data: Data that the key represents.
+        :param ttl: Time to live of this entry in seconds. Defaults to the cache TTL.
+        :return: Inserted data
+        """
+        # Expired entries go before live ones are evicted to make room
+        if time.monotonic() >= self.next_sweep:
+            self.sweep()
+        if self._get_data_by_name(name) is not None:
+            # Call update function instead
+            self.update(name, data, ttl)
+            if self.max_bytes is not None and self.cache[name]['size'] > self.max_bytes:
+                self._remove(name, EVICT_SIZE)
+            self.prune()
+            return data
+        size = self._measure(data)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would flush the whole cache and still not fit, don't bother keeping it
+            self.evict_count += 1
+            self.evictions[EVICT_SIZE] += 1
+            return data
+        # Make room first, otherwise the new entry (hit count 0) would be its own victim
+        while self.cache and len(self.cache) >= self.size:
+            self._evict(EVICT_CAPACITY)
+        if self.max_bytes is not None:
+            while self.cache and self.current_bytes + size > self.max_bytes:
+                self._evict(EVICT_SIZE)
+        new_cache_object = self._get_cache_metadata_template()
+        new_cache_object.update({'name': name})
+        self._set_data(new_cache_object, data, ttl, size)
+        self.cache[name] = new_cache_object
+        self._bucket_add(name, 0)
+        self.min_hit_count = 0
         return data
 
-    def update(self, name, data):
-        if not self.check(name):
+    def update(self, name, data, ttl=None):
+        """
+        Replace the data of an existing key without counting it as a hit.
+
+        :param name: Name of the key
+        :param data: New data that the key represents.
+        :param ttl: Time to live of this entry in seconds. Defaults to the cache TTL.
+        :return: Updated data, or None if the key is not cached
+        """
+        cache_entry = self._get_data_by_name(name)
+        if cache_entry is None:
             return None
-        updated_cache_object = self._get_data_by_name(name)
-        self.cache.remove(updated_cache_object)
-        updated_cache_object.update({'data': data})
-        self.cache.appendleft(updated_cache_object)
+        self._set_data(cache_entry, data, ttl)
+        # Refresh recency within the same hit count
+        self.buckets[cache_entry['hit_count']].move_to_end(name)
         return data
 
-    def get(self, name):
-        if not self.check(name):
-            return None
-        dict_data = self._get_data_by_name(name)
-        self.cache.remove(dict_data)
-        dict_data.update({'hit_count': dict_data.get('hit_count')+1})
-        self.cache.appendleft(dict_data)
+    def get(self, name, default=None):
+        """
+        Get cached data and count it as a hit.
+
+        :param name: Name of the key
+        :param default: Value returned when the key is not cached. Pass MISSING to tell a miss
+                        apart from cached None/empty data without a separate check() call.
+        :return: Cached data, or default if the key is not cached
+        """
+        cache_entry = self._get_data_by_name(name)
+        if cache_entry is None:
+            return default
+        hit_count = cache_entry['hit_count']
+        self._bucket_remove(name, hit_count)
+        cache_entry['hit_count'] = hit_count + 1
+        self._bucket_add(name, hit_count + 1)
         self.hit_count += 1
-        return dict_data.get('data')
+        return cache_entry['data']
 
     def check(self, name):
-        if name in self.index:
-            return True
-        return False
+        return self._get_data_by_name(name) is not None
 
-    def get_stats(self):
-        stats = {'hits': self.hit_count, 'misses': self.miss_count, 'evicted': self.evict_count}
+    def get_stats(self, with_entries=True):
+        """
+        Cache statistics.
+
+        :param with_entries: Include the hit count of every entry, which grows with the cache
+        :return: Dict of statistics
+        """
+        stats = {'hits': self.hit_count, 'misses': self.miss_count, 'evicted': self.evict_count,
+                 'evictions': dict(self.evictions), 'entries': len(self.cache), 'bytes': self.current_bytes}
 
-        stats.update({'cache_entry': [{entry['name']: entry['hit_count']} for entry in self.cache]})
+        if with_entries:
+            stats.update({'cache_entry': [{name: entry['hit_count']} for name, entry in self.cache.items()]})
         return stats
 
+    def _remove(self, name, reason):
+        """
+        Remove an entry and count it as evicted.
+
+        :param name: Name of the key
+        :param reason: One of EVICT_CAPACITY, EVICT_SIZE or EVICT_TTL
+        :return: The removed cache entry
+        """
+        cache_entry = self.cache.pop(name)
+        self._bucket_remove(name, cache_entry['hit_count'])
+        self.current_bytes -= cache_entry['size']
+        self.evict_count += 1
+        self.evictions[reason] += 1
+        return cache_entry
+
+    def _evict(self, reason):
+        """
+        Evict the least frequently used entry, least recently used first on ties.
+
+        :param reason: Why the entry is evicted
+        :return: The evicted cache entry
+        """
+        if self.min_hit_count not in self.buckets:
+            # min_hit_count went stale after a removal emptied its bucket.
+            # Buckets only exist for hit counts in use so this stays cheap.
+            self.min_hit_count = min(self.buckets)
+        name = next(iter(self.buckets[self.min_hit_count]))
+        return self._remove(name, reason)
+
     def prune(self):
         while len(self.cache) > self.size:
-            data = self.cache.pop()
-            self.index.remove(data['name'])
-            self.evict_count += 1
+            self._evict(EVICT_CAPACITY)
+        if self.max_bytes is not None:
+            while self.cache and self.current_bytes > self.max_bytes:
+                self._evict(EVICT_SIZE)
+
+    def sweep(self):
+        """
+        Remove every expired entry.
+
+        :return: Amount of entries removed
+        """
+        now = time.monotonic()
+        self.next_sweep = now + self.sweep_interval
+        removed = 0
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            expires_at, name = heapq.heappop(self.expiry_heap)
+            cache_entry = self.cache.get(name)
+            # Skip leftovers of entries that were updated or already removed
+            if cache_entry is not None and cache_entry['expires_at'] == expires_at:
+                self._remove(name, EVICT_TTL)
+                removed += 1
+        if len(self.expiry_heap) > 2 * len(self.cache) + 64:
+            # Too many leftovers, rebuild from the live entries
+            self.expiry_heap = [(entry['expires_at'], name) for name, entry in self.cache.items()
+                                if entry['expires_at'] is not None]
+            heapq.heapify(self.expiry_heap)
+        return removed
+
+
+def _share(total, parts, index):
+    # Part of total given to one of parts segments, the first ones take the remainder so the parts add up to total
+    return total // parts + (1 if index < total % parts else 0)
+
+
+class StripedLFUCache(object):
+    """
+    Thread safe cache that spreads keys over several independently locked LFUCache segments.
+    Accesses to keys that land on different segments never wait on each other.
+    Eviction is LFU within each segment, which is close enough to a global LFU once the
+    segments hold more than a handful of entries each.
+    """
+    def __init__(self, size=1024, segments=16, max_bytes=None, ttl=None, sweep_interval=60, sizer=estimate_size):
+        """
+        Create a new StripedLFUCache instance for caching
+
+        :param size: Size of the cache across all segments. Defaults to 1024 entries.
+        :param segments: Number of independently locked segments. Defaults to 16.
+        :param max_bytes: Upper limit of the cached data size in bytes across all segments. Defaults to no limit.
+        :param ttl: Default time to live of an entry in seconds. Defaults to never expiring.
+        :param sweep_interval: Minimum seconds between sweeps of expired entries. Defaults to 60 seconds.
+        :param sizer: Function used to measure an entry when max_bytes is set.
+        """
+        # Every segment holds at least one entry, a smaller cache gets fewer segments
+        segments = max(1, min(segments, size))
+        self.size = size
+        self.max_bytes = max_bytes
+        self.segments = [LFUCache(size=_share(size, segments, index),
+                                  max_bytes=None if max_bytes is None else _share(max_bytes, segments, index),
+                                  ttl=ttl, sweep_interval=sweep_interval, sizer=sizer) for index in range(segments)]
+        self.locks = [threading.Lock() for _ in range(segments)]
+
+    def _segment_index(self, name):
+        return hash(name) % len(self.segments)
+
+    def insert(self, name, data, ttl=None):
+        index = self._segment_index(name)
+        with self.locks[index]:
+            return self.segments[index].insert(name, data, ttl)
+
+    def put(self, name, data, ttl=None):
+        index = self._segment_index(name)
+        with self.locks[index]:
+            return self.segments[index].put(name, data, ttl)
+
+    def update(self, name, data, ttl=None):
+        index = self._segment_index(name)
+        with self.locks[index]:
+            return self.segments[index].update(name, data, ttl)
+
+    def get(self, name, default=None):
+        """
+        Get cached data and count it as a hit. The lookup is atomic, so use
+        get(name, MISSING) instead of check() followed by get() as the entry may be evicted
+        in between.
+
+        :param name: Name of the key
+        :param default: Value returned when the key is not cached
+        :return: Cached data, or default if the key is not cached
+        """
+        index = self._segment_index(name)
+        with self.locks[index]:
+            return self.segments[index].get(name, default)
+
+    def check(self, name):
+        index = self._segment_index(name)
+        with self.locks[index]:
+            return self.segments[index].check(name)
+
+    def sweep(self):
+        """
+        Remove every expired entry from all segments, one segment lock at a time.
+
+        :return: Amount of entries removed
+        """
+        removed = 0
+        for segment, lock in zip(self.segments, self.locks):
+            with lock:
+                removed += segment.sweep()
+        return removed
+
+    def get_stats(self, with_entries=True):
+        stats = {'hits': 0, 'misses': 0, 'evicted': 0, 'evictions': {EVICT_CAPACITY: 0, EVICT_SIZE: 0, EVICT_TTL: 0},
+                 'entries': 0, 'bytes': 0}
+        if with_entries:
+            stats.update({'cache_entry': []})
+        for segment, lock in zip(self.segments, self.locks):
+            with lock:
+                segment_stats = segment.get_stats(with_entries)
+            for key in ('hits', 'misses', 'evicted', 'entries', 'bytes'):
+                stats[key] += segment_stats[key]
+            for reason, count in segment_stats['evictions'].items():
+                stats['evictions'][reason] += count
+            if with_entries:
+                stats['cache_entry'].extend(segment_stats['cache_entry'])
+        return stats
+
+
+class _Call(object):
+    """
+    A call in progress, shared by the caller running it and the ones waiting for it.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Deduplicates concurrent calls for the same key.
+    The first caller of a key runs the function, everyone else asking for the same key while it runs
+    waits for it and gets the same result (or the same exception).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.leader_count = 0
+        self.coalesced_count = 0
+
+    def do(self, key, func):
+        """
+        Run func, or wait for the run already in progress for key.
+
+        :param key: Key identifying the call
+        :param func: Function without arguments to run
+        :return: Result of func
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.leader_count += 1
+            else:
+                self.coalesced_count += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def get_stats(self):
+        return {'executed': self.leader_count, 'coalesced': self.coalesced_count, 'in_flight': len(self.calls)}
+
+
+class AsyncSingleFlight(object):
+    """
+    SingleFlight for coroutines running on one event loop.
+    The run is a task of its own, so a caller going away (like a client disconnecting) doesn't cancel it
+    for the callers still waiting.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.leader_count = 0
+        self.coalesced_count = 0
+
+    async def do(self, key, func):
+        """
+        Run func, or wait for the run already in progress for key.
+
+        :param key: Key identifying the call
+        :param func: Coroutine function without arguments to run
+        :return: Result of func
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._done(key, done))
+            self.leader_count += 1
+        else:
+            self.coalesced_count += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception as retrieved, every caller may have gone away already
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self):
+        return {'executed': self.leader_count, 'coalesced': self.coalesced_count, 'in_flight': len(self.calls)}
+
+
+class Generations(object):
+    """
+    Data generation of every year, as last read from the database.
+    The dumper bumps the generation of the years it loads. Cached bodies remember the generation they were built
+    from, so a body built before the last load of its year is stale. Reading the generations is cheap but not free,
+    so they're only read again once they're older than interval seconds.
+    """
+    def __init__(self, interval=5.0, on_change=None):
+        """
+        Create a new Generations instance
+
+        :param interval: Seconds the generations are used before being read again
+        :param on_change: Optional function called with the set of years whose generation changed
+        """
+        self.interval = interval
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.values = None
+        self.checked_at = 0
+
+    def is_stale(self):
+        return self.values is None or time.monotonic() - self.checked_at >= self.interval
+
+    def refresh(self, read):
+        """
+        Read the generations again if they're stale. Only one thread reads them, the others wait for it.
+
+        :param read: Function without arguments returning a dict of year -> generation
+        """
+        if not self.is_stale():
+            return
+        with self.lock:
+            if self.is_stale():
+                self.update(read())
+
+    def update(self, values):
+        """
+        Replace the generations with freshly read ones.
+
+        :param values: Dict of year -> generation
+        """
+        old_values = self.values
+        self.values = values
+        self.checked_at = time.monotonic()
+        if old_values is None or self.on_change is None:
+            return
+        changed = {year for year in old_values.keys() | values.keys() if old_values.get(year) != values.get(year)}
+        if changed:
+            self.on_change(changed)
+
+    def get(self, year=None):
+        """
+        Generation of a year. Years the dumper never loaded are at generation 0.
+
+        :param year: Survey year, None for data spanning every year
+        :return: Generation of the year. For every year, the sum of all generations, which changes whenever
+                 any of them does.
+        """
+        values = self.values or {}
+        if year is None:
+            return sum(values.values())
+        return values.get(year, 0)
@@ -0,0 +1,208 @@
+# Cache warm-up and next page prefetch.
+# Both replay requests through the app itself, so what ends up in the cache is exactly what the views would have
+# cached. Replayed requests are flagged in their WSGI environ so they don't trigger prefetches of their own and
+# don't count in the request metrics.
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+# WSGI environ key set on replayed requests
+REPLAY_ENVIRON_KEY = 'pystackoverflow.replay'
+
+log = logging.getLogger(__name__)
+
+
+def replay(app, key):
+    """
+    Run a GET request through the app, filling the cache like a client request would.
+
+    :param app: Flask app
+    :param key: Cache key, which is the full path of the request
+    :return: HTTP status code of the response
+    """
+    response = app.test_client().get(key, environ_overrides={REPLAY_ENVIRON_KEY: True})
+    response.close()
+    return response.status_code
+
+
+def is_replay(req):
+    """
+    Check whether a request was made by replay().
+
+    :param req: Request being answered
+    :return: True for replayed requests
+    """
+    return req.environ.get(REPLAY_ENVIRON_KEY, False)
+
+
+def get_hot_keys(cache, limit):
+    """
+    Most hit keys of a cache.
+
+    :param cache: Cache to look at
+    :param limit: Maximum amount of keys
+    :return: List of (key, hit count) tuples, most hit first
+    """
+    entries = (item for entry in cache.get_stats()['cache_entry'] for item in entry.items())
+    return heapq.nlargest(limit, entries, key=lambda item: item[1])
+
+
+def save_snapshot(cache, path, limit):
+    """
+    Save the most hit keys of a cache, for warm_up() to load them again in the next process.
+
+    :param cache: Cache to save the keys of
+    :param path: Snapshot file, replaced atomically
+    :param limit: Maximum amount of keys
+    :return: Amount of keys saved
+    """
+    keys = get_hot_keys(cache, limit)
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    with open(temporary_path, 'w', encoding='utf8') as file:
+        json.dump({'saved_at': time.time(), 'keys': keys}, file)
+    os.replace(temporary_path, path)
+    return len(keys)
+
+
+def load_snapshot(path, limit):
+    """
+    Load the keys saved by save_snapshot().
+
+    :param path: Snapshot file
+    :param limit: Maximum amount of keys
+    :return: List of keys, most hit first. Empty when there is no snapshot yet.
+    """
+    try:
+        with open(path, encoding='utf8') as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return []
+    return [key for key, _ in snapshot['keys'][:limit]]
+
+
+def warm_up(app, cache, path, limit):
+    """
+    Fill the cache with the keys of a snapshot, hottest first.
+
+    :param app: Flask app
+    :param cache: Cache being warmed up, keys already in it are skipped
+    :param path: Snapshot file
+    :param limit: Maximum amount of keys to load
+    :return: Amount of keys loaded
+    """
+    loaded = 0
+    start_time = time.time_ns()
+    for key in load_snapshot(path, limit):
+        if cache.check(key):
+            continue
+        try:
+            replay(app, key)
+            loaded += 1
+        except Exception:
+            log.exception(f'Warming up {key} failed.')
+    log.info(f'Warmed up {loaded} cache keys from "{path}" in {round((time.time_ns() - start_time) / 1000000000, 3)}s.')
+    return loaded
+
+
+def start(app, cache, path, limit, save_interval):
+    """
+    Warm the cache up in the background and keep the snapshot up to date: every save_interval seconds and when
+    the process exits.
+
+    :param app: Flask app
+    :param cache: Cache to warm up and save the keys of
+    :param path: Snapshot file
+    :param limit: Maximum amount of keys to load and save
+    :param save_interval: Seconds between two snapshots, 0 only saves on exit
+    """
+    def run():
+        warm_up(app, cache, path, limit)
+        while save_interval > 0:
+            time.sleep(save_interval)
+            save_snapshot(cache, path, limit)
+    threading.Thread(target=run, name='cache-warm-up', daemon=True).start()
+    atexit.register(save_snapshot, cache, path, limit)
+
+
+def next_page_key(path, query_string, page_number):
+    """
+    Cache key of the page after the given one, keeping the other parameters in the order the client sent them
+    so the key matches the request the client is likely to make next.
+
+    :param path: Path of the request
+    :param query_string: Decoded query string of the request
+    :param page_number: Page that was requested
+    :return: Cache key of the next page
+    """
+    parameters = [parameter for parameter in query_string.split('&') if parameter]
+    next_page = f'page={max(page_number, 1) + 1}'
+    for position, parameter in enumerate(parameters):
+        if parameter.split('=', 1)[0] == 'page':
+            parameters[position] = next_page
+            break
+    else:
+        parameters.append(next_page)
+    return f'{path}?{"&".join(parameters)}'
+
+
+class Prefetcher(object):
+    """
+    Loads keys into the cache in the background before they're asked for.
+    At most `workers` keys are prefetched at a time. Nothing is queued past that, prefetches asked for while every
+    worker is busy are dropped, so prefetching never piles up work on the database.
+    """
+    def __init__(self, app, cache, workers=2):
+        """
+        Create a new Prefetcher instance
+
+        :param app: Flask app
+        :param cache: Cache the keys go to, keys already in it are not prefetched
+        :param workers: Most keys prefetched at the same time. Defaults to 2.
+        """
+        self.app = app
+        self.cache = cache
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.prefetched = 0
+        self.dropped = 0
+
+    def prefetch(self, key):
+        """
+        Prefetch a key unless it's cached, already being prefetched, or every worker is busy.
+
+        :param key: Cache key, which is the full path of the request
+        :return: True when the prefetch was started
+        """
+        with self.lock:
+            if key in self.pending:
+                return False
+            if len(self.pending) >= self.workers:
+                self.dropped += 1
+                return False
+            self.pending.add(key)
+        if self.cache.check(key):
+            with self.lock:
+                self.pending.discard(key)
+            return False
+        self.executor.submit(self._run, key)
+        return True
+
+    def _run(self, key):
+        try:
+            replay(self.app, key)
+        except Exception:
+            log.exception(f'Prefetching {key} failed.')
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+                self.prefetched += 1
+
+    def get_stats(self):
+        return {'prefetched': self.prefetched, 'dropped': self.dropped, 'in_flight': len(self.pending)}
@@ -0,0 +1,295 @@
+# Columnar snapshots of the survey years for analytics.
+# Every question of Schema.response_columns becomes one array of integer codes plus a dictionary of the answers
+# the codes stand for, saved as .npy files so readers can memory map them. Workers mapping the same snapshot share
+# its pages through the OS page cache and never touch the database.
+#
+# Layout of a snapshot directory:
+#   <year>.json           metadata of the current snapshot of the year (rows, dictionaries, file names)
+#   <year>/<token>/*.npy  the arrays, a new token directory per export
+# The metadata file is replaced atomically after the arrays are written, so readers see either the old or the
+# new snapshot. The arrays of the previous snapshot are kept until the next export for the readers still using it.
+# Code 0 means the question was not answered, see SurveyFormat.UNANSWERED.
+# NumPy is optional, only exporting and querying snapshots needs it.
+from SurveyFormat import UNANSWERED
+from array import array
+from collections import Counter
+import AnswerStats
+import csv
+import json
+import os
+import shutil
+import threading
+import uuid
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def require_numpy():
+    """
+    Make sure NumPy can be used.
+
+    :raises RuntimeError: When NumPy is not installed
+    """
+    if numpy is None:
+        raise RuntimeError('NumPy is required for columnar snapshots, install it with "pip install numpy"')
+
+
+def code_dtype(dictionary_size):
+    """
+    Smallest unsigned integer type holding every code of a dictionary, code 0 included.
+
+    :param dictionary_size: Amount of distinct answers
+    :return: NumPy dtype
+    """
+    if dictionary_size < 256:
+        return numpy.uint8
+    if dictionary_size < 65536:
+        return numpy.uint16
+    return numpy.uint32
+
+
+def _meta_path(directory, year):
+    return os.path.join(directory, f'{year}.json')
+
+
+def _read_token(directory, year):
+    # Token of the current snapshot of a year, None when there is none
+    try:
+        with open(_meta_path(directory, year), encoding='utf8') as file:
+            return json.load(file)['token']
+    except FileNotFoundError:
+        return None
+
+
+def export_snapshot(path, year, columns, directory):
+    """
+    Write the columnar snapshot of a response file and make it the current snapshot of the year.
+
+    :param path: Path to the response CSV file
+    :param year: Year of the survey
+    :param columns: Question columns in schema order, usually the keys of Schema.response_columns
+    :param directory: Snapshot directory
+    :return: Amount of rows in the snapshot
+    """
+    require_numpy()
+    columns = list(columns)
+    dictionaries = [{} for _ in columns]
+    codes = [array('I') for _ in columns]
+    respondent_ids = array('q')
+    with open(path, newline='', encoding='utf8') as file:
+        for d in csv.DictReader(file):
+            respondent_ids.append(int(d['Respondent']))
+            for position, column in enumerate(columns):
+                answer = d.get(column)
+                if answer is None or answer in UNANSWERED:
+                    codes[position].append(0)
+                    continue
+                dictionary = dictionaries[position]
+                code = dictionary.get(answer)
+                if code is None:
+                    code = dictionary[answer] = len(dictionary) + 1
+                codes[position].append(code)
+
+    token = uuid.uuid4().hex
+    snapshot_path = os.path.join(directory, str(year), token)
+    os.makedirs(snapshot_path)
+    numpy.save(os.path.join(snapshot_path, 'respondent_id.npy'), numpy.frombuffer(respondent_ids, dtype=numpy.int64))
+    meta_columns = []
+    for position, column in enumerate(columns):
+        file_name = f'{position}.npy'
+        column_codes = numpy.frombuffer(codes[position], dtype=numpy.uint32)
+        numpy.save(os.path.join(snapshot_path, file_name), column_codes.astype(code_dtype(len(dictionaries[position]))))
+        # Dicts keep insertion order, which is the code order
+        meta_columns.append({'name': column, 'file': file_name, 'values': list(dictionaries[position])})
+    meta = {'year': year, 'token': token, 'rows': len(respondent_ids), 'respondent_id': 'respondent_id.npy',
+            'columns': meta_columns}
+    previous_token = _read_token(directory, year)
+    temporary_path = f'{_meta_path(directory, year)}.{token}'
+    with open(temporary_path, 'w', encoding='utf8') as file:
+        json.dump(meta, file)
+    os.replace(temporary_path, _meta_path(directory, year))
+
+    # The previous snapshot is kept: readers that opened it just before the swap map its columns lazily and still
+    # need the files. Anything older than that is gone from every reader after one export.
+    for old_token in os.listdir(os.path.join(directory, str(year))):
+        if old_token not in (token, previous_token):
+            shutil.rmtree(os.path.join(directory, str(year), old_token), ignore_errors=True)
+    return len(respondent_ids)
+
+
+class Snapshot(object):
+    """
+    Query engine over the memory mapped snapshot of a survey year.
+    Filters use the same predicates as AnswerStats.match_respondents(): a list of (question, [values]) tuples,
+    where a predicate matches respondents that picked any of its values, multi-select answers included.
+    """
+    def __init__(self, directory, year):
+        """
+        Open the current snapshot of a year.
+
+        :param directory: Snapshot directory
+        :param year: Year of the survey
+        :raises FileNotFoundError: When the year has no snapshot
+        """
+        require_numpy()
+        self.meta_path = _meta_path(directory, year)
+        self.meta_mtime = os.stat(self.meta_path).st_mtime_ns
+        with open(self.meta_path, encoding='utf8') as file:
+            meta = json.load(file)
+        self.year = year
+        self.rows = meta['rows']
+        self.path = os.path.join(directory, str(year), meta['token'])
+        self.files = {column['name']: column['file'] for column in meta['columns']}
+        self.dictionaries = {column['name']: column['values'] for column in meta['columns']}
+        self.respondent_id_file = meta['respondent_id']
+        # Arrays are mapped on first use, most queries only touch a few questions
+        self.arrays = {}
+
+    def _load(self, file_name):
+        data = self.arrays.get(file_name)
+        if data is None:
+            data = self.arrays[file_name] = numpy.load(os.path.join(self.path, file_name), mmap_mode='r')
+        return data
+
+    def has_question(self, question):
+        return question in self.files
+
+    def column(self, question):
+        """
+        Codes of a question, one per row.
+
+        :param question: Question column
+        :return: Memory mapped array of codes
+        :raises KeyError: When the question is not in the snapshot
+        """
+        return self._load(self.files[question])
+
+    def respondent_ids(self, mask=None):
+        """
+        Respondent IDs of the rows, optionally filtered.
+
+        :param mask: Boolean row mask from mask(), None for every row
+        :return: Array of respondent IDs
+        """
+        respondent_ids = self._load(self.respondent_id_file)
+        return respondent_ids if mask is None else respondent_ids[mask]
+
+    def mask(self, predicates, match_all=True):
+        """
+        Rows matching answer predicates. Predicates are resolved against the dictionaries first, so the rows are
+        only read once per predicate through a lookup table.
+
+        :param predicates: List of (question, [values]) tuples
+        :param match_all: True to keep rows matching every predicate (AND), False for any of them (OR)
+        :return: Boolean array with one entry per row, None when there are no predicates
+        """
+        result = None
+        for question, values in predicates:
+            if question not in self.files:
+                match = numpy.zeros(self.rows, dtype=bool)
+            else:
+                values = set(values)
+                dictionary = self.dictionaries[question]
+                lookup = numpy.zeros(len(dictionary) + 1, dtype=bool)
+                lookup[1:] = [not values.isdisjoint(AnswerStats.split_answer(answer)) for answer in dictionary]
+                match = lookup[self.column(question)]
+            if result is None:
+                result = match
+            elif match_all:
+                result &= match
+            else:
+                result |= match
+        return result
+
+    def count(self, mask=None):
+        """
+        Amount of rows, optionally filtered.
+
+        :param mask: Boolean row mask from mask(), None for every row
+        :return: Amount of rows
+        """
+        return self.rows if mask is None else int(numpy.count_nonzero(mask))
+
+    def _split_counts(self, question, code_counts):
+        # (code, count) pairs -> answer value counts, multi-select answers count once per selected value.
+        # Code 0 is unanswered and isn't counted.
+        dictionary = self.dictionaries[question]
+        counts = Counter()
+        for code, count in code_counts:
+            if code == 0:
+                continue
+            for value in AnswerStats.split_answer(dictionary[code - 1]):
+                counts[value] += count
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def value_counts(self, question, mask=None):
+        """
+        How many rows picked every value of a question.
+
+        :param question: Question column
+        :param mask: Boolean row mask from mask(), None for every row
+        :return: List of (value, count) tuples, most picked first
+        :raises KeyError: When the question is not in the snapshot
+        """
+        codes = self.column(question)
+        if mask is not None:
+            codes = codes[mask]
+        code_counts = numpy.bincount(codes)
+        present = numpy.flatnonzero(code_counts)
+        return self._split_counts(question, zip(present.tolist(), code_counts[present].tolist()))
+
+    def group_counts(self, by, question, mask=None):
+        """
+        Value counts of a question for every value of another question, e.g. languages per country.
+
+        :param by: Question column to group by
+        :param question: Question column to count
+        :param mask: Boolean row mask from mask(), None for every row
+        :return: Dict of value of by -> list of (value, count) tuples, most picked first
+        :raises KeyError: When a question is not in the snapshot
+        """
+        by_codes = self.column(by)
+        codes = self.column(question)
+        if mask is not None:
+            by_codes = by_codes[mask]
+            codes = codes[mask]
+        size = len(self.dictionaries[question]) + 1
+        # Count the (by, question) code pairs that actually occur. A dense by x question table would be the product
+        # of both dictionary sizes, which is huge for free text or numeric questions.
+        pairs, pair_counts = numpy.unique(by_codes.astype(numpy.int64) * size + codes, return_counts=True)
+        groups = {}
+        dictionary = self.dictionaries[by]
+        for by_code, code, count in zip((pairs // size).tolist(), (pairs % size).tolist(), pair_counts.tolist()):
+            if by_code == 0:
+                continue
+            for by_value in AnswerStats.split_answer(dictionary[by_code - 1]):
+                groups.setdefault(by_value, Counter())[code] += count
+        return {by_value: self._split_counts(question, code_counts.items())
+                for by_value, code_counts in groups.items()}
+
+
+# Snapshots opened by this process, reopened when an export replaces them
+snapshots = {}
+snapshots_lock = threading.Lock()
+
+
+def get_snapshot(directory, year):
+    """
+    Get the current snapshot of a year, sharing opened snapshots across calls.
+
+    :param directory: Snapshot directory
+    :param year: Year of the survey
+    :return: Snapshot instance, or None when the year has no snapshot
+    """
+    try:
+        mtime = os.stat(_meta_path(directory, year)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with snapshots_lock:
+        snapshot = snapshots.get((directory, year))
+        if snapshot is None or snapshot.meta_mtime != mtime:
+            snapshot = snapshots[directory, year] = Snapshot(directory, year)
+        return snapshot
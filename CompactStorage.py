@@ -0,0 +1,59 @@
+# Compact storage of response rows.
+# Instead of a JSON object repeating every column name of the year, a compact row is a JSON array holding the
+# values in the order of the year's Schema.response_columns. Columns found in the response file but not in the
+# schema are kept in a trailing object so nothing is lost.
+# Compact and regular rows can live side by side in the same table, they're told apart by their JSON type.
+
+
+class ResponseLayout(object):
+    """
+    Column layout of a survey year, used to turn response dicts into compact rows and back.
+    """
+    def __init__(self, columns):
+        """
+        Create a new ResponseLayout instance
+
+        :param columns: Column names in schema order, usually the keys of Schema.response_columns
+        """
+        self.columns = list(columns)
+        self.column_set = frozenset(self.columns)
+        # Column name -> position in a compact row
+        self.positions = {column: position for position, column in enumerate(self.columns)}
+
+    def compact(self, row):
+        """
+        Turn a response dict into a compact row.
+
+        :param row: Response dict, like the ones from csv.DictReader
+        :return: List of values in column order, plus a dict of unknown columns at the end if there are any
+        """
+        values = [row.get(column) for column in self.columns]
+        if len(row) != len(self.column_set) or not self.column_set.issuperset(row):
+            extras = {key: value for key, value in row.items() if key not in self.column_set}
+            if extras:
+                values.append(extras)
+        return values
+
+    def expand(self, responses):
+        """
+        Turn a compact row back into a response dict. Regular (dict) rows are returned as-is.
+
+        :param responses: Stored responses, compact or not
+        :return: Response dict
+        """
+        if not is_compact(responses):
+            return responses
+        row = dict(zip(self.columns, responses))
+        if len(responses) > len(self.columns) and isinstance(responses[-1], dict):
+            row.update(responses[-1])
+        return row
+
+
+def is_compact(responses):
+    """
+    Check whether stored responses are a compact row.
+
+    :param responses: Stored responses
+    :return: True for compact rows
+    """
+    return isinstance(responses, list)
@@ -0,0 +1,209 @@
+# Lightweight metrics in the Prometheus text exposition format.
+# Recording a value is a dict lookup and a few additions under a lock that is only contended by other writers
+# of the same metric, the text is only built when /metrics is scraped.
+import bisect
+import math
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from half a millisecond to ten seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Content type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# File the dumper writes its metrics to while loading, appended to /metrics by the REST API when set
+INGEST_METRICS_PATH = os.environ.get('PYSTACKOVERFLOW_INGEST_METRICS_PATH')
+# Seconds between two writes of the ingest metrics file
+INGEST_METRICS_INTERVAL = 1.0
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        """
+        Create a new metric
+
+        :param name: Metric name
+        :param documentation: Help text
+        :param labels: Label names, values are given in the same order when recording
+        :param function: Optional function returning {label values: value}, called when the metrics are rendered.
+                         For values already tracked elsewhere, like the cache statistics.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.function = function
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _samples(self):
+        if self.function is not None:
+            return [(self.name, values, value) for values, value in self.function().items()]
+        with self.lock:
+            return [(self.name, values, value) for values, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, values, value in self._samples():
+            labels = _format_labels(self.labels + (('le',) if name.endswith('_bucket') else ()), values)
+            lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up.
+    """
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down.
+    """
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, counted in cumulative buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # Per bucket counts (not cumulative yet), sum and count
+                series = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, labels=()):
+        """
+        Context manager observing the time spent in its block, in seconds.
+        """
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self.lock:
+            series = [(values, list(counts), total, count) for values, (counts, total, count) in self.values.items()]
+        samples = []
+        for values, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', values + (_format_value(bound),), cumulative))
+            samples.append((f'{self.name}_sum', values, total))
+            samples.append((f'{self.name}_count', values, count))
+        return samples
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+class Registry(object):
+    """
+    Set of metrics rendered together.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.write_lock = threading.Lock()
+        self.last_write = 0
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=(), function=None):
+        return self.register(Counter(name, documentation, labels, function))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """
+        Render every metric in the text exposition format.
+
+        :return: Exposition text
+        """
+        return ''.join(f'{metric.render()}\n' for metric in self.metrics)
+
+    def write(self, path):
+        """
+        Atomically write the rendered metrics to a file, for processes that are not scraped themselves.
+
+        :param path: File to write
+        """
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(temporary_path, 'w', encoding='utf8') as file:
+            file.write(self.render())
+        os.replace(temporary_path, path)
+
+    def write_every(self, path, interval=INGEST_METRICS_INTERVAL):
+        """
+        Write the rendered metrics to a file unless that was already done less than interval seconds ago.
+
+        :param path: File to write
+        :param interval: Seconds between two writes
+        """
+        now = time.monotonic()
+        with self.write_lock:
+            if now - self.last_write < interval:
+                return
+            self.last_write = now
+        self.write(path)
+
+
+# Metrics of the REST API
+registry = Registry()
+request_seconds = registry.histogram('pystackoverflow_request_seconds', 'Time spent answering requests, per route',
+                                     ('method', 'route', 'status'))
+db_query_seconds = registry.histogram('pystackoverflow_db_query_seconds',
+                                      'Time spent querying the database, per CacheDBWrapper function', ('function',))
+cache_requests = registry.counter('pystackoverflow_cache_requests_total',
+                                  'Response cache lookups per key family, result is hit or miss',
+                                  ('family', 'result'))
@@ -0,0 +1,139 @@
+# Promoted questions: survey questions copied out of the responses JSON into typed, indexed columns of
+# stackoverflow_response, so filtering on them is an index range scan instead of parsing the JSON of every row.
+# Expression indexes over the JSON would not cover compact rows (arrays in schema column order), the columns do.
+#
+# The dumper fills the columns while loading, from the answer of the question in every year that has it. Years
+# without the question leave them NULL. Multi-select questions (DevType, LanguageWorkedWith...) are better served
+# by the answer index of /responses/<year>/search, an equality filter would only match the whole answer.
+#
+# The promoted questions are not a setting, they're part of the database schema. The model columns and their
+# indexes are generated from PROMOTED_QUESTIONS, but the migration creating them (a3c94e2b7f18) is a fixed snapshot
+# of the list as it was then. Adding, removing, renaming or retyping a promoted question needs a new migration
+# (`flask db migrate`, then check the generated columns and indexes, and clear the ingest checkpoints like
+# a3c94e2b7f18 does) so the next `--bulk --resume` loads every year again.
+# Editing the list alone leaves the model out of step with the database and the queries fail on the missing column.
+from SurveyFormat import UNANSWERED
+from sqlalchemy import Float, Integer, Text
+import operator
+import re
+
+# Range filters of /responses/<year>, as <question>.<operator>=<value>
+RANGE_OPERATORS = {'gt': operator.gt, 'gte': operator.ge, 'lt': operator.lt, 'lte': operator.le}
+
+
+def parse_text(answer):
+    return answer
+
+
+def parse_number(answer):
+    try:
+        return float(answer)
+    except ValueError:
+        return None
+
+
+def parse_years(answer):
+    # Years questions mix plain numbers with "Less than 1 year" and "More than 50 years"
+    if answer.startswith('Less than'):
+        return 0
+    match = re.search(r'\d+', answer)
+    return int(match.group()) if match is not None else None
+
+
+class PromotedQuestion(object):
+    """
+    A survey question stored in a column of its own.
+    """
+    def __init__(self, question, column, type_, parse):
+        """
+        Create a new PromotedQuestion instance
+
+        :param question: Column of the question in the response file
+        :param column: Name of the stackoverflow_response column holding the answers
+        :param type_: SQLAlchemy type of the column
+        :param parse: Function turning an answer into the column value, None when it can't be converted
+        """
+        self.question = question
+        self.column = column
+        self.type = type_
+        self.parse = parse
+
+    def extract(self, responses):
+        """
+        Column value of a response.
+
+        :param responses: Dict of question -> answer, as read from the response file
+        :return: Converted answer, None when unanswered
+        """
+        answer = responses.get(self.question)
+        if answer is None or answer in UNANSWERED:
+            return None
+        return self.parse(answer)
+
+    def parse_filter(self, value):
+        """
+        Convert a filter value given in the query string to the type of the column.
+
+        :param value: Value from the query string
+        :return: Converted value
+        :raises ValueError: When the value doesn't fit the column type
+        """
+        try:
+            return self.type().python_type(value)
+        except ValueError as e:
+            raise ValueError(f'Invalid value {value} for {self.question}.') from e
+
+
+# Changing this list changes the database schema, see the top of the module
+PROMOTED_QUESTIONS = [
+    PromotedQuestion('Country', 'country', Text, parse_text),
+    PromotedQuestion('YearsCodePro', 'years_code_pro', Integer, parse_years),
+    PromotedQuestion('ConvertedComp', 'converted_comp', Float, parse_number),
+]
+
+
+def extract(responses):
+    """
+    Values of every promoted column for a response.
+
+    :param responses: Dict of question -> answer, as read from the response file
+    :return: Dict of column name -> value, every promoted column included
+    """
+    return {promoted.column: promoted.extract(responses) for promoted in PROMOTED_QUESTIONS}
+
+
+def parse_filters(args):
+    """
+    Promoted question filters of a query string, e.g. ?Country=Germany&Country=Austria&YearsCodePro.gte=5
+    Repeating an equality filter matches any of its values, every filter has to match.
+
+    :param args: Query parameters, a werkzeug MultiDict
+    :return: List of (PromotedQuestion, operator, value) tuples. The operator is 'eq' with a list of values or one
+             of RANGE_OPERATORS with a single value.
+    :raises ValueError: When a value doesn't fit the column type
+    """
+    filters = []
+    for promoted in PROMOTED_QUESTIONS:
+        values = args.getlist(promoted.question)
+        if values:
+            filters.append((promoted, 'eq', [promoted.parse_filter(value) for value in values]))
+        for name in RANGE_OPERATORS:
+            value = args.get(f'{promoted.question}.{name}')
+            if value is not None:
+                filters.append((promoted, name, promoted.parse_filter(value)))
+    return filters
+
+
+def filter_criteria(model, filters):
+    """
+    SQL criteria of promoted question filters.
+
+    :param model: Model holding the promoted columns, Response
+    :param filters: Filters from parse_filters()
+    :return: List of SQLAlchemy expressions, for filter() or where()
+    """
+    criteria = []
+    for promoted, name, value in filters:
+        column = getattr(model, promoted.column)
+        criteria.append(column.in_(value) if name == 'eq' else RANGE_OPERATORS[name](column, value))
+    return criteria
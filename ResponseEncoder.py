@@ -0,0 +1,138 @@
+from flask import current_app, json, stream_with_context
+import gzip
+import hashlib
+import zlib
+
+# Bodies smaller than this are not worth the gzip header and the CPU time
+MIN_COMPRESS_SIZE = 1024
+# zlib compression level used for the gzip'd copy. Compression only happens once per cache entry
+# so a higher level than the usual on-the-fly default is affordable.
+COMPRESS_LEVEL = 6
+# Compression level of streamed bodies, compressed on the fly for every request so cheaper than COMPRESS_LEVEL
+STREAM_COMPRESS_LEVEL = 1
+# zlib window bits producing a gzip container
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class EncodedBody(object):
+    """
+    A response body that is serialized once and sent as-is afterwards.
+    Holds the encoded JSON and, when it's big enough, a gzip'd copy of it.
+    """
+    # Data generation the body was built from, set by the cache (see CacheEngine.Generations).
+    # A class attribute so bodies pickled before it existed still have one.
+    generation = None
+
+    def __init__(self, raw, status=200, mimetype='application/json'):
+        """
+        Create a new EncodedBody instance
+
+        :param raw: Encoded body
+        :param status: HTTP status code to send the body with
+        :param mimetype: Mimetype of the body
+        """
+        self.raw = raw
+        self.status = status
+        self.mimetype = mimetype
+        self.gzipped = gzip.compress(raw, COMPRESS_LEVEL) if len(raw) >= MIN_COMPRESS_SIZE else None
+        # Strong ETags, the gzip'd copy is another representation so it gets its own
+        self.etag = hashlib.blake2b(raw, digest_size=16).hexdigest()
+        self.gzipped_etag = f'{self.etag}-gzip'
+        # Read by the cache size accounting
+        self.nbytes = len(raw) + (len(self.gzipped) if self.gzipped is not None else 0)
+
+    def pick(self, accept_encodings):
+        """
+        Pick the representation to send.
+
+        :param accept_encodings: Accept-Encoding header of the request, parsed by werkzeug
+        :return: Tuple of the body, its ETag and its Content-Encoding (None when not compressed)
+        """
+        if self.gzipped is not None and accept_encodings['gzip'] > 0:
+            return self.gzipped, self.gzipped_etag, 'gzip'
+        return self.raw, self.etag, None
+
+    def is_not_modified(self, if_none_match, etag):
+        """
+        Check whether the client already has this body, only successful bodies are revalidated.
+
+        :param if_none_match: If-None-Match header of the request, parsed by werkzeug
+        :param etag: ETag of the representation that would be sent
+        :return: True when a 304 Not Modified can be sent instead of the body
+        """
+        return self.status == 200 and if_none_match.contains_weak(etag)
+
+    def to_response(self, req, cacheable=True):
+        """
+        Build a Flask response, picking the gzip'd body when the client accepts it.
+        Successful cacheable bodies carry an ETag and the configured Cache-Control, and become a 304 Not Modified
+        when the client sends a matching If-None-Match.
+
+        :param req: The request being answered
+        :param cacheable: False for answers that can't be cached by clients or proxies (e.g. POST), which are sent
+                          without ETag and Cache-Control and never become a 304. Defaults to True.
+        :return: Flask response object
+        """
+        data, etag, encoding = self.pick(req.accept_encodings)
+        if cacheable and self.is_not_modified(req.if_none_match, etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(data, status=self.status, mimetype=self.mimetype)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+        if self.gzipped is not None:
+            response.vary.add('Accept-Encoding')
+        if cacheable and self.status == 200:
+            response.set_etag(etag)
+            cache_control = current_app.config.get('PYSTACKOVERFLOW_CACHE_CONTROL')
+            if cache_control:
+                response.headers['Cache-Control'] = cache_control
+        return response
+
+
+def encode_json(payload, status=200):
+    """
+    Serialize a payload the same way jsonify() does and wrap it in an EncodedBody.
+
+    :param payload: Object to serialize. Dataclasses (like the database models) are supported.
+    :param status: HTTP status code to send the body with
+    :return: EncodedBody instance
+    """
+    # Same formatting rules as jsonify()
+    indent = None
+    separators = (',', ':')
+    if current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug:
+        indent = 2
+        separators = (', ', ': ')
+    return EncodedBody(f'{json.dumps(payload, indent=indent, separators=separators)}\n'.encode('utf8'), status,
+                       current_app.config['JSONIFY_MIMETYPE'])
+
+
+def stream_ndjson(req, chunks):
+    """
+    Build a streaming response sending every payload as one line of JSON (NDJSON).
+    Nothing is buffered past the current chunk, so memory stays flat however many lines are sent.
+    The body is gzip'd on the fly when the client accepts it.
+
+    :param req: The request being answered
+    :param chunks: Iterable of lists of payloads, consumed while the response is sent
+    :return: Flask response object
+    """
+    compress = req.accept_encodings['gzip'] > 0
+
+    def generate():
+        compressor = zlib.compressobj(STREAM_COMPRESS_LEVEL, zlib.DEFLATED, GZIP_WBITS) if compress else None
+        for chunk in chunks:
+            data = ''.join(f'{json.dumps(payload, separators=(",", ":"))}\n' for payload in chunk).encode('utf8')
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor is not None:
+            yield compressor.flush()
+    # The request context has to outlive the view function for the database session used by chunks
+    response = current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
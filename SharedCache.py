@@ -0,0 +1,234 @@
+# Second tier cache shared by every worker process on the same host.
+# Backed by a SQLite file in WAL mode, which allows any number of concurrent readers next to a single
+# writer without readers blocking each other.
+from CacheEngine import MISSING
+import pickle
+import sqlite3
+import threading
+import time
+
+# Don't rewrite the access time of an entry more often than this (in seconds).
+# Reads would turn into writes otherwise and writes are serialized across all workers.
+TOUCH_INTERVAL = 60
+
+
+class SQLiteCache(object):
+    """
+    Cache backed by a SQLite file that can be opened by several processes at once.
+    Entries are evicted least recently used first when the file grows past max_bytes.
+    Safe to use from multiple threads, every thread gets its own connection.
+    """
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024, ttl=None, timeout=5.0, sweep_interval=60):
+        """
+        Create a new SQLiteCache instance for caching
+
+        :param path: Path of the SQLite file. Created if it doesn't exist.
+        :param max_bytes: Upper limit of the cached data size in bytes. Defaults to 1 GiB.
+        :param ttl: Default time to live of an entry in seconds. Defaults to never expiring.
+        :param timeout: Seconds to wait for another process holding the write lock.
+        :param sweep_interval: Minimum seconds between sweeps of expired entries by this process, done by inserts.
+                               Defaults to 60 seconds.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self.next_sweep = time.monotonic() + sweep_interval
+        self.local = threading.local()
+        # Stats are per process, the file is shared but the numbers are about this worker
+        self.stats_lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+        self.evict_count = 0
+        connection = self._get_connection()
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute('CREATE TABLE IF NOT EXISTS cache_entry (name TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                           'size INTEGER NOT NULL, accessed REAL NOT NULL, expires_at REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS idx_cache_entry_accessed ON cache_entry (accessed)')
+        # Running total of the entry sizes so inserts don't need a SUM() over the whole table
+        connection.execute('CREATE TABLE IF NOT EXISTS cache_meta (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                           'total_bytes INTEGER NOT NULL)')
+        connection.execute('INSERT OR IGNORE INTO cache_meta (id, total_bytes) VALUES (0, 0)')
+        connection.execute('COMMIT')
+
+    def _get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # Autocommit mode, transactions are opened explicitly where needed
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def _count(self, attribute, amount=1):
+        with self.stats_lock:
+            setattr(self, attribute, getattr(self, attribute) + amount)
+
+    def _delete(self, connection, name, size):
+        connection.execute('DELETE FROM cache_entry WHERE name = ?', (name,))
+        connection.execute('UPDATE cache_meta SET total_bytes = total_bytes - ? WHERE id = 0', (size,))
+
+    def insert(self, name, data, ttl=None):
+        """
+        Insert new data, replacing the existing data of the key.
+
+        :param name: Name of the key
+        :param data: Data that the key represents. Must be picklable.
+        :param ttl: Time to live of this entry in seconds. Defaults to the cache TTL.
+        :return: Inserted data
+        """
+        blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return data
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        connection = self._get_connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Expired entries still count towards max_bytes, they go before live ones are pruned
+            if time.monotonic() >= self.next_sweep:
+                self._sweep(connection)
+            old = connection.execute('SELECT size FROM cache_entry WHERE name = ?', (name,)).fetchone()
+            if old is not None:
+                self._delete(connection, name, old[0])
+            connection.execute('INSERT INTO cache_entry (name, data, size, accessed, expires_at) VALUES (?, ?, ?, ?, ?)',
+                               (name, blob, len(blob), now, expires_at))
+            connection.execute('UPDATE cache_meta SET total_bytes = total_bytes + ? WHERE id = 0', (len(blob),))
+            self._prune(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._count('miss_count')
+        return data
+
+    def update(self, name, data, ttl=None):
+        if not self.check(name):
+            return None
+        return self.insert(name, data, ttl)
+
+    def get(self, name, default=None):
+        """
+        Get cached data and count it as a hit.
+
+        :param name: Name of the key
+        :param default: Value returned when the key is not cached
+        :return: Cached data, or default if the key is not cached
+        """
+        connection = self._get_connection()
+        row = connection.execute('SELECT data, accessed, expires_at FROM cache_entry WHERE name = ?',
+                                 (name,)).fetchone()
+        now = time.time()
+        if row is None or (row[2] is not None and row[2] <= now):
+            # Expired entries are left for the sweep of a later insert, no point in taking the write lock here
+            return default
+        if now - row[1] > TOUCH_INTERVAL:
+            connection.execute('UPDATE cache_entry SET accessed = ? WHERE name = ?', (now, name))
+        self._count('hit_count')
+        return pickle.loads(row[0])
+
+    def check(self, name):
+        row = self._get_connection().execute('SELECT expires_at FROM cache_entry WHERE name = ?', (name,)).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def _prune(self, connection):
+        """
+        Evict least recently used entries until the file fits max_bytes. Runs inside the insert transaction.
+        """
+        total_bytes = connection.execute('SELECT total_bytes FROM cache_meta WHERE id = 0').fetchone()[0]
+        while total_bytes > self.max_bytes:
+            victims = connection.execute('SELECT name, size FROM cache_entry ORDER BY accessed LIMIT 64').fetchall()
+            if not victims:
+                break
+            for name, size in victims:
+                self._delete(connection, name, size)
+                total_bytes -= size
+                self._count('evict_count')
+                if total_bytes <= self.max_bytes:
+                    break
+
+    def _sweep(self, connection):
+        """
+        Remove every expired entry. Runs inside a write transaction.
+
+        :return: Amount of entries removed
+        """
+        self.next_sweep = time.monotonic() + self.sweep_interval
+        expired = connection.execute('SELECT name, size FROM cache_entry WHERE expires_at <= ?',
+                                     (time.time(),)).fetchall()
+        for name, size in expired:
+            self._delete(connection, name, size)
+        self._count('evict_count', len(expired))
+        return len(expired)
+
+    def sweep(self):
+        """
+        Remove every expired entry.
+
+        :return: Amount of entries removed
+        """
+        connection = self._get_connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            removed = self._sweep(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return removed
+
+    def get_stats(self):
+        entries, total_bytes = self._get_connection().execute(
+            'SELECT (SELECT COUNT(*) FROM cache_entry), total_bytes FROM cache_meta WHERE id = 0').fetchone()
+        return {'hits': self.hit_count, 'misses': self.miss_count, 'evicted': self.evict_count,
+                'entries': entries, 'bytes': total_bytes, 'max_bytes': self.max_bytes}
+
+
+class TieredCache(object):
+    """
+    In-process cache (L1) in front of a shared cache (L2).
+    L1 misses are looked up in L2 and copied into L1 when found, so a page computed by one worker
+    is served from memory by the others after their first request for it.
+    """
+    def __init__(self, l1, l2):
+        """
+        Create a new TieredCache instance
+
+        :param l1: In-process cache with put(), usually a StripedLFUCache
+        :param l2: Shared cache, usually a SQLiteCache
+        """
+        self.l1 = l1
+        self.l2 = l2
+
+    def insert(self, name, data, ttl=None):
+        self.l2.insert(name, data, ttl)
+        return self.l1.insert(name, data, ttl)
+
+    def update(self, name, data, ttl=None):
+        self.l2.update(name, data, ttl)
+        return self.l1.update(name, data, ttl)
+
+    def get(self, name, default=None):
+        data = self.l1.get(name, MISSING)
+        if data is not MISSING:
+            return data
+        data = self.l2.get(name, MISSING)
+        if data is MISSING:
+            return default
+        # Not a miss of L1 as far as the statistics go, the request was answered by L2
+        self.l1.put(name, data)
+        return data
+
+    def check(self, name):
+        return self.l1.check(name) or self.l2.check(name)
+
+    def sweep(self):
+        return self.l1.sweep() + self.l2.sweep()
+
+    def get_stats(self, with_entries=True):
+        stats = self.l1.get_stats(with_entries)
+        stats.update({'l2': self.l2.get_stats()})
+        return stats
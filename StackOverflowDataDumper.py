@@ -1,4 +1,12 @@
-from ExampleStackOverflowRest import db, Response, Schema
+from ExampleStackOverflowRest import db, DataGeneration, Response, Schema
+from BatchController import BatchController, estimate_row_size
+import BulkLoader
+import AnswerStats
+import ColumnarSnapshot
+import Metrics
+import PromotedQuestions
+from CompactStorage import ResponseLayout
+import argparse
 import csv
 import logging
 import time
@@ -9,13 +17,24 @@ import time
 # - Break out code that can be shared across dumper and REST to a common Python file
 # - [in progress] Appropriately document internal code in Python file
 # - Put available public API on README.md (or appropriate file)
-# - Enable argument support for dumper
+# - [in progress] Enable argument support for dumper
 # - [in progress] Cut down indentations (preferably below 3 levels of indentation)
 # - Allow customization of logging verbosity
 # - Make code sorta testable
 
 # Directory path (relative to script location for the time being)
 DIR = 'stackoverflow_data'
+# Survey years to load
+YEARS = range(2017, 2021)
+
+# Ingest metrics, written to Metrics.INGEST_METRICS_PATH when set so the REST API can expose them on /metrics
+metrics = Metrics.Registry()
+ingest_rows = metrics.counter('pystackoverflow_ingest_rows_total', 'Responses loaded by the dumper', ('year',))
+ingest_rows_per_second = metrics.gauge('pystackoverflow_ingest_rows_per_second',
+                                       'Load rate of the last committed batch, reading included', ('year',))
+ingest_commit_seconds = metrics.histogram('pystackoverflow_ingest_commit_seconds',
+                                          'Time spent writing and committing a batch', ('year',),
+                                          buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
 
 # Loggy bits
 log = logging.getLogger('__name__')
@@ -24,13 +43,6 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 log.addHandler(ch)
 
-# Start timer before launching
-all_op_start_time = time.time_ns()
-total_data = 0
-dump_rate = 1000
-log.info(f'Begin processing schema data located at "{DIR}".')
-elapsed_time = 0
-
 
 def measure_time(func):
     """
@@ -59,81 +71,377 @@ def commit_data():
     log.debug('Commit success.')
 
 
-# Assume the directory is labelled by year
-# TODO: write in README about expected format
-for i in range(2017, 2021):
-    log.info(f'Start processing StackOverflow schema data for year {str(i)}.')
-    with open('/'.join([DIR, str(i), 'survey_results_schema.csv']), newline='',
-              encoding='utf8') as file:
-        log.info(f'File "{file.name}" successfully opened.')
-        data = csv.DictReader(file)
-        row = {}
-        log.info(f'Extracting schema data from "{file.name}"...')
-        for d in data:
-            log.debug(f'Discovered data {d}.')
-            k, v = d.keys()
-            row.update({d[k]: d[v]})
-            log.debug(f'Extracted data with key {k} and value {v}')
-        log.debug(f'Schema data extraction for year {str(i)} completed.')
-        log.debug(f'Saving extracted schema data for year {str(i)} to database...')
-        log.debug(f'Begin creating schema object with data {row}')
-        schema = Schema(i, row)
-        log.debug(f'Adding schema object {schema}...')
-        db.session.add(schema)
-        log.debug('Schema object created successfully.')
-    commit_data()
-    log.info(f'Schema data for year {str(i)} extracted.')
-log.info('Finished processing all schema data')
-
-log.info(f'Start processing response data from {DIR}.')
-for i in range(2017, 2021):
-    count = 0
-    next_check = dump_rate
-    log.info(f'Start processing StackOverflow response data for year {str(i)}.')
-
-    with open('/'.join([DIR, str(i), 'survey_results_public.csv']), newline='',
-              encoding='utf8') as file:
-        log.info(f'Response data "{file.name}" opened successfully.')
-        data = csv.DictReader(file)
-        log.info(f'Extracting response data from "{file.name}". This may take a long time.')
-
-        for d in data:
+def record_batch(year, rows, commit_time, batch_time):
+    """
+    Record a committed batch in the ingest metrics.
+
+    :param year: Year of the batch
+    :param rows: Rows in the batch
+    :param commit_time: Time spent writing and committing the batch in nanoseconds
+    :param batch_time: Time taken by the whole batch (reading included) in nanoseconds
+    """
+    ingest_rows.inc((year,), rows)
+    ingest_commit_seconds.observe(commit_time / 1000000000, (year,))
+    ingest_rows_per_second.set(round(rows / max(batch_time / 1000000000, 1e-9)), (year,))
+    if Metrics.INGEST_METRICS_PATH:
+        metrics.write_every(Metrics.INGEST_METRICS_PATH)
+
+
+def load_schemas(years):
+    """
+    Load the schema data of every year.
+
+    :param years: Years to load
+    """
+    log.info(f'Begin processing schema data located at "{DIR}".')
+    # Assume the directory is labelled by year
+    # TODO: write in README about expected format
+    for i in years:
+        log.info(f'Start processing StackOverflow schema data for year {str(i)}.')
+        with open('/'.join([DIR, str(i), 'survey_results_schema.csv']), newline='',
+                  encoding='utf8') as file:
+            log.info(f'File "{file.name}" successfully opened.')
+            data = csv.DictReader(file)
             row = {}
-            log.debug(f'Discovered data {d}')
-            log.debug(f'Extracted data with key {k} and value {v}')
-
-            log.debug(f'Begin creating response object with data {row}')
-            response = Response(d['Respondent'], i, d)
-            log.debug(f'Response object created with data {response}.')
-            log.debug(f'Begin saving response data {response} into database...')
-            db.session.add(response)
-            log.debug('Response data saved.')
-
-            if count == next_check:
-                _, _, elapsed_time = commit_data()
-                log.info(
-                    f'Dump rate is {dump_rate}. Inserted {count} rows of data. It took '
-                    f'{round(elapsed_time / 1000000000, 3)}s to commit.')
-                if dump_rate < 500:
-                    dump_rate = 1000
-                    log.info(f'Dump rate limited to {dump_rate} rows.')
-                elif elapsed_time > 10 * (10 ** 9):
-
-                    dump_rate -= 1000 if dump_rate != 0 else 1000
-                    log.info(f'Commit time took longer than 10 seconds. Decreasing dump rate to {dump_rate} rows...')
-                elif elapsed_time < 10 * (10 ** 9):
-                    dump_rate += 500
-                    log.info(f'Commit time is faster than 10 seconds. Increasing dump rate to {dump_rate} rows...')
-                next_check = count + dump_rate
-            count += 1
-        log.info(f'Loaded {count} responses for year {str(i)}')
-        log.info(f'Data successfully extracted. Committing one final time...')
-        _, _, elapsed_time = commit_data()
-        log.info(
-            f'Dump rate is {dump_rate}. Inserted {count} rows of data. It took '
-            f'{round(elapsed_time / 1000000000, 3)}s to commit.')
-        log.info(f'Response data for year {str(i)} completed.')
+            log.info(f'Extracting schema data from "{file.name}"...')
+            for d in data:
+                log.debug(f'Discovered data {d}.')
+                k, v = d.keys()
+                row.update({d[k]: d[v]})
+                log.debug(f'Extracted data with key {k} and value {v}')
+            log.debug(f'Schema data extraction for year {str(i)} completed.')
+            log.debug(f'Saving extracted schema data for year {str(i)} to database...')
+            log.debug(f'Begin creating schema object with data {row}')
+            schema = Schema(i, row)
+            log.debug(f'Adding schema object {schema}...')
+            # merge() so loading again replaces the schema instead of failing on the existing row
+            db.session.merge(schema)
+            log.debug('Schema object created successfully.')
+        commit_data()
+        log.info(f'Schema data for year {str(i)} extracted.')
+    log.info('Finished processing all schema data')
+
+
+def get_layouts(years):
+    """
+    Get the column layouts of every year from the loaded schemas, for storing compact rows.
+
+    :param years: Years to get the layouts of
+    :return: Dict of year -> ResponseLayout
+    """
+    return {i: ResponseLayout(db.session.query(Schema).get(i).response_columns.keys()) for i in years}
+
+
+def load_responses(years, controller, layouts):
+    """
+    Load the response data of every year one ORM object at a time.
+
+    :param years: Years to load
+    :param controller: BatchController deciding how many rows go in a commit
+    :param layouts: Dict of year -> ResponseLayout to store compact rows, empty to store regular rows
+    :return: Amount of responses loaded
+    """
+    total_data = 0
+    log.info(f'Start processing response data from {DIR}.')
+    for i in years:
+        count = 0
+        pending_rows = 0
+        pending_bytes = 0
+        batch_start_time = time.time_ns()
+        log.info(f'Start processing StackOverflow response data for year {str(i)}.')
+
+        with open('/'.join([DIR, str(i), 'survey_results_public.csv']), newline='',
+                  encoding='utf8') as file:
+            log.info(f'Response data "{file.name}" opened successfully.')
+            data = csv.DictReader(file)
+            log.info(f'Extracting response data from "{file.name}". This may take a long time.')
+
+            for d in data:
+                log.debug(f'Discovered data {d}')
+
+                log.debug(f'Begin creating response object with data {d}')
+                response = Response(d['Respondent'], i, layouts[i].compact(d) if i in layouts else d)
+                for column, value in PromotedQuestions.extract(d).items():
+                    setattr(response, column, value)
+                log.debug(f'Response object created with data {response}.')
+                log.debug(f'Begin saving response data {response} into database...')
+                db.session.add(response)
+                log.debug('Response data saved.')
+                count += 1
+                pending_rows += 1
+                pending_bytes += estimate_row_size(d)
+
+                if controller.should_commit(pending_rows, pending_bytes):
+                    _, end_time, elapsed_time = commit_data()
+                    decision = controller.update(pending_rows, pending_bytes, elapsed_time,
+                                                 end_time - batch_start_time)
+                    record_batch(i, pending_rows, elapsed_time, end_time - batch_start_time)
+                    log.info(
+                        f'Inserted {count} rows of data. Committing {pending_rows} rows ({pending_bytes} bytes) took '
+                        f'{round(elapsed_time / 1000000000, 3)}s at {decision["rows_per_second"]} rows/s. '
+                        f'Next batch is {decision["batch_size"]} rows ({decision["action"]}, {decision["reason"]}).')
+                    pending_rows = 0
+                    pending_bytes = 0
+                    batch_start_time = time.time_ns()
+            log.info(f'Loaded {count} responses for year {str(i)}')
+            log.info(f'Data successfully extracted. Committing one final time...')
+            _, end_time, elapsed_time = commit_data()
+            if pending_rows > 0:
+                record_batch(i, pending_rows, elapsed_time, end_time - batch_start_time)
+            log.info(
+                f'Batch size is {controller.batch_size}. Inserted {count} rows of data. It took '
+                f'{round(elapsed_time / 1000000000, 3)}s to commit.')
+            log.info(f'Response data for year {str(i)} completed.')
+            total_data += count
+    return total_data
+
+
+def bulk_load_responses(years, batch_size, layouts):
+    """
+    Load the response data of every year through BulkLoader (batched Core inserts, or COPY on PostgreSQL).
+
+    :param years: Years to load
+    :param batch_size: Amount of rows per batch
+    :param layouts: Dict of year -> ResponseLayout to store compact rows, empty to store regular rows
+    :return: Amount of responses loaded
+    """
+    total_data = 0
+    log.info(f'Start bulk loading response data from {DIR} in batches of {batch_size} rows.')
+    for i in years:
+        path = '/'.join([DIR, str(i), 'survey_results_public.csv'])
+        log.info(f'Start bulk loading StackOverflow response data for year {str(i)} from "{path}".')
+        start_time = time.time_ns()
+        last_batch_time = [start_time]
+
+        def report(count, batch_count, write_time):
+            now = time.time_ns()
+            record_batch(i, batch_count, write_time, now - last_batch_time[0])
+            last_batch_time[0] = now
+            log.debug(f'Inserted batch of {batch_count} rows, {count} rows so far.')
+
+        count = BulkLoader.bulk_load_responses(path, i, batch_size, report, layouts.get(i))
+        elapsed_time = time.time_ns() - start_time
+        log.info(f'Loaded {count} responses for year {str(i)} in {round(elapsed_time / 1000000000, 3)}s '
+                 f'({round(count / max(elapsed_time / 1000000000, 1e-9))} rows/s).')
+        total_data += count
+    return total_data
+
+
+def resumable_load_responses(years, batch_size, layouts):
+    """
+    Load the response data of every year with checkpoints, resuming interrupted loads and skipping unchanged files.
+
+    :param years: Years to load
+    :param batch_size: Amount of rows per batch
+    :param layouts: Dict of year -> ResponseLayout to store compact rows, empty to store regular rows
+    :return: Tuple of the amount of responses loaded and the list of years that were loaded or resumed, skipped
+             years left out
+    """
+    total_data = 0
+    loaded_years = []
+    log.info(f'Start resumable loading of response data from {DIR} in batches of {batch_size} rows.')
+    for i in years:
+        path = '/'.join([DIR, str(i), 'survey_results_public.csv'])
+        log.info(f'Start resumable loading of StackOverflow response data for year {str(i)} from "{path}".')
+        start_time = time.time_ns()
+        last_batch_time = [start_time]
+
+        def report(count, batch_count, write_time):
+            now = time.time_ns()
+            record_batch(i, batch_count, write_time, now - last_batch_time[0])
+            last_batch_time[0] = now
+            log.debug(f'Upserted batch of {batch_count} rows, {count} rows committed for the year.')
+
+        count, status = BulkLoader.resumable_load_responses(path, i, batch_size, report, layouts.get(i))
+        elapsed_time = time.time_ns() - start_time
+        if status == 'skipped':
+            log.info(f'Response data for year {str(i)} is unchanged since the last complete load. Skipped.')
+        else:
+            log.info(f'{status.capitalize()} {count} responses for year {str(i)} in '
+                     f'{round(elapsed_time / 1000000000, 3)}s.')
+            loaded_years.append(i)
         total_data += count
-all_op_end_time = time.time_ns()
-log.info(f'Finished processing all response data. Loaded {total_data} rows in '
-         f'{round((all_op_end_time - all_op_start_time) / 1000000000, 3)}s.')
+    return total_data, loaded_years
+
+
+def pipelined_load_responses(years, batch_size, workers, writers, queue_size, layouts):
+    """
+    Load the response data of every year with parser processes and writer threads running side by side.
+
+    :param years: Years to load
+    :param batch_size: Amount of rows per batch
+    :param workers: Amount of parser processes
+    :param writers: Amount of writer threads
+    :param queue_size: Maximum amount of parsed batches waiting to be inserted
+    :param layouts: Dict of year -> ResponseLayout to store compact rows, empty to store regular rows
+    :return: Amount of responses loaded
+    """
+    log.info(f'Start pipelined loading of response data from {DIR} with {workers} parser(s), {writers} writer(s) '
+             f'and batches of {batch_size} rows.')
+    files = [('/'.join([DIR, str(i), 'survey_results_public.csv']), i) for i in years]
+    start_time = time.time_ns()
+    # Writer threads report concurrently, batches of a year are timed from the previous batch of any year
+    last_batch_time = [start_time]
+
+    def report(year, count, batch_count, write_time):
+        now = time.time_ns()
+        record_batch(year, batch_count, write_time, now - last_batch_time[0])
+        last_batch_time[0] = now
+        log.debug(f'Inserted batch of {batch_count} rows for year {str(year)}, {count} rows so far.')
+
+    counts = BulkLoader.pipelined_load_responses(files, workers, writers, batch_size, queue_size, report, layouts)
+    elapsed_time = time.time_ns() - start_time
+    for i in years:
+        log.info(f'Loaded {counts.get(i, 0)} responses for year {str(i)}.')
+    total_data = sum(counts.values())
+    log.info(f'Pipelined load took {round(elapsed_time / 1000000000, 3)}s '
+             f'({round(total_data / max(elapsed_time / 1000000000, 1e-9))} rows/s).')
+    return total_data
+
+
+def materialize_answer_index(years):
+    """
+    Count and index the answers of every year for the /stats and /responses/<year>/search endpoints.
+
+    :param years: Years to index
+    :return: Amount of (question, value) rows saved
+    """
+    total_rows = 0
+    for i in years:
+        path = '/'.join([DIR, str(i), 'survey_results_public.csv'])
+        log.info(f'Indexing answers for year {str(i)} from "{path}".')
+        start_time = time.time_ns()
+        rows = AnswerStats.materialize_answer_index(path, i)
+        log.info(f'Saved {rows} answer counts and postings for year {str(i)} in '
+                 f'{round((time.time_ns() - start_time) / 1000000000, 3)}s.')
+        total_rows += rows
+    return total_rows
+
+
+def export_snapshots(years, directory):
+    """
+    Write the columnar snapshot of every year for the /analytics endpoint.
+
+    :param years: Years to export
+    :param directory: Snapshot directory
+    :return: Amount of rows exported
+    """
+    total_rows = 0
+    for i in years:
+        path = '/'.join([DIR, str(i), 'survey_results_public.csv'])
+        log.info(f'Exporting columnar snapshot for year {str(i)} from "{path}" to "{directory}".')
+        start_time = time.time_ns()
+        rows = ColumnarSnapshot.export_snapshot(path, i, db.session.query(Schema).get(i).response_columns.keys(),
+                                                directory)
+        log.info(f'Exported {rows} rows for year {str(i)} in {round((time.time_ns() - start_time) / 1000000000, 3)}s.')
+        total_rows += rows
+    return total_rows
+
+
+def bump_data_generations(years):
+    """
+    Move every year to its next data generation, which tells the REST API to drop what it cached for them.
+    Done once everything of the years is written, so nothing cached in between survives. Only pass the years that
+    were actually written, the cache of every other year stays valid.
+
+    :param years: Years that were loaded
+    """
+    table = DataGeneration.__table__
+    with db.engine.begin() as connection:
+        for i in years:
+            updated = connection.execute(table.update().where(table.c.year == i).values(
+                generation=table.c.generation + 1)).rowcount
+            if updated == 0:
+                connection.execute(table.insert().values(year=i, generation=1))
+    log.info(f'Bumped the data generation of years {", ".join(str(i) for i in years)}.')
+
+
+def get_populated_years(years):
+    """
+    Years that already have responses in the database.
+
+    :param years: Years to check
+    :return: List of years with at least one response
+    """
+    return [i for i in years if db.session.query(Response.query.filter_by(response_year=i).exists()).scalar()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load StackOverflow Insights data into the database.')
+    parser.add_argument('--max-commit-time', type=float, default=10.0,
+                        help='Longest acceptable commit in seconds, the batch size shrinks past it. Defaults to 10.')
+    parser.add_argument('--max-batch-mb', type=int, default=256,
+                        help='Most response data allowed to wait for a commit, in MiB. Defaults to 256.')
+    parser.add_argument('--compact', action='store_true',
+                        help='Store responses as arrays in schema column order instead of objects repeating every '
+                             'column name. The REST API expands them back transparently.')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Load responses with batched Core inserts (COPY on PostgreSQL) instead of the ORM')
+    parser.add_argument('--batch-size', type=int, default=BulkLoader.DEFAULT_BATCH_SIZE,
+                        help=f'Rows per batch in bulk mode. Defaults to {BulkLoader.DEFAULT_BATCH_SIZE}.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Checkpoint every batch and upsert rows (bulk mode only). Resumes an interrupted load '
+                             'and skips years whose file did not change.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Parse files in this many processes while inserting in parallel (bulk mode only). '
+                             'Defaults to 0, which loads one year after another.')
+    parser.add_argument('--writers', type=int, default=2,
+                        help='Writer threads used with --workers. Defaults to 2.')
+    parser.add_argument('--queue-size', type=int, default=BulkLoader.DEFAULT_QUEUE_SIZE,
+                        help=f'Parsed batches allowed to wait for a writer with --workers. '
+                             f'Defaults to {BulkLoader.DEFAULT_QUEUE_SIZE}.')
+    parser.add_argument('--skip-stats', action='store_true',
+                        help='Don\'t count and index the answers of every question for the /stats and '
+                             '/responses/<year>/search endpoints')
+    parser.add_argument('--snapshot-dir',
+                        help='Also export a columnar snapshot of every year to this directory for the /analytics '
+                             'endpoint. Needs NumPy.')
+    args = parser.parse_args()
+    if args.snapshot_dir and ColumnarSnapshot.numpy is None:
+        parser.error('--snapshot-dir needs NumPy, install it with "pip install numpy"')
+    if args.resume and args.workers > 0:
+        parser.error('--resume loads one batch after another and can\'t be combined with --workers')
+    return args
+
+
+def main():
+    args = parse_args()
+    if not (args.bulk and args.resume):
+        # Only resumable loads replace existing rows, the other paths would fail on the unique respondent index
+        populated_years = get_populated_years(YEARS)
+        if populated_years:
+            log.error(f'Responses of years {", ".join(str(i) for i in populated_years)} are already loaded. '
+                      f'Load them again with --bulk --resume, which replaces the rows of changed files.')
+            raise SystemExit(1)
+    # Start timer before launching
+    all_op_start_time = time.time_ns()
+    load_schemas(YEARS)
+    layouts = get_layouts(YEARS) if args.compact else {}
+    # Years whose responses were written by this run, the later stages leave the other years alone
+    loaded_years = list(YEARS)
+    if args.bulk and args.resume:
+        total_data, loaded_years = resumable_load_responses(YEARS, args.batch_size, layouts)
+    elif args.bulk and args.workers > 0:
+        total_data = pipelined_load_responses(YEARS, args.batch_size, args.workers, args.writers, args.queue_size,
+                                              layouts)
+    elif args.bulk:
+        total_data = bulk_load_responses(YEARS, args.batch_size, layouts)
+    else:
+        controller = BatchController(max_commit_time=args.max_commit_time,
+                                     max_batch_bytes=args.max_batch_mb * 1024 * 1024)
+        total_data = load_responses(YEARS, controller, layouts)
+    if not args.skip_stats:
+        materialize_answer_index(loaded_years)
+    if args.snapshot_dir:
+        export_snapshots(loaded_years, args.snapshot_dir)
+    if loaded_years:
+        bump_data_generations(loaded_years)
+    all_op_end_time = time.time_ns()
+    if Metrics.INGEST_METRICS_PATH:
+        metrics.write(Metrics.INGEST_METRICS_PATH)
+    log.info(f'Finished processing all response data. Loaded {total_data} rows in '
+             f'{round((all_op_end_time - all_op_start_time) / 1000000000, 3)}s.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+# Conventions of the StackOverflow survey files shared by everything reading them.
+
+# Answers the survey files use for unanswered questions
+UNANSWERED = frozenset({'', 'NA'})
@@ -0,0 +1,87 @@
+# Shared setup of the tests.
+# The app reads its configuration from the environment when it's imported, so the environment is set here, before
+# any test module imports it. Every test runs against a throwaway SQLite database filled from small survey files
+# written by write_survey(). Each test module works on a year of its own, 2000 + the number of the request it
+# tests (2007 for user-007), so cached bodies of one module never show up in another.
+import atexit
+import csv
+import os
+import shutil
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix='pystackoverflow-tests-')
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+
+os.environ['PYSTACKOVERFLOW_DATABASE_URI'] = f'sqlite:///{os.path.join(DATA_DIR, "pystackoverflow.sqlite")}'
+# Read the data generations on every request, a load has to show up right away
+os.environ['PYSTACKOVERFLOW_GENERATION_CHECK_INTERVAL'] = '0'
+# Nothing shared with other processes or left behind by the tests
+for name in ('PYSTACKOVERFLOW_L2_CACHE_PATH', 'PYSTACKOVERFLOW_WARMUP_PATH', 'PYSTACKOVERFLOW_SNAPSHOT_DIR',
+             'PYSTACKOVERFLOW_PREFETCH_WORKERS', 'PYSTACKOVERFLOW_INGEST_METRICS_PATH'):
+    os.environ.pop(name, None)
+
+from ExampleStackOverflowRest import app, db
+import StackOverflowDataDumper
+
+db.create_all()
+StackOverflowDataDumper.DIR = DATA_DIR
+
+# Questions of the generated survey files, Respondent included
+QUESTIONS = ['Respondent', 'Country', 'YearsCodePro', 'ConvertedComp', 'LanguageWorkedWith']
+COUNTRIES = ['Germany', 'Austria', 'Malaysia', 'NA']
+LANGUAGES = ['Python', 'Rust;Go', 'C#;Python', 'NA']
+
+
+def make_rows(count, start=1):
+    """
+    Generate survey answers.
+
+    :param count: Amount of respondents
+    :param start: Respondent ID of the first respondent
+    :return: List of dicts of question -> answer
+    """
+    return [{'Respondent': str(respondent), 'Country': COUNTRIES[respondent % len(COUNTRIES)],
+             'YearsCodePro': str(respondent % 30), 'ConvertedComp': str(respondent * 1000),
+             'LanguageWorkedWith': LANGUAGES[respondent % len(LANGUAGES)]}
+            for respondent in range(start, start + count)]
+
+
+def write_survey(year, rows, questions=None):
+    """
+    Write the schema and response files of a year where the dumper reads them from.
+
+    :param year: Survey year
+    :param rows: Answers from make_rows()
+    :param questions: Questions of the files, defaults to QUESTIONS
+    :return: Path of the response file
+    """
+    questions = questions or QUESTIONS
+    directory = os.path.join(DATA_DIR, str(year))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'survey_results_schema.csv'), 'w', newline='', encoding='utf8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Column', 'QuestionText'])
+        writer.writerows([question, f'Question {question}'] for question in questions)
+    path = os.path.join(directory, 'survey_results_public.csv')
+    with open(path, 'w', newline='', encoding='utf8') as file:
+        writer = csv.DictWriter(file, questions, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def load_survey(year, rows, questions=None):
+    """
+    Write the files of a year and load them the way `StackOverflowDataDumper.py --bulk --resume` does.
+
+    :param year: Survey year
+    :param rows: Answers from make_rows()
+    :param questions: Questions of the files, defaults to QUESTIONS
+    :return: Years that were loaded, empty when the files didn't change since the last load
+    """
+    write_survey(year, rows, questions)
+    StackOverflowDataDumper.load_schemas([year])
+    _, loaded_years = StackOverflowDataDumper.resumable_load_responses([year], 10, {})
+    if loaded_years:
+        StackOverflowDataDumper.bump_data_generations(loaded_years)
+    return loaded_years
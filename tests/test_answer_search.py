@@ -0,0 +1,67 @@
+from tests import app, make_rows, write_survey
+import AnswerStats
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2015
+
+
+class PostingEncodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(AnswerStats.decode_respondents(AnswerStats.encode_respondents([7, 3, 3, 100000, 1])),
+                         [1, 3, 7, 100000])
+        self.assertEqual(AnswerStats.decode_respondents(AnswerStats.encode_respondents([])), [])
+
+    def test_match_respondents(self):
+        postings = {('A', 'x'): [1, 2, 3], ('A', 'y'): [4], ('B', 'z'): [2, 4, 5]}
+        self.assertEqual(AnswerStats.match_respondents(postings, [('A', ['x', 'y']), ('B', ['z'])]), [2, 4])
+        self.assertEqual(AnswerStats.match_respondents(postings, [('A', ['y']), ('B', ['z'])], False), [2, 4, 5])
+        self.assertEqual(AnswerStats.match_respondents(postings, [('A', ['unknown'])]), [])
+
+
+class SearchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(40)
+        write_survey(YEAR, cls.rows)
+        StackOverflowDataDumper.load_schemas([YEAR])
+        StackOverflowDataDumper.bulk_load_responses([YEAR], 10, {})
+        StackOverflowDataDumper.materialize_answer_index([YEAR])
+        StackOverflowDataDumper.bump_data_generations([YEAR])
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def search(self, query):
+        response = self.client.get(f'/responses/{YEAR}/search?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json['total'], [response['respondent_id'] for response in response.json['responses']]
+
+    def expected(self, match):
+        respondents = [int(row['Respondent']) for row in self.rows if match(row)]
+        return len(respondents), respondents
+
+    def test_multi_select_values_match(self):
+        self.assertEqual(self.search('where=LanguageWorkedWith:Python&size=100'),
+                         self.expected(lambda row: 'Python' in row['LanguageWorkedWith'].split(';')))
+
+    def test_match_all_and_any(self):
+        self.assertEqual(self.search('where=LanguageWorkedWith:Go&where=Country:Austria|Germany&size=100'),
+                         self.expected(lambda row: 'Go' in row['LanguageWorkedWith']
+                                       and row['Country'] in ('Austria', 'Germany')))
+        self.assertEqual(self.search('where=LanguageWorkedWith:Go&where=Country:Germany&match=any&size=100'),
+                         self.expected(lambda row: 'Go' in row['LanguageWorkedWith'] or row['Country'] == 'Germany'))
+
+    def test_pages(self):
+        total, respondents = self.expected(lambda row: row['Country'] != 'NA')
+        first = self.search('where=Country:Austria|Germany|Malaysia&size=20')
+        second = self.search('where=Country:Austria|Germany|Malaysia&size=20&page=2')
+        self.assertEqual((first[0], first[1] + second[1]), (total, respondents))
+
+    def test_invalid_filters(self):
+        for query in ('', 'where=Country', 'where=:Germany', 'where=Country:Germany&match=some'):
+            self.assertEqual(self.client.get(f'/responses/{YEAR}/search?{query}').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
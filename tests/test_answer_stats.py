@@ -0,0 +1,69 @@
+from collections import Counter
+from tests import DATA_DIR, QUESTIONS, app, make_rows, write_survey
+import AnswerStats
+import ColumnarSnapshot
+import StackOverflowDataDumper
+import os
+import unittest
+
+YEAR = 2014
+
+
+def expected_counts(rows, question):
+    # Respondents per answer value, unanswered questions left out
+    counts = Counter(value for row in rows for value in row[question].split(';') if value not in ('', 'NA'))
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+class SplitAnswerTest(unittest.TestCase):
+    def test_split_answer(self):
+        self.assertEqual(AnswerStats.split_answer('Python;Rust;Go'), ['Python', 'Rust', 'Go'])
+        self.assertEqual(AnswerStats.split_answer('Germany'), ['Germany'])
+        for answer in ('', 'NA', None):
+            self.assertEqual(AnswerStats.split_answer(answer), [])
+        self.assertEqual(AnswerStats.split_answer('Python;;NA'), ['Python'])
+
+
+class AnswerCountTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(30)
+        write_survey(YEAR, cls.rows)
+        StackOverflowDataDumper.materialize_answer_index([YEAR])
+        StackOverflowDataDumper.bump_data_generations([YEAR])
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def get_counts(self, question):
+        response = self.client.get(f'/stats/{YEAR}/{question}')
+        self.assertEqual(response.status_code, 200)
+        return [(item['value'], item['count']) for item in response.json['values']]
+
+    def test_counts_every_value(self):
+        self.assertEqual(self.get_counts('Country'), expected_counts(self.rows, 'Country'))
+        self.assertEqual(self.get_counts('LanguageWorkedWith'), expected_counts(self.rows, 'LanguageWorkedWith'))
+
+    def test_unanswered_is_not_a_value(self):
+        self.assertNotIn('NA', dict(self.get_counts('Country')))
+        response = self.client.get(f'/responses/{YEAR}/search?where=Country:NA')
+        self.assertEqual(response.json['total'], 0)
+
+    def test_unknown_questions(self):
+        self.assertEqual(self.client.get(f'/stats/{YEAR}/Unknown').status_code, 404)
+        self.assertEqual(self.client.get(f'/stats/{YEAR}/Respondent').status_code, 404)
+
+    @unittest.skipIf(ColumnarSnapshot.numpy is None, 'needs NumPy')
+    def test_snapshot_agrees_with_the_counts(self):
+        directory = os.path.join(DATA_DIR, 'answer-stats-snapshots')
+        ColumnarSnapshot.export_snapshot(os.path.join(DATA_DIR, str(YEAR), 'survey_results_public.csv'), YEAR,
+                                         QUESTIONS[1:], directory)
+        snapshot = ColumnarSnapshot.Snapshot(directory, YEAR)
+        for question in ('Country', 'LanguageWorkedWith'):
+            self.assertEqual(sorted(snapshot.value_counts(question)), sorted(self.get_counts(question)))
+        self.assertNotIn('NA', snapshot.dictionaries['Country'])
+        self.assertEqual(snapshot.count(snapshot.mask([('Country', ['NA'])], True)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
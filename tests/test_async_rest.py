@@ -0,0 +1,82 @@
+from tests import app, make_rows, write_survey
+from unittest import mock
+import AsyncRest
+import BulkLoader
+import CacheDBWrapper
+import gzip
+import json
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2019
+
+
+class AsyncRestTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Compact rows, so fields need the layout of the year
+        cls.rows = make_rows(12)
+        path = write_survey(YEAR, cls.rows)
+        StackOverflowDataDumper.load_schemas([YEAR])
+        BulkLoader.bulk_load_responses(path, YEAR, 10, layout=StackOverflowDataDumper.get_layouts([YEAR])[YEAR])
+        StackOverflowDataDumper.bump_data_generations([YEAR])
+
+    async def asyncTearDown(self):
+        # The engine belongs to the event loop of the test
+        if AsyncRest.engine is not None:
+            await AsyncRest.engine.dispose()
+            AsyncRest.engine = None
+
+    async def call(self, path, query_string='', headers=(), method='GET'):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            messages.append(message)
+        await AsyncRest.app({'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode(),
+                             'headers': [(key.encode(), value.encode()) for key, value in headers]}, receive, send)
+        start, body = messages
+        headers = {key.decode(): value.decode() for key, value in start['headers']}
+        data = gzip.decompress(body['body']) if headers.get('content-encoding') == 'gzip' else body['body']
+        return start['status'], headers, data
+
+    async def test_same_answers_as_the_flask_app(self):
+        client = app.test_client()
+        for path, query_string in ((f'/responses/{YEAR}', 'size=5'), (f'/responses/{YEAR}', 'size=5&fields=Country'),
+                                   (f'/responses/{YEAR}', 'cursor=&size=4&count=true'),
+                                   (f'/responses/{YEAR}', 'Country=Austria&YearsCodePro.gte=5'),
+                                   (f'/response/{YEAR}/3', 'fields=Country,LanguageWorkedWith'),
+                                   (f'/response/{YEAR}/999', ''), (f'/schema/{YEAR}', '')):
+            with self.subTest(path=path, query_string=query_string):
+                status, headers, data = await self.call(path, query_string, [('Accept-Encoding', 'gzip')])
+                # Another query string, so the Flask app doesn't get the body cached by the call above
+                expected = client.get(f'{path}?{query_string}&via=flask')
+                self.assertEqual(status, expected.status_code)
+                self.assertEqual(json.loads(data), expected.json)
+
+    async def test_fields_of_compact_rows_without_blocking_queries(self):
+        with mock.patch.dict(CacheDBWrapper.layouts, clear=True), \
+                mock.patch.object(CacheDBWrapper, 'get_layout', side_effect=AssertionError('sync query')):
+            status, _, data = await self.call(f'/response/{YEAR}/5', 'fields=Country&async=1')
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(data)[0]['responses'], {'Country': self.rows[4]['Country']})
+            status, _, data = await self.call(f'/responses/{YEAR}', 'size=3&async=1')
+            self.assertEqual([response['responses'] for response in json.loads(data)], self.rows[:3])
+            # No schema, so no layout to keep either
+            status, _, _ = await self.call(f'/responses/{YEAR - 1000}', 'fields=Country&async=1')
+            self.assertEqual(status, 404)
+
+    async def test_conditional_request_and_routing(self):
+        _, headers, _ = await self.call(f'/response/{YEAR}/1', 'conditional=1')
+        status, _, data = await self.call(f'/response/{YEAR}/1', 'conditional=1', [('If-None-Match', headers['etag'])])
+        self.assertEqual((status, data), (304, b''))
+        status, _, _ = await self.call(f'/response/{YEAR}/1', method='POST')
+        self.assertEqual(status, 405)
+        status, _, data = await self.call('/nowhere')
+        self.assertEqual((status, json.loads(data)), (404, {'error': '/nowhere not found.'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+from BatchController import BatchController, estimate_row_size
+from ExampleStackOverflowRest import Response, db
+from tests import make_rows, write_survey
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2010
+
+SECOND = 1000000000
+
+
+class BatchControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = BatchController(initial=1000, step=500, max_commit_time=10.0, max_batch_bytes=1000000)
+
+    def test_grows_within_limits(self):
+        decision = self.controller.update(1000, 1000, SECOND // 10, SECOND)
+        self.assertEqual((decision['action'], decision['batch_size']), ('increase', 1500))
+
+    def test_slow_commit_cuts_the_batch(self):
+        decision = self.controller.update(1000, 1000, 11 * SECOND, 12 * SECOND)
+        self.assertEqual((decision['action'], decision['batch_size']), ('decrease', 500))
+
+    def test_throughput_drop_after_increase_steps_back(self):
+        self.controller.update(1000, 1000, SECOND // 10, SECOND)
+        decision = self.controller.update(1500, 1500, SECOND // 10, 3 * SECOND)
+        self.assertEqual((decision['action'], decision['batch_size']), ('decrease', 1000))
+
+    def test_holds_close_to_the_limits(self):
+        decision = self.controller.update(1000, 1000, 10 * SECOND, 11 * SECOND)
+        self.assertEqual((decision['action'], decision['batch_size']), ('hold', 1000))
+
+
+class ControlledLoadTest(unittest.TestCase):
+    def tearDown(self):
+        db.session.remove()
+
+    def test_orm_load_commits_controlled_batches(self):
+        rows = make_rows(30)
+        write_survey(YEAR, rows)
+        StackOverflowDataDumper.load_schemas([YEAR])
+        controller = BatchController(initial=100, minimum=4, step=4, max_batch_bytes=estimate_row_size(rows[0]) * 8)
+        self.assertEqual(StackOverflowDataDumper.load_responses([YEAR], controller, {}), 30)
+        # Batches hit the memory limit long before the row count, so the controller keeps cutting them
+        self.assertEqual((controller.last_action, controller.batch_size), ('decrease', 12))
+        self.assertEqual(db.session.query(Response).filter_by(response_year=YEAR).count(), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from ExampleStackOverflowRest import Response, db
+from tests import app, load_survey, make_rows
+from unittest import mock
+import ExampleStackOverflowRest
+import unittest
+
+YEAR = 2018
+
+
+class BatchLookupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(20)
+        load_survey(YEAR, cls.rows)
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def lookup(self, body, query=''):
+        return self.client.post(f'/responses/lookup{query}', json=body)
+
+    def test_same_order_with_null_when_missing(self):
+        response = self.lookup({'respondents': [[YEAR, 7], [YEAR, 9999], [YEAR, 2], [YEAR, 7]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('response_ids', response.json)
+        respondents = response.json['respondents']
+        self.assertEqual([item and item['respondent_id'] for item in respondents], [7, None, 2, 7])
+        self.assertEqual(respondents[0]['responses'], self.rows[6])
+
+    def test_response_ids_and_fields(self):
+        response_id = db.session.query(Response.response_id).filter_by(response_year=YEAR, respondent_id=3).scalar()
+        response = self.lookup({'respondents': [[YEAR, 4]], 'response_ids': ['missing', response_id]},
+                               '?fields=Country')
+        self.assertEqual(response.json['respondents'][0]['responses'], {'Country': self.rows[3]['Country']})
+        self.assertIsNone(response.json['response_ids'][0])
+        self.assertEqual(response.json['response_ids'][1]['respondent_id'], 3)
+        self.assertEqual(response.json['response_ids'][1]['responses'], {'Country': self.rows[2]['Country']})
+
+    def test_invalid_bodies(self):
+        for body in ([], {'respondents': [[YEAR]]}, {'respondents': [[YEAR, '1']]}, {'respondents': {}},
+                     {'response_ids': [1]}):
+            with self.subTest(body=body):
+                self.assertEqual(self.lookup(body).status_code, 400)
+
+    def test_lookup_size_limit(self):
+        with mock.patch.object(ExampleStackOverflowRest, 'MAX_LOOKUP_SIZE', 3):
+            self.assertEqual(self.lookup({'respondents': [[YEAR, 1], [YEAR, 2]], 'response_ids': ['a']})
+                             .status_code, 200)
+            self.assertEqual(self.lookup({'respondents': [[YEAR, 1], [YEAR, 2]], 'response_ids': ['a', 'b']})
+                             .status_code, 400)
+
+    def test_lookup_is_not_cacheable(self):
+        response = self.client.post('/responses/lookup', json={'respondents': [[YEAR, 1], [YEAR, 9999]]},
+                                    headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('ETag'))
+        self.assertIsNone(response.headers.get('Cache-Control'))
+        self.assertEqual(response.json['respondents'][0]['respondent_id'], 1)
+        self.assertIsNone(response.json['respondents'][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from tests import DATA_DIR, app
+from unittest import mock
+import Benchmark
+import BulkLoader
+import csv
+import os
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2025
+
+
+def read_files(directory, year):
+    with open(os.path.join(directory, str(year), 'survey_results_schema.csv'), encoding='utf8') as file:
+        schema = list(csv.reader(file))
+    with open(os.path.join(directory, str(year), 'survey_results_public.csv'), encoding='utf8') as file:
+        responses = list(csv.reader(file))
+    return schema, responses
+
+
+class SurveyGeneratorTest(unittest.TestCase):
+    def generate(self, name, seed, columns=12):
+        directory = os.path.join(DATA_DIR, 'benchmark', name)
+        questions = Benchmark.generate_survey(directory, [YEAR], 200, columns, seed)
+        return questions, read_files(directory, YEAR)
+
+    def test_same_seed_same_files(self):
+        self.assertEqual(self.generate('first', 7), self.generate('second', 7))
+        self.assertNotEqual(self.generate('first', 7)[1][1], self.generate('other', 8)[1][1])
+
+    def test_file_layout(self):
+        questions, (schema, responses) = self.generate('layout', 3)
+        self.assertEqual(len(questions), 11)
+        self.assertEqual(schema[0], ['Column', 'QuestionText'])
+        self.assertEqual([row[0] for row in schema[1:]], ['Respondent'] + questions)
+        self.assertEqual(responses[0], ['Respondent'] + questions)
+        self.assertEqual([row[0] for row in responses[1:]], [str(respondent) for respondent in range(1, 201)])
+        self.assertTrue(all(len(row) == len(responses[0]) for row in responses))
+        answers = [answer for row in responses[1:] for answer in row[1:]]
+        self.assertIn('NA', answers)
+        self.assertTrue(any(';' in row[questions.index('LanguageWorkedWith') + 1] for row in responses[1:]))
+
+    def test_fixed_columns_are_always_there(self):
+        questions, _ = self.generate('narrow', 1, columns=2)
+        self.assertEqual(questions, Benchmark.FIXED_COLUMNS[1:])
+
+
+class WorkloadTest(unittest.TestCase):
+    def test_same_seed_same_requests(self):
+        questions = Benchmark.FIXED_COLUMNS[1:]
+        workload = Benchmark.build_workload([YEAR], 100, 300, 10, questions, 5)
+        self.assertEqual(workload, Benchmark.build_workload([YEAR], 100, 300, 10, questions, 5))
+        self.assertEqual(len(workload), 300)
+        self.assertEqual({name for name, _, _, _ in workload}, set(Benchmark.WORKLOAD_WEIGHTS))
+
+    def test_generated_survey_is_served(self):
+        directory = os.path.join(DATA_DIR, 'benchmark', 'served')
+        questions = Benchmark.generate_survey(directory, [YEAR], 60, 10, 2)
+        with mock.patch.object(StackOverflowDataDumper, 'DIR', directory):
+            StackOverflowDataDumper.load_schemas([YEAR])
+        BulkLoader.resumable_load_responses(os.path.join(directory, str(YEAR), 'survey_results_public.csv'), YEAR, 25)
+        StackOverflowDataDumper.bump_data_generations([YEAR])
+        latencies, statuses, _ = Benchmark.replay(app.test_client(),
+                                                  Benchmark.build_workload([YEAR], 60, 200, 10, questions, 2))
+        self.assertEqual(sum(len(values) for values in latencies.values()), 200)
+        self.assertFalse([status for status in statuses if status.startswith('5')])
+        self.assertGreater(statuses.get('200', 0), 100)
+
+
+class ResultsTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((Benchmark.percentile(values, 50), Benchmark.percentile(values, 99)), (50, 99))
+        self.assertEqual(Benchmark.percentile([3], 99), 3)
+        self.assertIsNone(Benchmark.percentile([], 50))
+
+    def test_summarize_latencies(self):
+        self.assertEqual(Benchmark.summarize_latencies([0.003, 0.001, 0.002]),
+                         {'count': 3, 'p50_ms': 2.0, 'p99_ms': 3.0, 'mean_ms': 2.0})
+
+    def test_compare(self):
+        baseline = {'config': {'rows': 1}, 'ingest': {'rows_per_second': 100}, 'api': {'latency': {'p99_ms': 10}}}
+        results = {'config': {'rows': 1}, 'ingest': {'rows_per_second': 150}, 'api': {'latency': {'p99_ms': 12}}}
+        with self.assertLogs(Benchmark.log) as logs:
+            Benchmark.compare(baseline, results)
+        self.assertEqual([record.getMessage() for record in logs.records],
+                         ['ingest.rows_per_second: 100 -> 150 (+50.0%, better)',
+                          'api.latency.p99_ms: 10 -> 12 (+20.0%, worse)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
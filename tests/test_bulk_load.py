@@ -0,0 +1,41 @@
+from ExampleStackOverflowRest import Response, db
+from tests import make_rows, write_survey
+import BulkLoader
+import unittest
+import uuid
+
+YEAR = 2008
+
+
+class BulkLoadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(25)
+        cls.batches = []
+        cls.count = BulkLoader.bulk_load_responses(write_survey(YEAR, cls.rows), YEAR, 10,
+                                                   lambda *batch: cls.batches.append(batch[:2]))
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_commits_in_batches(self):
+        self.assertEqual(self.count, 25)
+        self.assertEqual(self.batches, [(10, 10), (20, 10), (25, 5)])
+
+    def test_rows_match_the_file(self):
+        responses = db.session.query(Response).filter_by(response_year=YEAR).order_by(Response.respondent_id).all()
+        self.assertEqual([response.responses for response in responses], self.rows)
+        self.assertEqual([response.respondent_id for response in responses], list(range(1, 26)))
+        self.assertEqual(len({uuid.UUID(response.response_id).hex for response in responses}), 25)
+
+    def test_promoted_columns_are_filled(self):
+        response = db.session.query(Response).filter_by(response_year=YEAR, respondent_id=1).one()
+        self.assertEqual((response.country, response.years_code_pro, response.converted_comp),
+                         ('Austria', 1, 1000.0))
+        # NA answers are stored as NULL
+        response = db.session.query(Response).filter_by(response_year=YEAR, respondent_id=3).one()
+        self.assertIsNone(response.country)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+from CacheEngine import MISSING, LFUCache, StripedLFUCache
+from unittest import mock
+import threading
+import unittest
+
+
+class LFUCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = LFUCache(size=3)
+
+    def test_evicts_least_frequently_used(self):
+        for name in ('a', 'b', 'c'):
+            self.cache.insert(name, name)
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.get('b')
+        self.cache.insert('d', 'd')
+        self.assertFalse(self.cache.check('c'))
+        self.assertTrue(all(self.cache.check(name) for name in ('a', 'b', 'd')))
+
+    def test_ties_evict_least_recently_used(self):
+        for name in ('a', 'b', 'c'):
+            self.cache.insert(name, name)
+        for name in ('b', 'a', 'c'):
+            self.cache.get(name)
+        self.cache.insert('d', 'd')
+        self.assertFalse(self.cache.check('b'))
+        # d is the only entry without hits, it goes next
+        self.cache.insert('e', 'e')
+        self.assertFalse(self.cache.check('d'))
+        self.assertEqual(self.cache.get_stats()['evictions']['capacity'], 2)
+
+    def test_new_entry_is_not_its_own_victim(self):
+        for name in ('a', 'b', 'c'):
+            self.cache.insert(name, name)
+            self.cache.get(name)
+        self.cache.insert('d', 'd')
+        self.assertTrue(self.cache.check('d'))
+        self.assertEqual(self.cache.get_stats()['entries'], 3)
+
+    def test_get_counts_hits_and_tells_misses_apart(self):
+        self.cache.insert('empty', [])
+        self.assertEqual(self.cache.get('empty', MISSING), [])
+        self.assertIs(self.cache.get('unknown', MISSING), MISSING)
+        self.assertIsNone(self.cache.get('unknown'))
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['hits'], stats['cache_entry']), (1, [{'empty': 1}]))
+
+    def test_update_keeps_the_hit_count(self):
+        self.cache.insert('a', 1)
+        self.cache.get('a')
+        self.assertEqual(self.cache.update('a', 2), 2)
+        self.assertIsNone(self.cache.update('unknown', 2))
+        self.assertEqual(self.cache.get_stats()['cache_entry'], [{'a': 1}])
+        self.assertEqual(self.cache.get('a'), 2)
+
+
+class ByteBudgetTest(unittest.TestCase):
+    def setUp(self):
+        # Every entry weighs 100 bytes
+        self.cache = LFUCache(size=100, max_bytes=1000, sizer=lambda data: 100)
+
+    def test_new_entry_evicts_the_least_used_entry(self):
+        for number in range(10):
+            self.cache.insert(number, number)
+            self.cache.get(number)
+        self.cache.get(3)
+        self.cache.insert('new', 'new')
+        self.assertTrue(self.cache.check('new'))
+        self.assertFalse(self.cache.check(0))
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']['size']), (10, 1000, 1))
+
+    def test_new_entries_keep_replacing_each_other_until_hit(self):
+        for number in range(10):
+            self.cache.insert(number, number)
+            self.cache.get(number)
+        self.cache.insert('first', 'first')
+        self.cache.insert('second', 'second')
+        self.assertTrue(self.cache.check('second'))
+        self.assertFalse(self.cache.check('first'))
+
+    def test_entry_bigger_than_the_budget_is_not_kept(self):
+        cache = LFUCache(size=100, max_bytes=1000, sizer=len)
+        cache.insert('small', 'x' * 600)
+        cache.insert('huge', 'x' * 1001)
+        self.assertFalse(cache.check('huge'))
+        self.assertTrue(cache.check('small'))
+        self.assertEqual(cache.get_stats()['bytes'], 600)
+
+    def test_update_accounts_for_the_new_size(self):
+        cache = LFUCache(size=100, max_bytes=1000, sizer=len)
+        cache.insert('a', 'x' * 400)
+        cache.insert('b', 'x' * 400)
+        cache.get('b')
+        cache.insert('b', 'x' * 500)
+        self.assertEqual(cache.get_stats()['bytes'], 900)
+        cache.insert('b', 'x' * 700)
+        self.assertFalse(cache.check('a'))
+        self.assertEqual(cache.get_stats()['bytes'], 700)
+
+
+class TTLTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('CacheEngine.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = LFUCache(size=10, ttl=30, sweep_interval=60)
+
+    def test_expired_entries_are_misses(self):
+        self.cache.insert('a', 'a')
+        self.cache.insert('b', 'b', ttl=90)
+        self.now += 29
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.now += 1
+        self.assertIs(self.cache.get('a', MISSING), MISSING)
+        self.assertFalse(self.cache.check('a'))
+        self.assertTrue(self.cache.check('b'))
+        self.assertEqual(self.cache.get_stats()['evictions']['ttl'], 1)
+
+    def test_update_restarts_the_ttl(self):
+        self.cache.insert('a', 1)
+        self.now += 20
+        self.cache.update('a', 2)
+        self.now += 20
+        self.assertEqual(self.cache.get('a'), 2)
+
+    def test_sweep_removes_expired_entries_nobody_asks_for(self):
+        for number in range(5):
+            self.cache.insert(number, number)
+        self.cache.insert('forever', 'forever', ttl=0)
+        self.now += 60
+        # The insert is past the sweep interval, so it sweeps first
+        self.cache.insert('new', 'new')
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['evictions']['ttl'], 5)
+        self.assertEqual(sorted(name for entry in stats['cache_entry'] for name in entry), ['forever', 'new'])
+
+    def test_expired_entries_go_before_live_ones(self):
+        cache = LFUCache(size=2, ttl=30, sweep_interval=10)
+        cache.insert('short', 'short', ttl=5)
+        cache.insert('live', 'live')
+        self.now += 10
+        cache.insert('new', 'new')
+        self.assertTrue(cache.check('live'))
+        self.assertEqual(cache.get_stats()['evictions'], {'capacity': 0, 'size': 0, 'ttl': 1})
+
+
+class StripedLFUCacheTest(unittest.TestCase):
+    def test_capacity_adds_up_to_size(self):
+        for size, segments in ((10, 16), (10, 3), (1000, 16), (1, 4)):
+            cache = StripedLFUCache(size=size, segments=segments, max_bytes=size * 100)
+            self.assertEqual(sum(segment.size for segment in cache.segments), size)
+            self.assertEqual(sum(segment.max_bytes for segment in cache.segments), size * 100)
+            self.assertTrue(all(segment.size >= 1 for segment in cache.segments))
+
+    def test_small_cache_holds_size_entries(self):
+        cache = StripedLFUCache(size=10, segments=16)
+        # Keys filling every segment up to its share, whichever segment they land on
+        names = []
+        number = 0
+        while len(names) < 10:
+            name = f'key-{number}'
+            number += 1
+            index = cache._segment_index(name)
+            if sum(cache._segment_index(other) == index for other in names) < cache.segments[index].size:
+                names.append(name)
+        for name in names:
+            cache.insert(name, name)
+        self.assertEqual(cache.get_stats()['entries'], 10)
+
+    def test_concurrent_access(self):
+        cache = StripedLFUCache(size=100, segments=4)
+
+        def work(offset):
+            for number in range(1000):
+                name = f'key-{(number + offset) % 150}'
+                if cache.get(name, MISSING) is MISSING:
+                    cache.insert(name, number)
+        threads = [threading.Thread(target=work, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.get_stats()
+        self.assertLessEqual(stats['entries'], 100)
+        self.assertEqual(stats['hits'] + stats['misses'], 8000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from CacheEngine import LFUCache
+from tests import DATA_DIR, app, load_survey, make_rows
+from unittest import mock
+import CacheWarmer
+import ExampleStackOverflowRest
+import os
+import threading
+import unittest
+
+YEAR = 2022
+
+
+class NextPageKeyTest(unittest.TestCase):
+    def test_keeps_the_order_of_the_parameters(self):
+        self.assertEqual(CacheWarmer.next_page_key('/responses/2022', 'size=5&page=3&count=true', 3),
+                         '/responses/2022?size=5&page=4&count=true')
+
+    def test_first_page_without_page_parameter(self):
+        self.assertEqual(CacheWarmer.next_page_key('/responses', '', 1), '/responses?page=2')
+        self.assertEqual(CacheWarmer.next_page_key('/responses', 'page=0', 0), '/responses?page=2')
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(DATA_DIR, f'warmup-{self.id()}.json')
+
+    def test_hottest_keys_round_trip(self):
+        cache = LFUCache(size=10)
+        for key, hits in (('a', 1), ('b', 3), ('c', 2)):
+            cache.insert(key, key)
+            for _ in range(hits):
+                cache.get(key)
+        self.assertEqual(CacheWarmer.save_snapshot(cache, self.path, 2), 2)
+        self.assertEqual(CacheWarmer.load_snapshot(self.path, 10), ['b', 'c'])
+        self.assertEqual(CacheWarmer.load_snapshot(self.path, 1), ['b'])
+
+    def test_missing_snapshot(self):
+        self.assertEqual(CacheWarmer.load_snapshot(self.path, 10), [])
+
+
+class WarmUpTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        load_survey(YEAR, make_rows(20))
+
+    def test_warm_up_replays_the_keys_once(self):
+        cache = ExampleStackOverflowRest.db_cache
+        keys = [f'/responses/{YEAR}?page={page}&size=4&warmup=true' for page in (1, 2, 3)]
+        snapshot = LFUCache(size=10)
+        for key in keys:
+            snapshot.insert(key, None)
+        path = os.path.join(DATA_DIR, 'warmup.json')
+        CacheWarmer.save_snapshot(snapshot, path, 10)
+        self.assertEqual(CacheWarmer.warm_up(app, cache, path, 2), 2)
+        self.assertEqual([cache.check(key) for key in keys], [True, True, False])
+        # Keys already cached are skipped
+        self.assertEqual(CacheWarmer.warm_up(app, cache, path, 10), 1)
+
+    def test_next_page_is_prefetched(self):
+        cache = ExampleStackOverflowRest.db_cache
+        prefetcher = CacheWarmer.Prefetcher(app, cache, workers=1)
+        with mock.patch.object(ExampleStackOverflowRest, 'prefetcher', prefetcher):
+            self.assertEqual(app.test_client().get(f'/responses/{YEAR}?size=4&prefetch=true').status_code, 200)
+            prefetcher.executor.shutdown(wait=True)
+        self.assertTrue(cache.check(f'/responses/{YEAR}?size=4&prefetch=true&page=2'))
+        # The prefetched page doesn't prefetch the page after it
+        self.assertFalse(cache.check(f'/responses/{YEAR}?size=4&prefetch=true&page=3'))
+        self.assertEqual(prefetcher.get_stats(), {'prefetched': 1, 'dropped': 0, 'in_flight': 0})
+
+
+class PrefetcherTest(unittest.TestCase):
+    def test_busy_workers_drop_prefetches(self):
+        release = threading.Event()
+        prefetcher = CacheWarmer.Prefetcher(app, LFUCache(size=10), workers=1)
+        with mock.patch.object(CacheWarmer, 'replay', side_effect=lambda app, key: release.wait()):
+            self.assertTrue(prefetcher.prefetch('a'))
+            self.assertFalse(prefetcher.prefetch('a'))
+            self.assertFalse(prefetcher.prefetch('b'))
+            release.set()
+            prefetcher.executor.shutdown(wait=True)
+        self.assertEqual(prefetcher.get_stats(), {'prefetched': 1, 'dropped': 1, 'in_flight': 0})
+
+    def test_cached_keys_are_not_prefetched(self):
+        cache = LFUCache(size=10)
+        cache.insert('a', 'body')
+        prefetcher = CacheWarmer.Prefetcher(app, cache, workers=1)
+        self.assertFalse(prefetcher.prefetch('a'))
+        self.assertEqual(prefetcher.get_stats()['in_flight'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+from tests import DATA_DIR, QUESTIONS, app, make_rows, write_survey
+from unittest import mock
+import ColumnarSnapshot
+import ExampleStackOverflowRest
+import os
+import unittest
+
+# Only written to the snapshot directory, never loaded into the database
+YEAR = 2016
+
+
+@unittest.skipIf(ColumnarSnapshot.numpy is None, 'needs NumPy')
+class ColumnarSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(DATA_DIR, 'snapshots')
+        self.rows = make_rows(40)
+        self.path = write_survey(YEAR, self.rows)
+
+    def export(self):
+        return ColumnarSnapshot.export_snapshot(self.path, YEAR, QUESTIONS[1:], self.directory)
+
+    def test_previous_snapshot_stays_readable(self):
+        self.export()
+        snapshot = ColumnarSnapshot.Snapshot(self.directory, YEAR)
+        self.export()
+        # Opened before the export above, its columns are only mapped now
+        self.assertEqual(dict(snapshot.value_counts('Country'))['Germany'],
+                         sum(row['Country'] == 'Germany' for row in self.rows))
+        self.export()
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, str(YEAR)))), 2)
+
+    def test_group_counts(self):
+        self.export()
+        snapshot = ColumnarSnapshot.Snapshot(self.directory, YEAR)
+        groups = snapshot.group_counts('Country', 'LanguageWorkedWith')
+        expected = {}
+        for row in self.rows:
+            # Unanswered on either side isn't counted
+            if row['Country'] == 'NA' or row['LanguageWorkedWith'] == 'NA':
+                continue
+            counts = expected.setdefault(row['Country'], {})
+            for language in row['LanguageWorkedWith'].split(';'):
+                counts[language] = counts.get(language, 0) + 1
+        self.assertEqual({country: dict(counts) for country, counts in groups.items()}, expected)
+
+    def test_analytics_endpoint(self):
+        self.export()
+        client = app.test_client()
+        self.assertEqual(client.get(f'/analytics/{YEAR}/Country').status_code, 404)
+        with mock.patch.object(ExampleStackOverflowRest, 'SNAPSHOT_DIR', self.directory):
+            response = client.get(f'/analytics/{YEAR}/LanguageWorkedWith?where=Country:Austria|Malaysia')
+            languages = [row['LanguageWorkedWith'] for row in self.rows if row['Country'] in ('Austria', 'Malaysia')]
+            self.assertEqual(response.json['respondents'], len(languages))
+            self.assertEqual({item['value']: item['count'] for item in response.json['values']},
+                             {language: sum(language in answer.split(';') for answer in languages)
+                              for answer in languages for language in answer.split(';')})
+            response = client.get(f'/analytics/{YEAR}/LanguageWorkedWith?by=Country')
+            self.assertEqual({group['value'] for group in response.json['groups']}, {'Austria', 'Germany', 'Malaysia'})
+            self.assertEqual(client.get(f'/analytics/{YEAR}/Unknown').status_code, 404)
+            self.assertEqual(client.get(f'/analytics/{YEAR - 1000}/Country').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+from CompactStorage import ResponseLayout, is_compact
+from ExampleStackOverflowRest import Response, db
+from tests import QUESTIONS, app, make_rows, write_survey
+import BulkLoader
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2012
+
+
+class ResponseLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.layout = ResponseLayout(['A', 'B', 'C'])
+
+    def test_round_trip(self):
+        row = {'A': '1', 'B': '', 'C': 'x;y'}
+        self.assertEqual(self.layout.compact(row), ['1', '', 'x;y'])
+        self.assertEqual(self.layout.expand(self.layout.compact(row)), row)
+
+    def test_unknown_and_missing_columns(self):
+        compact = self.layout.compact({'A': '1', 'D': 'extra'})
+        self.assertEqual(compact, ['1', None, None, {'D': 'extra'}])
+        self.assertEqual(self.layout.expand(compact), {'A': '1', 'B': None, 'C': None, 'D': 'extra'})
+
+    def test_regular_rows_are_left_alone(self):
+        row = {'A': '1'}
+        self.assertFalse(is_compact(row))
+        self.assertIs(self.layout.expand(row), row)
+
+
+class CompactRowsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(6)
+        path = write_survey(YEAR, cls.rows)
+        StackOverflowDataDumper.load_schemas([YEAR])
+        layout = StackOverflowDataDumper.get_layouts([YEAR])[YEAR]
+        BulkLoader.bulk_load_responses(path, YEAR, 10, layout=layout)
+        StackOverflowDataDumper.bump_data_generations([YEAR])
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_rows_are_stored_compact(self):
+        response = db.session.query(Response).filter_by(response_year=YEAR, respondent_id=1).one()
+        self.assertEqual(response.responses, [self.rows[0][question] for question in QUESTIONS])
+
+    def test_api_expands_compact_rows(self):
+        self.assertEqual(self.client.get(f'/response/{YEAR}/1').json[0]['responses'], self.rows[0])
+        page = self.client.get(f'/responses/{YEAR}?size=10').json
+        self.assertEqual([response['responses'] for response in page], self.rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from ExampleStackOverflowRest import Schema
+from tests import QUESTIONS, app, load_survey, make_rows
+from unittest import mock
+import CacheDBWrapper
+import unittest
+
+YEAR = 2020
+
+
+class ConditionalRequestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        load_survey(YEAR, make_rows(50))
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_etag_and_cache_control(self):
+        response = self.client.get(f'/response/{YEAR}/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.headers.get('ETag'))
+        self.assertEqual(response.headers.get('Cache-Control'), app.config['PYSTACKOVERFLOW_CACHE_CONTROL'])
+
+    def test_matching_if_none_match_is_not_modified(self):
+        etag = self.client.get(f'/response/{YEAR}/1').headers['ETag']
+        response = self.client.get(f'/response/{YEAR}/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_other_if_none_match_sends_the_body(self):
+        response = self.client.get(f'/response/{YEAR}/1', headers={'If-None-Match': '"something-else"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json), 1)
+
+    def test_gzip_representation_has_its_own_etag(self):
+        path = f'/responses/{YEAR}?size=50'
+        plain = self.client.get(path, headers={'Accept-Encoding': 'identity'})
+        gzipped = self.client.get(path, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', gzipped.headers['Vary'])
+        self.assertNotEqual(plain.headers['ETag'], gzipped.headers['ETag'])
+        # The ETag of the plain body doesn't validate the gzip'd one
+        response = self.client.get(path, headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(path, headers={'Accept-Encoding': 'gzip',
+                                                  'If-None-Match': gzipped.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_errors_are_not_revalidated(self):
+        response = self.client.get(f'/response/{YEAR}/9999')
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(response.headers.get('ETag'))
+        self.assertEqual(self.client.get(f'/response/{YEAR}/9999', headers={'If-None-Match': '*'}).status_code, 404)
+
+
+class SchemaPreloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        load_survey(YEAR, make_rows(5))
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_schemas_are_only_queried_once(self):
+        first = self.client.get(f'/schema/{YEAR}')
+        self.client.get('/schemas')
+        query = CacheDBWrapper.db.session.query
+        with mock.patch.object(CacheDBWrapper.db.session, 'query', wraps=query) as spy:
+            second = self.client.get(f'/schema/{YEAR}')
+            self.assertEqual(second.json, first.json)
+            self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+            self.assertIn(YEAR, [schema['year'] for schema in self.client.get('/schemas').json])
+            etag = second.headers['ETag']
+            self.assertEqual(self.client.get(f'/schema/{YEAR}', headers={'If-None-Match': etag}).status_code, 304)
+        # Only the data generations are read
+        self.assertFalse([args for args, _ in spy.call_args_list if args[0] is Schema])
+
+    def test_missing_schema_is_not_kept(self):
+        self.assertEqual(self.client.get(f'/schema/{YEAR - 1000}').status_code, 404)
+        self.assertNotIn(YEAR - 1000, CacheDBWrapper.schema_bodies)
+
+    def test_reloaded_year_gets_its_new_schema(self):
+        self.client.get(f'/schema/{YEAR}')
+        load_survey(YEAR, make_rows(5), QUESTIONS + ['DevType'])
+        questions = self.client.get(f'/schema/{YEAR}').json[0]['response_columns']
+        self.assertIn('DevType', questions)
+        load_survey(YEAR, make_rows(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
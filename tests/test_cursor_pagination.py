@@ -0,0 +1,56 @@
+from tests import app, load_survey, make_rows
+import unittest
+
+YEAR = 2007
+RESPONDENTS = 23
+
+
+class CursorPaginationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        load_survey(YEAR, make_rows(RESPONDENTS))
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def walk(self, query):
+        # Follow the next cursors from the first page until the last one
+        pages = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get(f'/responses/{YEAR}?{query}&cursor={cursor}')
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json['responses'])
+            cursor = response.json['next']
+        return pages
+
+    def test_walks_every_response_once_in_order(self):
+        pages = self.walk('size=5')
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 3])
+        respondents = [response['respondent_id'] for page in pages for response in page]
+        self.assertEqual(respondents, list(range(1, RESPONDENTS + 1)))
+
+    def test_full_last_page_ends_with_an_empty_page(self):
+        pages = self.walk('size=23')
+        self.assertEqual([len(page) for page in pages], [23, 0])
+
+    def test_filters_apply_to_every_page(self):
+        pages = self.walk('size=2&Country=Germany')
+        countries = {response['responses']['Country'] for page in pages for response in page}
+        self.assertEqual(countries, {'Germany'})
+        self.assertEqual(sum(len(page) for page in pages),
+                         sum(row['Country'] == 'Germany' for row in make_rows(RESPONDENTS)))
+
+    def test_count(self):
+        response = self.client.get(f'/responses/{YEAR}?cursor=&size=5&count=true')
+        self.assertEqual(response.json['total'], RESPONDENTS)
+        self.assertNotIn('total', self.client.get(f'/responses/{YEAR}?cursor=&size=5').json)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'/responses/{YEAR}?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json, {'error': 'Invalid cursor.'})
+
+
+if __name__ == '__main__':
+    unittest.main()
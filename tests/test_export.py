@@ -0,0 +1,44 @@
+from tests import app, load_survey, make_rows
+from unittest import mock
+import ExampleStackOverflowRest
+import gzip
+import json
+import unittest
+
+YEAR = 2017
+
+
+class ExportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(23)
+        load_survey(YEAR, cls.rows)
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def read_lines(self, data):
+        return [json.loads(line) for line in data.decode('utf8').splitlines()]
+
+    def test_every_response_once_per_line(self):
+        # Batches smaller than the year, so the export spans several of them
+        with mock.patch.object(ExampleStackOverflowRest, 'EXPORT_BATCH_SIZE', 5):
+            response = self.client.get(f'/export/{YEAR}')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = self.read_lines(response.data)
+        self.assertEqual([line['responses'] for line in lines], self.rows)
+        self.assertEqual([line['respondent_id'] for line in lines], list(range(1, 24)))
+
+    def test_gzip_and_fields(self):
+        response = self.client.get(f'/export/{YEAR}?fields=Country', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual([line['responses'] for line in self.read_lines(gzip.decompress(response.data))],
+                         [{'Country': row['Country']} for row in self.rows])
+
+    def test_empty_year(self):
+        response = self.client.get(f'/export/{YEAR - 1000}')
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+from tests import app, make_rows, write_survey
+import BulkLoader
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2013
+# Same answers stored as compact rows
+COMPACT_YEAR = 1013
+
+
+class FieldProjectionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(5)
+        for year in (YEAR, COMPACT_YEAR):
+            path = write_survey(year, cls.rows)
+            StackOverflowDataDumper.load_schemas([year])
+            layout = StackOverflowDataDumper.get_layouts([year])[year] if year == COMPACT_YEAR else None
+            BulkLoader.bulk_load_responses(path, year, 10, layout=layout)
+        StackOverflowDataDumper.bump_data_generations([YEAR, COMPACT_YEAR])
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_single_response(self):
+        for year in (YEAR, COMPACT_YEAR):
+            response = self.client.get(f'/response/{year}/2?fields=LanguageWorkedWith,Country').json[0]
+            self.assertEqual(response['responses'], {'LanguageWorkedWith': 'C#;Python', 'Country': 'Malaysia'})
+            self.assertEqual((response['respondent_id'], response['response_year']), (2, year))
+            response_id = response['response_id']
+            self.assertEqual(self.client.get(f'/response/{response_id}?fields=Country').json[0]['responses'],
+                             {'Country': 'Malaysia'})
+
+    def test_pages(self):
+        for year in (YEAR, COMPACT_YEAR):
+            for query in ('size=10', 'size=10&cursor='):
+                page = self.client.get(f'/responses/{year}?{query}&fields=YearsCodePro').json
+                responses = page if isinstance(page, list) else page['responses']
+                self.assertEqual([response['responses'] for response in responses],
+                                 [{'YearsCodePro': row['YearsCodePro']} for row in self.rows])
+
+    def test_unknown_and_repeated_fields(self):
+        response = self.client.get(f'/response/{YEAR}/1?fields=Country,Unknown,Country').json[0]
+        self.assertEqual(response['responses'], {'Country': 'Austria', 'Unknown': None})
+
+    def test_empty_fields_returns_everything(self):
+        self.assertEqual(self.client.get(f'/response/{YEAR}/1?fields=,').json[0]['responses'], self.rows[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+from tests import QUESTIONS, app, load_survey, make_rows, write_survey
+import BulkLoader
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2023
+# Year whose generation is bumped without touching YEAR
+OTHER_YEAR = 1999
+
+
+class GenerationTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.rows = make_rows(12)
+        load_survey(YEAR, self.rows)
+
+    def get_country(self):
+        return self.client.get(f'/response/{YEAR}/1').json[0]['responses']['Country']
+
+    def get_schemas(self):
+        return {schema['year']: schema for schema in self.client.get('/schemas').json}
+
+    def test_cached_bodies_last_until_their_year_is_bumped(self):
+        country = self.get_country()
+        self.rows[0]['Country'] = f'Changed from {country}'
+        path = write_survey(YEAR, self.rows)
+        # Written but not bumped yet, the dumper bumps once everything of the year is written
+        BulkLoader.resumable_load_responses(path, YEAR, 10)
+        self.assertEqual(self.get_country(), country)
+        # Another year's load leaves the cache of this year alone
+        StackOverflowDataDumper.bump_data_generations([OTHER_YEAR])
+        self.assertEqual(self.get_country(), country)
+        StackOverflowDataDumper.bump_data_generations([YEAR])
+        self.assertEqual(self.get_country(), f'Changed from {country}')
+
+    def test_cached_not_found_is_dropped_by_a_load(self):
+        self.assertEqual(self.client.get(f'/response/{YEAR}/13').status_code, 404)
+        self.assertEqual(self.client.get(f'/response/{YEAR}/13').status_code, 404)
+        load_survey(YEAR, self.rows + make_rows(1, 13))
+        self.assertEqual(self.client.get(f'/response/{YEAR}/13').status_code, 200)
+        load_survey(YEAR, self.rows)
+
+    def test_unchanged_files_keep_the_generation(self):
+        body = self.client.get(f'/responses/{YEAR}?size=5')
+        # Nothing loaded, nothing bumped
+        self.assertEqual(load_survey(YEAR, self.rows), [])
+        response = self.client.get(f'/responses/{YEAR}?size=5', headers={'If-None-Match': body.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_reloaded_schema_is_served(self):
+        self.assertNotIn('DevType', self.client.get(f'/schema/{YEAR}').json[0]['response_columns'])
+        self.assertNotIn('DevType', self.get_schemas()[YEAR]['response_columns'])
+        load_survey(YEAR, self.rows, QUESTIONS + ['DevType'])
+        self.assertIn('DevType', self.client.get(f'/schema/{YEAR}').json[0]['response_columns'])
+        self.assertIn('DevType', self.get_schemas()[YEAR]['response_columns'])
+        load_survey(YEAR, self.rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+from tests import DATA_DIR, app, load_survey, make_rows
+from unittest import mock
+import Metrics
+import os
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2021
+
+
+def sample(text, name):
+    # Value of one sample of an exposition text, 0 when it isn't there yet
+    for line in text.splitlines():
+        if line.startswith(f'{name} '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter('test_total', 'Things', ('kind',))
+        counter.inc(('a"b',))
+        counter.inc(('a"b',), 2)
+        self.registry.gauge('test_size', 'Size', function=lambda: {(): 1.5})
+        self.assertEqual(self.registry.render(), '# HELP test_total Things\n# TYPE test_total counter\n'
+                                                 'test_total{kind="a\\"b"} 3\n'
+                                                 '# HELP test_size Size\n# TYPE test_size gauge\ntest_size 1.5\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('test_seconds', 'Time', ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, ('/',))
+        text = self.registry.render()
+        self.assertEqual([sample(text, f'test_seconds_bucket{{route="/",le="{bound}"}}')
+                          for bound in ('0.1', '1', '+Inf')], [2, 3, 4])
+        self.assertEqual(sample(text, 'test_seconds_sum{route="/"}'), 3.65)
+        self.assertEqual(sample(text, 'test_seconds_count{route="/"}'), 4)
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(15)
+        before = sample(StackOverflowDataDumper.metrics.render(), f'pystackoverflow_ingest_rows_total{{year="{YEAR}"}}')
+        load_survey(YEAR, cls.rows)
+        cls.ingested = sample(StackOverflowDataDumper.metrics.render(),
+                              f'pystackoverflow_ingest_rows_total{{year="{YEAR}"}}') - before
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.content_type, Metrics.CONTENT_TYPE)
+        return response.data.decode('utf8')
+
+    def test_routes_queries_and_cache_families(self):
+        route = 'pystackoverflow_request_seconds_count{method="GET",route="/response/<int:year>/<int:respondent_id>",' \
+                'status="200"}'
+        query = 'pystackoverflow_db_query_seconds_count{function="get_response_by_year_respondent_id"}'
+        hits = 'pystackoverflow_cache_requests_total{family="respondent",result="hit"}'
+        misses = 'pystackoverflow_cache_requests_total{family="respondent",result="miss"}'
+        before = self.metrics()
+        self.client.get(f'/response/{YEAR}/2')
+        self.client.get(f'/response/{YEAR}/2')
+        after = self.metrics()
+        self.assertEqual(sample(after, route) - sample(before, route), 2)
+        self.assertEqual(sample(after, query) - sample(before, query), 1)
+        self.assertEqual(sample(after, misses) - sample(before, misses), 1)
+        self.assertEqual(sample(after, hits) - sample(before, hits), 1)
+        self.assertGreater(sample(after, 'pystackoverflow_cache_entries'), 0)
+
+    def test_ingest_metrics_of_the_dumper(self):
+        self.assertEqual(self.ingested, len(self.rows))
+        path = os.path.join(DATA_DIR, 'ingest.prom')
+        StackOverflowDataDumper.metrics.write(path)
+        with mock.patch.object(Metrics, 'INGEST_METRICS_PATH', path):
+            text = self.metrics()
+        self.assertGreaterEqual(sample(text, f'pystackoverflow_ingest_rows_total{{year="{YEAR}"}}'), len(self.rows))
+        self.assertIn(f'pystackoverflow_ingest_commit_seconds_count{{year="{YEAR}"}}', text)
+        with mock.patch.object(Metrics, 'INGEST_METRICS_PATH', os.path.join(DATA_DIR, 'missing.prom')):
+            self.assertNotIn('pystackoverflow_ingest_rows_total', self.metrics())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+from ExampleStackOverflowRest import Response, db
+from sqlalchemy import func
+from tests import make_rows, write_survey
+import BulkLoader
+import threading
+import unittest
+
+# Two files, so batches of both years are in the queue at the same time
+YEARS = (2009, 1009)
+
+
+class PipelinedLoadTest(unittest.TestCase):
+    def tearDown(self):
+        db.session.remove()
+
+    def test_loads_every_file(self):
+        files = [(write_survey(YEARS[0], make_rows(47)), YEARS[0]), (write_survey(YEARS[1], make_rows(31)), YEARS[1])]
+        lock = threading.Lock()
+        batches = []
+
+        def on_batch(year, count, batch_count, write_time):
+            with lock:
+                batches.append((year, batch_count))
+        counts = BulkLoader.pipelined_load_responses(files, workers=2, writers=2, batch_size=10, queue_size=2,
+                                                     on_batch=on_batch)
+        self.assertEqual(counts, {YEARS[0]: 47, YEARS[1]: 31})
+        self.assertEqual(sorted(batches), sorted([(YEARS[0], 10)] * 4 + [(YEARS[0], 7)] + [(YEARS[1], 10)] * 3
+                                                 + [(YEARS[1], 1)]))
+        stored = dict(db.session.query(Response.response_year, func.count(func.distinct(Response.respondent_id)))
+                      .filter(Response.response_year.in_(YEARS)).group_by(Response.response_year).all())
+        self.assertEqual(stored, {YEARS[0]: 47, YEARS[1]: 31})
+
+    def test_parser_failure_fails_the_load(self):
+        with self.assertRaises(RuntimeError):
+            BulkLoader.pipelined_load_responses([(write_survey(YEARS[0], []) + '.missing', YEARS[0])], batch_size=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+from ExampleStackOverflowRest import Response, db
+from tests import app, load_survey, make_rows
+from werkzeug.datastructures import MultiDict
+import PromotedQuestions
+import unittest
+
+YEAR = 2024
+
+
+class ExtractTest(unittest.TestCase):
+    def test_typed_values(self):
+        self.assertEqual(PromotedQuestions.extract({'Country': 'Germany', 'YearsCodePro': 'More than 50 years',
+                                                    'ConvertedComp': '1500.5'}),
+                         {'country': 'Germany', 'years_code_pro': 50, 'converted_comp': 1500.5})
+        self.assertEqual(PromotedQuestions.extract({'Country': 'NA', 'YearsCodePro': 'Less than 1 year'}),
+                         {'country': None, 'years_code_pro': 0, 'converted_comp': None})
+
+    def test_parse_filters(self):
+        filters = PromotedQuestions.parse_filters(MultiDict([('Country', 'Germany'), ('Country', 'Austria'),
+                                                             ('YearsCodePro.gte', '5'), ('size', '10')]))
+        self.assertEqual([(promoted.question, name, value) for promoted, name, value in filters],
+                         [('Country', 'eq', ['Germany', 'Austria']), ('YearsCodePro', 'gte', 5)])
+        with self.assertRaises(ValueError):
+            PromotedQuestions.parse_filters(MultiDict([('ConvertedComp.lt', 'lots')]))
+
+
+class PromotedFilterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = make_rows(40)
+        cls.rows[0]['YearsCodePro'] = 'Less than 1 year'
+        cls.rows[1]['ConvertedComp'] = 'NA'
+        load_survey(YEAR, cls.rows)
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def respondents(self, query_string):
+        response = self.client.get(f'/responses/{YEAR}?size=100&{query_string}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['respondent_id'] for item in response.json)
+
+    def expected(self, match):
+        return [int(row['Respondent']) for row in self.rows if match(row)]
+
+    def test_columns_are_filled_by_the_load(self):
+        response = db.session.query(Response).filter_by(response_year=YEAR, respondent_id=1).one()
+        self.assertEqual((response.country, response.years_code_pro, response.converted_comp), ('Austria', 0, 1000))
+        response = db.session.query(Response).filter_by(response_year=YEAR, respondent_id=2).one()
+        self.assertIsNone(response.converted_comp)
+
+    def test_equality_and_repeats(self):
+        self.assertEqual(self.respondents('Country=Austria'), self.expected(lambda row: row['Country'] == 'Austria'))
+        self.assertEqual(self.respondents('Country=Austria&Country=Germany'),
+                         self.expected(lambda row: row['Country'] in ('Austria', 'Germany')))
+        # Unanswered is NULL, not the text NA
+        self.assertEqual(self.respondents('Country=NA'), [])
+
+    def test_ranges(self):
+        self.assertEqual(self.respondents('YearsCodePro.gte=10&YearsCodePro.lt=20'),
+                         self.expected(lambda row: row['YearsCodePro'].isdigit()
+                                       and 10 <= int(row['YearsCodePro']) < 20))
+        self.assertEqual(self.respondents('YearsCodePro.lte=0'), [1, 30])
+        self.assertEqual(self.respondents('Country=Malaysia&ConvertedComp.gt=20000'),
+                         self.expected(lambda row: row['Country'] == 'Malaysia' and row['ConvertedComp'] != 'NA'
+                                       and float(row['ConvertedComp']) > 20000))
+
+    def test_no_match_is_an_empty_page(self):
+        response = self.client.get(f'/responses/{YEAR}?Country=Narnia')
+        self.assertEqual((response.status_code, response.json), (200, []))
+
+    def test_invalid_value(self):
+        response = self.client.get(f'/responses/{YEAR}?YearsCodePro.gte=many')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('YearsCodePro', response.json['error'])
+
+    def test_cursor_pages(self):
+        expected = self.expected(lambda row: row['Country'] == 'Germany')
+        seen = []
+        response = self.client.get(f'/responses/{YEAR}?Country=Germany&cursor=&size=3&count=true')
+        self.assertEqual(response.json['total'], len(expected))
+        while True:
+            seen.extend(item['respondent_id'] for item in response.json['responses'])
+            if response.json['next'] is None:
+                break
+            response = self.client.get(f'/responses/{YEAR}?Country=Germany&size=3&cursor={response.json["next"]}')
+        self.assertEqual(seen, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+from ExampleStackOverflowRest import db_cache
+from ResponseEncoder import MIN_COMPRESS_SIZE, EncodedBody, encode_json
+from flask import jsonify
+from tests import app, load_survey, make_rows
+import gzip
+import unittest
+
+YEAR = 2004
+
+
+class EncodedBodyTest(unittest.TestCase):
+    def test_small_bodies_are_not_compressed(self):
+        body = EncodedBody(b'x' * (MIN_COMPRESS_SIZE - 1))
+        self.assertIsNone(body.gzipped)
+        self.assertEqual(body.pick({'gzip': 1}), (body.raw, body.etag, None))
+
+    def test_big_bodies_carry_a_gzip_copy(self):
+        body = EncodedBody(b'x' * MIN_COMPRESS_SIZE)
+        self.assertEqual(gzip.decompress(body.gzipped), body.raw)
+        self.assertEqual(body.pick({'gzip': 1}), (body.gzipped, body.gzipped_etag, 'gzip'))
+        self.assertEqual(body.pick({'gzip': 0}), (body.raw, body.etag, None))
+        self.assertNotEqual(body.etag, body.gzipped_etag)
+        self.assertEqual(body.nbytes, len(body.raw) + len(body.gzipped))
+
+    def test_encode_json_matches_jsonify(self):
+        payload = [{'b': 1, 'a': [None, 'ü']}]
+        with app.app_context():
+            self.assertEqual(encode_json(payload).raw, jsonify(payload).get_data())
+            self.assertEqual(encode_json(payload, 404).status, 404)
+
+
+class CachedBodyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        load_survey(YEAR, make_rows(5))
+
+    def test_cache_holds_the_encoded_body(self):
+        client = app.test_client()
+        response = client.get(f'/response/{YEAR}/1')
+        body = db_cache.get(f'/response/{YEAR}/1?')
+        self.assertIsInstance(body, EncodedBody)
+        self.assertEqual(body.raw, response.data)
+        hits = db_cache.get_stats(with_entries=False)['hits']
+        self.assertEqual(client.get(f'/response/{YEAR}/1').data, response.data)
+        self.assertEqual(db_cache.get_stats(with_entries=False)['hits'], hits + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from ExampleStackOverflowRest import Response, db
+from tests import make_rows, write_survey
+from unittest import mock
+import BulkLoader
+import StackOverflowDataDumper
+import unittest
+
+YEAR = 2011
+RESPONDENTS = 35
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(batches):
+    # on_batch callback failing once the given amount of batches is committed, like a killed dumper
+    def on_batch(count, batch_count, write_time):
+        on_batch.batches += 1
+        if on_batch.batches >= batches:
+            raise Interrupted()
+    on_batch.batches = 0
+    return on_batch
+
+
+def count_rows():
+    return db.session.query(Response).filter_by(response_year=YEAR).count()
+
+
+class ResumableLoadTest(unittest.TestCase):
+    def setUp(self):
+        # Every test starts from a year that was never loaded
+        with db.engine.begin() as connection:
+            connection.execute(BulkLoader.checkpoint_table.delete().where(BulkLoader.checkpoint_table.c.year == YEAR))
+            connection.execute(Response.__table__.delete().where(Response.response_year == YEAR))
+        self.rows = make_rows(RESPONDENTS)
+        self.path = write_survey(YEAR, self.rows)
+        StackOverflowDataDumper.load_schemas([YEAR])
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_resume_interrupted_load_then_skip_then_reload(self):
+        with self.assertRaises(Interrupted):
+            BulkLoader.resumable_load_responses(self.path, YEAR, 10, interrupt_after(2))
+        self.assertEqual(count_rows(), 20)
+
+        # Picks up after the last committed batch
+        loaded, status = BulkLoader.resumable_load_responses(self.path, YEAR, 10)
+        self.assertEqual((loaded, status), (RESPONDENTS - 20, 'resumed'))
+        self.assertEqual(count_rows(), RESPONDENTS)
+
+        # Unchanged file
+        self.assertEqual(BulkLoader.resumable_load_responses(self.path, YEAR, 10), (0, 'skipped'))
+
+        # Changed file, loaded again from the start and upserted over the existing rows
+        self.rows[0]['Country'] = 'Narnia'
+        write_survey(YEAR, self.rows)
+        loaded, status = BulkLoader.resumable_load_responses(self.path, YEAR, 10)
+        self.assertEqual((loaded, status), (RESPONDENTS, 'loaded'))
+        self.assertEqual(count_rows(), RESPONDENTS)
+        response = db.session.query(Response).filter_by(response_year=YEAR, respondent_id=1).one()
+        self.assertEqual(response.responses['Country'], 'Narnia')
+        self.assertEqual(response.country, 'Narnia')
+
+    def test_skipped_years_are_not_reported_as_loaded(self):
+        BulkLoader.resumable_load_responses(self.path, YEAR, 10)
+        self.assertEqual(StackOverflowDataDumper.resumable_load_responses([YEAR], 10, {}), (0, []))
+        self.rows[1]['Country'] = 'Atlantis'
+        write_survey(YEAR, self.rows)
+        self.assertEqual(StackOverflowDataDumper.resumable_load_responses([YEAR], 10, {}), (RESPONDENTS, [YEAR]))
+
+    def test_changed_file_replaces_the_rows_of_the_year(self):
+        BulkLoader.resumable_load_responses(self.path, YEAR, 10)
+        write_survey(YEAR, self.rows[5:])
+        self.assertEqual(BulkLoader.resumable_load_responses(self.path, YEAR, 10), (RESPONDENTS - 5, 'loaded'))
+        respondents = [respondent for respondent, in db.session.query(Response.respondent_id)
+                       .filter_by(response_year=YEAR).order_by(Response.respondent_id)]
+        self.assertEqual(respondents, list(range(6, RESPONDENTS + 1)))
+
+    def run_dumper(self, *args):
+        with mock.patch.object(StackOverflowDataDumper, 'YEARS', [YEAR]), \
+                mock.patch('sys.argv', ['StackOverflowDataDumper.py', '--skip-stats', *args]):
+            StackOverflowDataDumper.main()
+
+    def test_only_resumable_loads_run_on_loaded_years(self):
+        self.run_dumper()
+        self.assertEqual(count_rows(), RESPONDENTS)
+        for args in ((), ('--bulk',), ('--bulk', '--workers', '1')):
+            with self.assertRaises(SystemExit):
+                self.run_dumper(*args)
+        self.assertEqual(count_rows(), RESPONDENTS)
+        write_survey(YEAR, self.rows[:10])
+        self.run_dumper('--bulk', '--resume')
+        self.assertEqual(count_rows(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
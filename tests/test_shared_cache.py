@@ -0,0 +1,79 @@
+from CacheEngine import MISSING, StripedLFUCache
+from SharedCache import SQLiteCache, TieredCache
+from tests import DATA_DIR
+from unittest import mock
+import os
+import pickle
+import unittest
+
+
+class SharedCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(DATA_DIR, f'{self.id()}.sqlite')
+        self.addCleanup(lambda: [os.remove(f'{self.path}{suffix}') for suffix in ('', '-wal', '-shm')
+                                 if os.path.exists(f'{self.path}{suffix}')])
+        self.now = 1000000.0
+        self.clock = 0.0
+        for name, value in (('time', lambda: self.now), ('monotonic', lambda: self.clock)):
+            patcher = mock.patch(f'SharedCache.time.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class SQLiteCacheTest(SharedCacheTestCase):
+    def test_entries_are_shared_between_instances(self):
+        SQLiteCache(self.path).insert('key', {'a': [1, 2]})
+        other = SQLiteCache(self.path)
+        self.assertEqual(other.get('key'), {'a': [1, 2]})
+        self.assertIs(other.get('unknown', MISSING), MISSING)
+        self.assertEqual(other.get_stats()['hits'], 1)
+
+    def test_least_recently_used_entries_go_past_max_bytes(self):
+        size = len(pickle.dumps('x' * 100, pickle.HIGHEST_PROTOCOL))
+        cache = SQLiteCache(self.path, max_bytes=size * 3)
+        for number in range(3):
+            self.now += 100
+            cache.insert(number, 'x' * 100)
+        # Touched, so 1 is the least recently used now
+        self.now += 100
+        cache.get(0)
+        self.now += 100
+        cache.insert(3, 'x' * 100)
+        self.assertEqual([cache.check(number) for number in range(4)], [True, False, True, True])
+        self.assertEqual(cache.get_stats()['bytes'], size * 3)
+
+    def test_inserts_sweep_expired_entries(self):
+        size = len(pickle.dumps('x' * 100, pickle.HIGHEST_PROTOCOL))
+        cache = SQLiteCache(self.path, max_bytes=size * 3, ttl=10, sweep_interval=60)
+        cache.insert('expiring', 'x' * 100)
+        cache.insert('live', 'x' * 100, ttl=1000)
+        self.now += 10
+        self.assertIs(cache.get('expiring', MISSING), MISSING)
+        self.assertEqual(cache.get_stats()['entries'], 2)
+        # Past the sweep interval, the expired entry goes instead of a live one
+        self.clock += 60
+        cache.insert('new', 'x' * 100)
+        cache.insert('newer', 'x' * 100)
+        self.assertTrue(cache.check('live') and cache.check('new') and cache.check('newer'))
+        self.assertEqual(cache.get_stats()['entries'], 3)
+
+
+class TieredCacheTest(SharedCacheTestCase):
+    def test_l2_hits_are_copied_into_l1_without_counting_a_miss(self):
+        SQLiteCache(self.path).insert('key', 'value')
+        cache = TieredCache(StripedLFUCache(size=10, segments=2), SQLiteCache(self.path))
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertTrue(cache.l1.check('key'))
+        self.assertEqual(cache.get('key'), 'value')
+        stats = cache.get_stats(with_entries=False)
+        self.assertEqual((stats['hits'], stats['misses'], stats['l2']['hits']), (1, 0, 1))
+
+    def test_inserts_go_to_both_tiers(self):
+        cache = TieredCache(StripedLFUCache(size=10, segments=2), SQLiteCache(self.path))
+        cache.insert('key', 'value')
+        self.assertEqual(SQLiteCache(self.path).get('key'), 'value')
+        self.assertEqual(cache.get_stats(with_entries=False)['misses'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
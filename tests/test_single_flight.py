@@ -0,0 +1,97 @@
+from CacheEngine import AsyncSingleFlight, SingleFlight
+import asyncio
+import threading
+import unittest
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self, result):
+        def run():
+            self.calls += 1
+            self.release.wait(5)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return run
+
+    def run_callers(self, count, func):
+        results = []
+
+        def call():
+            try:
+                results.append(self.flight.do('key', func))
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        # Every caller is either running the call or waiting for it before it's released
+        while self.flight.get_stats()['executed'] + self.flight.get_stats()['coalesced'] < count:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_callers_share_one_call(self):
+        result = object()
+        results = self.run_callers(8, self.slow(result))
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(item is result for item in results))
+        self.assertEqual(self.flight.get_stats(), {'executed': 1, 'coalesced': 7, 'in_flight': 0})
+
+    def test_concurrent_callers_share_the_error(self):
+        error = ValueError('query failed')
+        results = self.run_callers(4, self.slow(error))
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(item is error for item in results))
+
+    def test_finished_calls_run_again(self):
+        self.release.set()
+        self.flight.do('key', self.slow(1))
+        self.flight.do('key', self.slow(2))
+        self.assertEqual(self.calls, 2)
+
+    def test_keys_do_not_wait_on_each_other(self):
+        self.release.set()
+        self.assertEqual([self.flight.do(key, self.slow(key)) for key in ('a', 'b')], ['a', 'b'])
+
+
+class AsyncSingleFlightTest(unittest.TestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def query():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def main():
+            return await asyncio.gather(*(flight.do('key', query) for _ in range(5)))
+        self.assertEqual(asyncio.run(main()), [1] * 5)
+        self.assertEqual(flight.get_stats(), {'executed': 1, 'coalesced': 4, 'in_flight': 0})
+
+    def test_cancelled_caller_does_not_cancel_the_others(self):
+        flight = AsyncSingleFlight()
+
+        async def query():
+            await asyncio.sleep(0.01)
+            return 'done'
+
+        async def main():
+            first = asyncio.ensure_future(flight.do('key', query))
+            second = asyncio.ensure_future(flight.do('key', query))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+        self.assertEqual(asyncio.run(main()), 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()